@@ -26,7 +26,9 @@ from __future__ import print_function
 import os
 import sys
 import re
+import signal
 import subprocess
+import threading
 import traceback
 
 import azurelinuxagent.common.logger as logger
@@ -39,6 +41,8 @@ from azurelinuxagent.common.version import AGENT_NAME, AGENT_LONG_VERSION, \
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.utils import fileutil
 
+AGENT_LOG_FILE = "/var/log/waagent.log"
+
 class Agent(object):
     def __init__(self, verbose, conf_file_path=None):
         """
@@ -60,8 +64,8 @@ class Agent(object):
         #Init log
         verbose = verbose or conf.get_logs_verbose()
         level = logger.LogLevel.VERBOSE if verbose else logger.LogLevel.INFO
-        logger.add_logger_appender(logger.AppenderType.FILE, level,
-                                 path="/var/log/waagent.log")
+        logger.add_logger_appender(logger.AppenderType.ASYNC_FILE, level,
+                                 path=AGENT_LOG_FILE)
         logger.add_logger_appender(logger.AppenderType.CONSOLE, level,
                                  path="/dev/console")
         # See issue #1035
@@ -91,6 +95,7 @@ class Agent(object):
         Run agent daemon
         """
         logger.set_prefix("Daemon")
+        self.install_profiler("daemon")
         child_args = None \
             if self.conf_file_path is None \
                 else "-configuration-path:{0}".format(self.conf_file_path)
@@ -131,10 +136,92 @@ class Agent(object):
         Run the update and extension handler
         """
         logger.set_prefix("ExtHandler")
+        self.start_log_rotation()
+        self.start_metrics_dump()
+        self.start_metrics_endpoint()
+        self.install_profiler("run-exthandlers")
         from azurelinuxagent.ga.update import get_update_handler
         update_handler = get_update_handler()
         update_handler.run()
 
+    def start_log_rotation(self):
+        """
+        Rotate the agent and extension logs from the (long-lived) extension
+        handler process
+        """
+        if not conf.get_logs_rotation_enabled():
+            return
+        from azurelinuxagent.common.resourcebudget import get_resource_budget, TaskPriority
+        rotator = logger.LogRotator(conf.get_logs_rotation_max_size(),
+                                    conf.get_logs_rotation_max_age(),
+                                    conf.get_logs_max_total_size(),
+                                    can_compress=lambda: get_resource_budget().should_run("log compression",
+                                                                                          TaskPriority.LOW))
+        rotator.add_file(AGENT_LOG_FILE)
+        rotator.add_directory(conf.get_ext_log_dir())
+        rotator.start()
+
+    def start_metrics_dump(self):
+        """
+        Write the metrics of the extension handler process to the lib dir on SIGUSR1
+        """
+        from azurelinuxagent.common import metrics
+        path = os.path.join(conf.get_lib_dir(), metrics.METRICS_DUMP_FILE_NAME)
+
+        def dump(signum, frame):
+            # the signal may interrupt a thread holding the lock of a metric; write from another thread
+            thread = threading.Thread(target=metrics.dump, args=(path,))
+            thread.setDaemon(True)
+            thread.start()
+
+        signal.signal(signal.SIGUSR1, dump)
+        # restart the system calls the signal interrupts (on Python 2 they would fail with EINTR)
+        signal.siginterrupt(signal.SIGUSR1, False)
+
+    def start_metrics_endpoint(self):
+        """
+        Serve the metrics of the extension handler process, queried by -metrics
+        """
+        if not conf.get_metrics_endpoint_enabled():
+            return
+        from azurelinuxagent.common.metricsendpoint import MetricsEndpoint, get_metrics_socket_path
+        try:
+            MetricsEndpoint(get_metrics_socket_path()).start()
+        except Exception as e:
+            logger.warn("Failed to start the metrics endpoint: {0}", e)
+
+    def show_metrics(self):
+        from azurelinuxagent.common.metricsendpoint import query_metrics, get_metrics_socket_path
+        path = get_metrics_socket_path()
+        try:
+            print(query_metrics(path), end="")
+        except Exception as e:
+            print("Error: Cannot query the metrics on {0} (is Metrics.EnableEndpoint set?): {1}".format(path, e),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    def install_profiler(self, command):
+        """
+        Toggle the sampling profiler of this process on SIGUSR2, sent by -profile
+        """
+        from azurelinuxagent.common.profiler import install_profiler
+        try:
+            install_profiler(command)
+        except Exception as e:
+            logger.warn("Failed to install the sampling profiler: {0}", e)
+
+    def toggle_profilers(self):
+        from azurelinuxagent.common.profiler import get_profiled_pids
+        pids = get_profiled_pids()
+        if len(pids) == 0:
+            print("Error: No running agent process has the profiler installed", file=sys.stderr)
+            sys.exit(1)
+            return
+        for name, pid in pids:
+            os.kill(pid, signal.SIGUSR2)
+            print("Toggled the profiler of the {0} process ({1}); profiles are written to {2}".format(
+                name, pid, conf.get_lib_dir()))
+
     def show_configuration(self):
         configuration = conf.get_configuration()
         for k in sorted(configuration.keys()):
@@ -171,6 +258,10 @@ def main(args=[]):
                 agent.run_exthandlers()
             elif command == "show-configuration":
                 agent.show_configuration()
+            elif command == "metrics":
+                agent.show_metrics()
+            elif command == "profile":
+                agent.toggle_profilers()
         except Exception:
             logger.error(u"Failed to run '{0}': {1}",
                          command,
@@ -214,6 +305,10 @@ def parse_args(sys_args):
             force = True
         elif re.match("^([-/]*)show-configuration", a):
             cmd = "show-configuration"
+        elif re.match("^([-/]*)metrics", a):
+            cmd = "metrics"
+        elif re.match("^([-/]*)profile", a):
+            cmd = "profile"
         elif re.match("^([-/]*)(help|usage|\\?)", a):
             cmd = "help"
         else:
@@ -241,7 +336,7 @@ def usage():
     s += ("usage: {0} [-verbose] [-force] [-help] "
            "-configuration-path:<path to configuration file>"
            "-deprovision[+user]|-register-service|-version|-daemon|-start|"
-           "-run-exthandlers|-show-configuration]"
+           "-run-exthandlers|-show-configuration|-metrics|-profile]"
            "").format(sys.argv[0])
     s += "\n"
     return s
@@ -24,6 +24,7 @@ from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.osutil.default import BASE_CGROUPS
 from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.metricsource import metric_sources, parse_proc_stat_cpu_times, PROC_STAT
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
 
@@ -31,8 +32,107 @@ WRAPPER_CGROUP_NAME = "Agent+Extensions"
 METRIC_HIERARCHIES = ['cpu', 'memory']
 MEMORY_DEFAULT = -1
 
+# cgroup v1 (one hierarchy per controller) and v2 (unified hierarchy)
+CGROUP_V1 = 1
+CGROUP_V2 = 2
+# Controllers of the unified hierarchy enabled for the agent and extension cgroups; io is optional
+V2_CONTROLLERS = ['cpu', 'memory', 'io']
+# Resources for which the kernel reports pressure stall information (<resource>.pressure)
+PRESSURE_RESOURCES = {'cpu': 'CPU', 'memory': 'Memory', 'io': 'IO'}
+
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+PROC_PRESSURE = "/proc/pressure"
+PROC_MEMINFO = "/proc/meminfo"
+
+# System load, as classified by SystemLoad
+LOAD_HIGH = "high"
+LOAD_LOW = "low"
+
+# Thresholds above which the system is under pressure (LOAD_HIGH) and below which it is idle (LOAD_LOW): the percent
+# of time some task stalled on the resource over the last 10s (PSI) or, on kernels without PSI, the percent of CPU
+# time not idle and the percent of memory available
+CPU_PRESSURE_THRESHOLDS = (10.0, 1.0)
+MEMORY_PRESSURE_THRESHOLDS = (5.0, 0.5)
+CPU_BUSY_THRESHOLDS = (90.0, 50.0)
+MEMORY_AVAILABLE_THRESHOLDS = (10.0, 25.0)
+
 re_user_system_times = re.compile('user (\d+)\nsystem (\d+)\n')
 
+
+def _get_user_hz():
+    try:
+        return os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+    except (ValueError, KeyError, OSError):
+        return 100
+
+
+USER_HZ = _get_user_hz()
+
+
+def parse_flat_keyed(contents):
+    """
+    Parse a flat keyed cgroup file (e.g. cpu.stat, memory.stat): one "key value" pair per line
+
+    :rtype: dict(str: int)
+    """
+    result = {}
+    for line in contents.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            try:
+                result[fields[0]] = int(fields[1])
+            except ValueError:
+                continue
+    return result
+
+
+def parse_nested_keyed(contents):
+    """
+    Parse a nested keyed cgroup file (e.g. io.stat, cpu.pressure): one "key subkey=value ..." entry per line
+
+    :rtype: dict(str: dict(str: float))
+    """
+    result = {}
+    for line in contents.splitlines():
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        values = {}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            try:
+                values[key] = float(value)
+            except ValueError:
+                continue
+        result[fields[0]] = values
+    return result
+
+
+def get_cgroup_version(mountinfo):
+    """
+    Determine which cgroup hierarchy holds the cpu and memory controllers, from the contents of
+    /proc/self/mountinfo. On hybrid systems (v1 controllers plus an empty unified hierarchy) that is v1.
+
+    :return: (CGROUP_V1, None) or (CGROUP_V2, mount point of the unified hierarchy)
+    """
+    v1_controllers = set()
+    v2_mount_points = []
+    for line in mountinfo.splitlines():
+        # <id> <parent> <major:minor> <root> <mount point> <options> [optional fields] - <type> <source> <super options>
+        mount_fields, _, fs_fields = line.partition(" - ")
+        mount_fields = mount_fields.split()
+        fs_fields = fs_fields.split()
+        if len(mount_fields) < 5 or len(fs_fields) < 1:
+            continue
+        if fs_fields[0] == "cgroup" and len(fs_fields) >= 3:
+            v1_controllers.update(fs_fields[2].split(','))
+        elif fs_fields[0] == "cgroup2":
+            v2_mount_points.append(mount_fields[4])
+
+    if all(h in v1_controllers for h in METRIC_HIERARCHIES) or len(v2_mount_points) == 0:
+        return CGROUP_V1, None
+    return CGROUP_V2, BASE_CGROUPS if BASE_CGROUPS in v2_mount_points else v2_mount_points[0]
+
 related_services = {
     "Microsoft.OSTCExtensions.LinuxDiagnostic":    ["omid", "omsagent-LAD", "mdsd-lde"],
     "Microsoft.Azure.Diagnostics.LinuxDiagnostic": ["omid", "omsagent-LAD", "mdsd-lde"],
@@ -82,12 +182,17 @@ class Cpu(object):
         """
         cpu_total = 0
         try:
-            cpu_stat = self.cgt.cgroup.\
-                get_file_contents('cpu', 'cpuacct.stat')
-            if cpu_stat is not None:
-                m = re_user_system_times.match(cpu_stat)
-                if m:
-                    cpu_total = int(m.groups()[0]) + int(m.groups()[1])
+            if CGroups.is_cgroup_v2():
+                # cpu.stat reports microseconds
+                cpu_stat = parse_flat_keyed(self.cgt.cgroup.get_file_contents('cpu', 'cpu.stat'))
+                cpu_total = float(cpu_stat.get('usage_usec', 0)) * USER_HZ / 1000000
+            else:
+                cpu_stat = self.cgt.cgroup.\
+                    get_file_contents('cpu', 'cpuacct.stat')
+                if cpu_stat is not None:
+                    m = re_user_system_times.match(cpu_stat)
+                    if m:
+                        cpu_total = int(m.groups()[0]) + int(m.groups()[1])
         except CGroupsException:
             # There are valid reasons for file contents to be unavailable; for example, if an extension
             # has not yet started (or has stopped) an associated service on a VM using systemd, the cgroup for
@@ -96,15 +201,19 @@ class Cpu(object):
             pass
         return cpu_total
 
-    def update(self):
+    def update(self, system_cpu=None):
         """
         Update all raw data required to compute metrics of interest. The intent is to call update() once, then
         call the various get_*() methods which use this data, which we've collected exactly once.
+
+        :param int system_cpu: CPU ticks since boot, if already read in this sampling pass
         """
         self.previous_cpu_total = self.current_cpu_total
         self.previous_system_cpu = self.current_system_cpu
         self.current_cpu_total = self.get_current_cpu_total()
-        self.current_system_cpu = self.osutil.get_total_cpu_ticks_since_boot()
+        if system_cpu is None:
+            system_cpu = self.osutil.get_total_cpu_ticks_since_boot()
+        self.current_system_cpu = system_cpu
 
     def get_cpu_percent(self):
         """
@@ -119,13 +228,14 @@ class Cpu(object):
 
         return round(float(cpu_delta * self.cgt.cpu_count * 100) / float(system_delta), 3)
 
-    def collect(self):
+    def collect(self, system_cpu=None):
         """
         Collect and return a list of all cpu metrics. If no metrics are collected, return an empty list.
 
+        :param int system_cpu: CPU ticks since boot, if already read in this sampling pass
         :rtype: [(str, str, float)]
         """
-        self.update()
+        self.update(system_cpu)
         usage = self.get_cpu_percent()
         return [("Process", "% Processor Time", usage)]
 
@@ -142,16 +252,28 @@ class Memory(object):
 
     def get_memory_usage(self):
         """
-        Collect memory.usage_in_bytes from the cgroup.
+        Collect memory.usage_in_bytes (memory.current on cgroup v2) from the cgroup.
 
         :return: Memory usage in bytes
         :rtype: int
         """
-        usage = self.cgt.cgroup.get_parameter('memory', 'memory.usage_in_bytes')
+        usage_file = 'memory.current' if CGroups.is_cgroup_v2() else 'memory.usage_in_bytes'
+        usage = self.cgt.cgroup.get_parameter('memory', usage_file)
         if not usage:
             usage = "0"
         return int(usage)
 
+    def get_memory_stat(self):
+        """
+        Collect memory.stat from the cgroup; an empty dictionary if it is not available
+
+        :rtype: dict(str: int)
+        """
+        try:
+            return parse_flat_keyed(self.cgt.cgroup.get_file_contents('memory', 'memory.stat'))
+        except CGroupsException:
+            return {}
+
     def collect(self):
         """
         Collect and return a list of all memory metrics
@@ -159,7 +281,125 @@ class Memory(object):
         :rtype: [(str, str, float)]
         """
         usage = self.get_memory_usage()
-        return [("Memory", "Total Memory Usage", usage)]
+        metrics = [("Memory", "Total Memory Usage", usage)]
+        if CGroups.is_cgroup_v2():
+            memory_stat = self.get_memory_stat()
+            if 'anon' in memory_stat:
+                metrics.append(("Memory", "Anonymous Memory", memory_stat['anon']))
+            if 'file' in memory_stat:
+                metrics.append(("Memory", "Page Cache", memory_stat['file']))
+        return metrics
+
+
+class IO(object):
+    def __init__(self, cgt):
+        """
+        Initialize data collection for the io controller (cgroup v2 only). The metrics are the bytes and operations
+        since the previous collect(); the first collect() reports the totals since the cgroup was created.
+
+        :param CGroupsTelemetry cgt: The telemetry object for which io metrics should be collected
+        """
+        self.cgt = cgt
+        self.previous_totals = {}
+
+    def get_io_totals(self):
+        """
+        Sum io.stat over all devices
+
+        :return: Total bytes and operations read and written, keyed by rbytes, wbytes, rios and wios
+        :rtype: dict(str: float)
+        """
+        totals = {'rbytes': 0, 'wbytes': 0, 'rios': 0, 'wios': 0}
+        try:
+            io_stat = parse_nested_keyed(self.cgt.cgroup.get_file_contents('io', 'io.stat'))
+        except CGroupsException:
+            return totals
+        for device_stat in io_stat.values():
+            for key in totals:
+                totals[key] += device_stat.get(key, 0)
+        return totals
+
+    def collect(self):
+        """
+        Collect and return a list of all io metrics
+
+        :rtype: [(str, str, float)]
+        """
+        totals = self.get_io_totals()
+        deltas = dict((k, max(0, v - self.previous_totals.get(k, 0))) for k, v in totals.items())
+        self.previous_totals = totals
+        return [("IO", "Bytes Read", deltas['rbytes']),
+                ("IO", "Bytes Written", deltas['wbytes']),
+                ("IO", "Read Operations", deltas['rios']),
+                ("IO", "Write Operations", deltas['wios'])]
+
+
+class Pressure(object):
+    def __init__(self, cgt):
+        """
+        Initialize data collection for the pressure stall information of the cgroup (cgroup v2, kernel 4.20+).
+        The metrics are the percentage of time some (or all, "full") tasks of the cgroup were stalled on each resource
+        since the previous collect(), computed from the cumulative stall time in the <resource>.pressure files.
+
+        :param CGroupsTelemetry cgt: The telemetry object for which pressure metrics should be collected
+        """
+        self.cgt = cgt
+        self.previous_totals = {}
+        self.previous_time = None
+        self.current_totals = self.get_stall_totals()
+        self.current_time = time.time()
+
+    def get_stall_totals(self):
+        """
+        :return: Cumulative stall time (microseconds), keyed by (resource, "some"/"full")
+        :rtype: dict((str, str): float)
+        """
+        totals = {}
+        for resource in PRESSURE_RESOURCES:
+            if resource not in self.cgt.cgroup.cgroups:
+                continue
+            try:
+                pressure = parse_nested_keyed(
+                    self.cgt.cgroup.get_file_contents(resource, '{0}.pressure'.format(resource)))
+            except CGroupsException:
+                continue
+            for kind, values in pressure.items():
+                if 'total' in values:
+                    totals[(resource, kind)] = values['total']
+        return totals
+
+    def update(self):
+        self.previous_totals = self.current_totals
+        self.previous_time = self.current_time
+        self.current_totals = self.get_stall_totals()
+        self.current_time = time.time()
+
+    def get_pressure_percent(self, resource, kind="some"):
+        """
+        Percent of the wall time between the last two updates during which tasks were stalled on the resource,
+        or None if it is not available
+        """
+        key = (resource, kind)
+        if key not in self.current_totals or key not in self.previous_totals:
+            return None
+        elapsed_usec = max(1.0, (self.current_time - self.previous_time) * 1000000)
+        stalled_usec = max(0, self.current_totals[key] - self.previous_totals[key])
+        return round(min(100.0, 100.0 * stalled_usec / elapsed_usec), 3)
+
+    def collect(self):
+        """
+        Collect and return a list of all pressure metrics
+
+        :rtype: [(str, str, float)]
+        """
+        self.update()
+        metrics = []
+        for resource, kind in sorted(self.current_totals.keys()):
+            percent = self.get_pressure_percent(resource, kind)
+            if percent is not None:
+                name = "{0} {1}".format(PRESSURE_RESOURCES[resource], kind.capitalize())
+                metrics.append(("Pressure", name, percent))
+        return metrics
 
 
 class CGroupsTelemetry(object):
@@ -175,6 +415,7 @@ class CGroupsTelemetry(object):
     }
     _hierarchies = list(_metrics.keys())
     tracked_names = set()
+    _extensions = set()
 
     @staticmethod
     def metrics_hierarchies():
@@ -223,6 +464,7 @@ class CGroupsTelemetry(object):
             cgroup = CGroups.for_extension(name) if cgroup is None else cgroup
             logger.info("Now tracking cgroup {0}".format(name))
             CGroupsTelemetry.track_cgroup(cgroup)
+        CGroupsTelemetry._extensions.add(name)
         if CGroups.is_systemd_manager():
             if name in related_services:
                 for service_name in related_services[name]:
@@ -245,6 +487,13 @@ class CGroupsTelemetry(object):
     def is_tracked(name):
         return name in CGroupsTelemetry._tracked
 
+    @staticmethod
+    def tracked_extensions():
+        """
+        Return the names of the extensions tracked (through track_extension), sorted
+        """
+        return sorted(n for n in CGroupsTelemetry._extensions if n in CGroupsTelemetry._tracked)
+
     @staticmethod
     def stop_tracking(name):
         """
@@ -254,7 +503,10 @@ class CGroupsTelemetry(object):
         :param str name: Extension to be dropped from tracking
         """
         if CGroupsTelemetry.is_tracked(name):
-            del (CGroupsTelemetry._tracked[name])
+            tracker = CGroupsTelemetry._tracked.pop(name)
+            CGroupsTelemetry._extensions.discard(name)
+            for path in set(tracker.cgroup.cgroups.values()):
+                metric_sources.close_tree(path)
 
     @staticmethod
     def collect_all_tracked():
@@ -268,9 +520,14 @@ class CGroupsTelemetry(object):
         :rtype: dict(str: [(str, str, float)])
         """
         results = {}
-        for cgroup_name, collector in CGroupsTelemetry._tracked.copy().items():
+        tracked = CGroupsTelemetry._tracked.copy()
+        if len(tracked) == 0:
+            return results
+        # /proc/stat is read once per pass, rather than once per tracked cgroup
+        system_cpu = get_osutil().get_total_cpu_ticks_since_boot()
+        for cgroup_name, collector in tracked.items():
             cgroup_name = cgroup_name if cgroup_name else WRAPPER_CGROUP_NAME
-            results[cgroup_name] = collector.collect()
+            results[cgroup_name] = collector.collect(system_cpu)
         return results
 
     @staticmethod
@@ -323,16 +580,25 @@ class CGroupsTelemetry(object):
         if CGroups.enabled():
             for hierarchy in CGroupsTelemetry.metrics_hierarchies():
                 self.data[hierarchy] = CGroupsTelemetry._metrics[hierarchy](self)
+            if CGroups.is_cgroup_v2():
+                if 'io' in self.cgroup.cgroups:
+                    self.data['io'] = IO(self)
+                self.data['pressure'] = Pressure(self)
 
-    def collect(self):
+    def collect(self, system_cpu=None):
         """
         Return a list of collected metrics. Each element is a tuple of
         (metric group name, metric name, metric value)
+
+        :param int system_cpu: CPU ticks since boot, if already read in this sampling pass
         :return: [(str, str, float)]
         """
         results = []
-        for collector in self.data.values():
-            results.extend(collector.collect())
+        for hierarchy, collector in self.data.items():
+            if hierarchy == 'cpu':
+                results.extend(collector.collect(system_cpu))
+            else:
+                results.extend(collector.collect())
         return results
 
 
@@ -346,14 +612,72 @@ class CGroups(object):
     _hierarchies = CGroupsTelemetry.metrics_hierarchies()
     _use_systemd = None     # Tri-state: None (i.e. "unknown"), True, False
     _osutil = get_osutil()
+    _version = None         # CGROUP_V1 or CGROUP_V2, determined from /proc/self/mountinfo on first use
+    _v2_root = None         # Mount point of the unified hierarchy (cgroup v2)
+
+    @staticmethod
+    def get_version():
+        """
+        Return CGROUP_V2 if the cpu and memory controllers are only available in the unified hierarchy, CGROUP_V1
+        otherwise (including when mountinfo cannot be read).
+        """
+        if CGroups._version is None:
+            try:
+                CGroups._version, CGroups._v2_root = get_cgroup_version(fileutil.read_file(MOUNTINFO_PATH))
+            except (IOError, OSError) as e:
+                logger.warn("Could not read {0}, assuming cgroup v1: {1}".format(MOUNTINFO_PATH, ustr(e)))
+                CGroups._version, CGroups._v2_root = CGROUP_V1, None
+            if CGroups._version == CGROUP_V2:
+                logger.info("Using the cgroup v2 (unified) hierarchy at {0}".format(CGroups._v2_root))
+        return CGroups._version
+
+    @staticmethod
+    def is_cgroup_v2():
+        return CGroups.get_version() == CGROUP_V2
+
+    @staticmethod
+    def _get_hierarchy_root(hierarchy):
+        """
+        Root of the hierarchy for the given controller: its own mount point on cgroup v1, the unified hierarchy
+        on cgroup v2
+        """
+        if CGroups.is_cgroup_v2():
+            return CGroups._v2_root
+        return os.path.join(BASE_CGROUPS, hierarchy)
+
+    @staticmethod
+    def get_v2_controllers(path=None):
+        """
+        Return the controllers available in a cgroup of the unified hierarchy (the root cgroup by default)
+        """
+        path = CGroups._v2_root if path is None else path
+        try:
+            return fileutil.read_file(os.path.join(path, 'cgroup.controllers')).split()
+        except (IOError, OSError):
+            return []
+
+    @staticmethod
+    def _enable_v2_controllers(path):
+        """
+        Enable the controllers of interest for the children of a cgroup of the unified hierarchy; controllers that
+        cannot be enabled are logged and skipped.
+        """
+        available = CGroups.get_v2_controllers(path)
+        for controller in V2_CONTROLLERS:
+            if controller not in available:
+                continue
+            try:
+                fileutil.append_file(os.path.join(path, 'cgroup.subtree_control'), "+{0}".format(controller))
+            except (IOError, OSError) as e:
+                logger.warn("Could not enable the {0} controller in {1}: {2}".format(controller, path, ustr(e)))
 
     @staticmethod
     def _construct_custom_path_for_hierarchy(hierarchy, cgroup_name):
-        return os.path.join(BASE_CGROUPS, hierarchy, AGENT_NAME, cgroup_name).rstrip(os.path.sep)
+        return os.path.join(CGroups._get_hierarchy_root(hierarchy), AGENT_NAME, cgroup_name).rstrip(os.path.sep)
 
     @staticmethod
     def _construct_systemd_path_for_hierarchy(hierarchy, cgroup_name):
-        return os.path.join(BASE_CGROUPS, hierarchy, 'system.slice', cgroup_name).rstrip(os.path.sep)
+        return os.path.join(CGroups._get_hierarchy_root(hierarchy), 'system.slice', cgroup_name).rstrip(os.path.sep)
 
     @staticmethod
     def for_extension(name):
@@ -394,8 +718,14 @@ class CGroups(object):
         if not self.enabled():
             return
 
-        system_hierarchies = os.listdir(BASE_CGROUPS)
-        for hierarchy in CGroups._hierarchies:
+        hierarchies = list(CGroups._hierarchies)
+        if CGroups.is_cgroup_v2():
+            system_hierarchies = CGroups.get_v2_controllers()
+            hierarchies.extend(h for h in V2_CONTROLLERS if h not in hierarchies and h in system_hierarchies)
+        else:
+            system_hierarchies = os.listdir(BASE_CGROUPS)
+
+        for hierarchy in hierarchies:
             if hierarchy not in system_hierarchies:
                 self.disable()
                 raise CGroupsException("Hierarchy {0} is not mounted".format(hierarchy))
@@ -463,8 +793,9 @@ class CGroups(object):
 
         if not self._osutil.check_pid_alive(pid):
             raise CGroupsException('PID {0} does not exist'.format(pid))
-        for hierarchy, cgroup in self.cgroups.items():
-            tasks_file = self._get_cgroup_file(hierarchy, 'cgroup.procs')
+        # on cgroup v2 all the hierarchies share the same directory
+        for cgroup in set(self.cgroups.values()):
+            tasks_file = os.path.join(cgroup, 'cgroup.procs')
             fileutil.append_file(tasks_file, "{0}\n".format(pid))
 
     def set_limits(self):
@@ -491,6 +822,16 @@ class CGroups(object):
         """
         For each hierarchy, construct the wrapper cgroup and apply the appropriate limits
         """
+        if CGroups.is_cgroup_v2():
+            root_dir = CGroups._construct_custom_path_for_hierarchy(None, "")
+            CGroups._try_mkdir(root_dir)
+            # the wrapper cgroup has no processes of its own, so its children can use the controllers
+            CGroups._enable_v2_controllers(CGroups._v2_root)
+            CGroups._enable_v2_controllers(root_dir)
+            for hierarchy in METRIC_HIERARCHIES:
+                CGroups._apply_wrapper_limits(root_dir, hierarchy)
+            return
+
         for hierarchy in METRIC_HIERARCHIES:
             root_dir = CGroups._construct_custom_path_for_hierarchy(hierarchy, "")
             CGroups._try_mkdir(root_dir)
@@ -507,7 +848,9 @@ class CGroups(object):
         """
         if CGroups.enabled():
             try:
-                CGroups._osutil.mount_cgroups()
+                # the unified hierarchy is mounted by the system; mount_cgroups() only handles cgroup v1
+                if not CGroups.is_cgroup_v2():
+                    CGroups._osutil.mount_cgroups()
                 if not suppress_process_add:
                     CGroups._setup_wrapper_groups()
                     pid = int(os.getpid())
@@ -587,6 +930,9 @@ class CGroups(object):
         :param hierarchy:
         :return: str
         """
+        if CGroups.is_cgroup_v2():
+            # /proc/self/cgroup lists the unified hierarchy as "0::<path>"
+            return "0"
         cgroup_states = fileutil.read_file("/proc/cgroups")
         for entry in cgroup_states.splitlines():
             fields = entry.split('\t')
@@ -603,7 +949,7 @@ class CGroups(object):
         :return: str
         """
         hierarchy_id = CGroups.get_hierarchy_id(hierarchy)
-        return os.path.join(BASE_CGROUPS, hierarchy, CGroups.get_my_cgroup_path(hierarchy_id))
+        return os.path.join(CGroups._get_hierarchy_root(hierarchy), CGroups.get_my_cgroup_path(hierarchy_id))
 
     def _get_cgroup_file(self, hierarchy, file_name):
         return os.path.join(self.cgroups[hierarchy], file_name)
@@ -627,7 +973,8 @@ class CGroups(object):
 
     def get_file_contents(self, hierarchy, file_name):
         """
-        Retrieve the value of a parameter from a hierarchy.
+        Retrieve the value of a parameter from a hierarchy. The file is kept open for the next reads (see
+        MetricSources); CGroupsTelemetry.stop_tracking() closes the files of a cgroup.
 
         :param str hierarchy: Name of cgroup metric hierarchy
         :param str file_name: Name of file within that metric hierarchy
@@ -638,7 +985,7 @@ class CGroups(object):
             parameter_file = self._get_cgroup_file(hierarchy, file_name)
 
             try:
-                return fileutil.read_file(parameter_file)
+                return metric_sources.read_text(parameter_file)
             except Exception:
                 raise CGroupsException("Could not retrieve cgroup file {0}/{1}".format(hierarchy, file_name))
         else:
@@ -686,9 +1033,15 @@ class CGroups(object):
         if limit is None:
             return
 
-        if 'cpu' in self.cgroups:
+        if 'cpu' in self.cgroups and CGroups.is_cgroup_v2():
+            # cpu.max is "<quota> <period>" (quota may be "max")
+            max_values = self.get_parameter('cpu', 'cpu.max').split()
+            total_units = int(max_values[1]) if len(max_values) == 2 else 100000
+            limit_units = int(self._convert_cpu_limit_to_fraction(limit) * total_units)
+            fileutil.write_file(self._get_cgroup_file('cpu', 'cpu.max'), "{0} {1}\n".format(limit_units, total_units))
+        elif 'cpu' in self.cgroups:
             total_units = float(self.get_parameter('cpu', 'cpu.cfs_period_us'))
-            limit_units = self._convert_cpu_limit_to_fraction(limit) * total_units
+            limit_units = int(self._convert_cpu_limit_to_fraction(limit) * total_units)
             cpu_shares_file = self._get_cgroup_file('cpu', 'cpu.cfs_quota_us')
             fileutil.write_file(cpu_shares_file, "{0}\n".format(limit_units))
         else:
@@ -719,11 +1072,214 @@ class CGroups(object):
                 value = int(limit * units[unit])
         return value
 
+    def set_memory_high(self, limit=None, unit='megabytes'):
+        """
+        Set the memory usage above which the processes of this cgroup are throttled and their memory reclaimed
+        (memory.high on cgroup v2), or reclaimed first under memory contention (memory.soft_limit_in_bytes on
+        cgroup v1). Unlike the memory limit, exceeding it does not invoke the OOM killer.
+        """
+        if not CGroups.enabled():
+            return
+
+        if 'memory' not in self.cgroups:
+            raise CGroupsException("Memory hierarchy not available in this cgroup")
+
+        value = self._format_memory_value(unit, limit)
+        if CGroups.is_cgroup_v2():
+            fileutil.write_file(self._get_cgroup_file('memory', 'memory.high'),
+                                "{0}\n".format("max" if value == MEMORY_DEFAULT else value))
+        else:
+            fileutil.write_file(self._get_cgroup_file('memory', 'memory.soft_limit_in_bytes'), "{0}\n".format(value))
+
     def set_memory_limit(self, limit=None, unit='megabytes'):
-        if 'memory' in self.cgroups:
+        if 'memory' in self.cgroups and CGroups.is_cgroup_v2():
+            value = self._format_memory_value(unit, limit)
+            fileutil.write_file(self._get_cgroup_file('memory', 'memory.max'),
+                                "{0}\n".format("max" if value == MEMORY_DEFAULT else value))
+        elif 'memory' in self.cgroups:
             value = self._format_memory_value(unit, limit)
             memory_limit_file = self._get_cgroup_file('memory', 'memory.limit_in_bytes')
             with open(memory_limit_file, 'w+') as f:
                 f.write("{0}\n".format(value))
         else:
             raise CGroupsException("Memory hierarchy not available in this cgroup")
+
+
+def _classify_load(value, thresholds):
+    high, low = thresholds
+    if value >= high:
+        return LOAD_HIGH
+    if value <= low:
+        return LOAD_LOW
+    return None
+
+
+class SystemLoad(object):
+    """
+    Classify the CPU and memory load of the whole system as LOAD_HIGH, LOAD_LOW or None (in between), from the
+    system-wide pressure stall information (/proc/pressure, kernel 4.20+) or, on kernels without it, from the CPU
+    utilization since the previous sample (/proc/stat) and the memory available (/proc/meminfo).
+    """
+    def __init__(self):
+        self._previous_cpu_times = None
+
+    @staticmethod
+    def get_pressure(resource):
+        """
+        Percent of the last 10 seconds during which some task stalled on the resource, or None if not available
+        """
+        try:
+            pressure = parse_nested_keyed(metric_sources.read_text(os.path.join(PROC_PRESSURE, resource)))
+            return pressure['some']['avg10']
+        except (IOError, OSError, KeyError):
+            return None
+
+    def get_cpu_busy_percent(self):
+        """
+        Percent of the CPU time not idle since the previous call, or None on the first call
+        """
+        try:
+            times = parse_proc_stat_cpu_times(metric_sources.read(PROC_STAT))
+        except (IOError, OSError):
+            return None
+        if len(times) < 5:
+            return None
+        # user, nice, system, idle, iowait, irq, softirq, steal; guest time is included in user time
+        total = sum(times[:8])
+        idle = times[3] + times[4]
+        previous = self._previous_cpu_times
+        self._previous_cpu_times = (total, idle)
+        if previous is None or total <= previous[0]:
+            return None
+        return 100.0 * (1.0 - float(idle - previous[1]) / (total - previous[0]))
+
+    @staticmethod
+    def get_memory_available_percent():
+        """
+        Percent of the memory available for new allocations without swapping, or None if not available
+        """
+        try:
+            meminfo = metric_sources.read_text(PROC_MEMINFO)
+        except (IOError, OSError):
+            return None
+        values = {}
+        for line in meminfo.splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[0] in ("MemTotal:", "MemAvailable:"):
+                values[fields[0]] = int(fields[1])
+        if values.get("MemTotal:", 0) <= 0 or "MemAvailable:" not in values:
+            return None
+        return 100.0 * values["MemAvailable:"] / values["MemTotal:"]
+
+    def sample(self):
+        """
+        :return: The load of the CPU and of the memory
+        :rtype: (str, str)
+        """
+        pressure = self.get_pressure('cpu')
+        if pressure is not None:
+            cpu_load = _classify_load(pressure, CPU_PRESSURE_THRESHOLDS)
+        else:
+            busy = self.get_cpu_busy_percent()
+            cpu_load = None if busy is None else _classify_load(busy, CPU_BUSY_THRESHOLDS)
+
+        pressure = self.get_pressure('memory')
+        if pressure is not None:
+            memory_load = _classify_load(pressure, MEMORY_PRESSURE_THRESHOLDS)
+        else:
+            available = self.get_memory_available_percent()
+            low_available, high_available = MEMORY_AVAILABLE_THRESHOLDS
+            if available is None or low_available < available < high_available:
+                memory_load = None
+            else:
+                memory_load = LOAD_HIGH if available <= low_available else LOAD_LOW
+        return cpu_load, memory_load
+
+
+class CGroupsGovernor(object):
+    """
+    Adjust the CPU limit and the memory high watermark of the extension cgroups to the load of the system, within
+    bounds. While the system is under pressure on a resource, the limit of each extension using at least half of its
+    current limit is halved, down to the minimum; while the system is idle, the limits are doubled, up to the maximum.
+    The limits start at the maximum, and are only written when they change.
+    """
+    def __init__(self, cpu_bounds, memory_bounds, system_load=None):
+        """
+        :param (int, int) cpu_bounds: Minimum and maximum CPU limit, in percent of a single core
+        :param (int, int) memory_bounds: Minimum and maximum memory high watermark, in megabytes
+        :param SystemLoad system_load: Source of the system load
+        """
+        self.cpu_min = cpu_bounds[0]
+        self.cpu_max = min(cpu_bounds[1], CGroups.get_num_cores() * 100)
+        self.memory_min, self.memory_max = memory_bounds
+        self.system_load = SystemLoad() if system_load is None else system_load
+        self._trackers = {}
+        self._limits = {}
+
+    def get_limits(self, name):
+        """
+        :return: The current CPU limit (percent) and memory high watermark (megabytes) of the extension
+        :rtype: (int, int)
+        """
+        return self._limits.get(name, (self.cpu_max, self.memory_max))
+
+    def adjust(self, names):
+        """
+        Adjust the limits of the given extensions to the current system load; the state kept for other extensions is
+        dropped.
+
+        :param [str] names: Names of the extensions to govern
+        :return: The limits changed, as (extension name, "CPU Limit" or "Memory High", new value)
+        :rtype: [(str, str, int)]
+        """
+        for name in list(self._trackers.keys()):
+            if name not in names:
+                del self._trackers[name]
+                self._limits.pop(name, None)
+
+        if not CGroups.enabled():
+            return []
+
+        cpu_load, memory_load = self.system_load.sample()
+        system_cpu = get_osutil().get_total_cpu_ticks_since_boot()
+        adjustments = []
+        for name in names:
+            try:
+                adjustments.extend(self._adjust(name, cpu_load, memory_load, system_cpu))
+            except (CGroupsException, IOError, OSError) as e:
+                logger.warn("Could not adjust the limits of the cgroup of {0}: {1}".format(name, ustr(e)))
+        return adjustments
+
+    def _adjust(self, name, cpu_load, memory_load, system_cpu):
+        tracker = self._trackers.get(name)
+        if tracker is None:
+            tracker = CGroupsTelemetry(name)
+            self._trackers[name] = tracker
+        cpu = tracker.data['cpu']
+        cpu.update(system_cpu)
+        cpu_usage = cpu.get_cpu_percent()
+        memory_usage = tracker.data['memory'].get_memory_usage() / (1024 * 1024)
+
+        cpu_limit, memory_high = self.get_limits(name)
+        adjustments = []
+
+        new_cpu_limit = cpu_limit
+        if cpu_load == LOAD_HIGH and cpu_usage >= cpu_limit / 2.0:
+            new_cpu_limit = max(self.cpu_min, cpu_limit // 2)
+        elif cpu_load == LOAD_LOW:
+            new_cpu_limit = min(self.cpu_max, cpu_limit * 2)
+        if new_cpu_limit != cpu_limit:
+            tracker.cgroup.set_cpu_limit(new_cpu_limit)
+            adjustments.append((name, "CPU Limit", new_cpu_limit))
+
+        new_memory_high = memory_high
+        if memory_load == LOAD_HIGH and memory_usage >= memory_high / 2.0:
+            new_memory_high = max(self.memory_min, memory_high // 2)
+        elif memory_load == LOAD_LOW:
+            new_memory_high = min(self.memory_max, memory_high * 2)
+        if new_memory_high != memory_high:
+            tracker.cgroup.set_memory_high(new_memory_high)
+            adjustments.append((name, "Memory High", new_memory_high))
+
+        self._limits[name] = (new_cpu_limit, new_memory_high)
+        return adjustments
@@ -0,0 +1,178 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+
+import threading
+import traceback
+
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.cgroups import CGroupsTelemetry
+from azurelinuxagent.common.future import ustr
+
+# Samples kept per metric; at the default sampling period (15s) that covers an hour, well over the report period
+DEFAULT_BUFFER_CAPACITY = 240
+
+SUMMARY_STATISTICS = ["Min", "Max", "Mean", "P50", "P95", "P99"]
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer of the most recent samples of a metric. 'count' is the number of samples appended since the
+    last clear(), including those overwritten.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._values = []
+        self._next = 0
+        self.count = 0
+
+    def append(self, value):
+        if len(self._values) < self.capacity:
+            self._values.append(value)
+        else:
+            self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.count += 1
+
+    def values(self):
+        """
+        Return the samples held, oldest first
+        """
+        if len(self._values) < self.capacity:
+            return list(self._values)
+        return self._values[self._next:] + self._values[:self._next]
+
+    def clear(self):
+        self._values = []
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return len(self._values)
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank percentile: the value at rank ceil(percent * n / 100)
+    rank = (percent * len(sorted_values) + 99) // 100
+    return sorted_values[max(0, rank - 1)]
+
+
+def summarize(values):
+    """
+    Return the min, max, mean and 50th, 95th and 99th percentiles of the values, keyed by SUMMARY_STATISTICS
+
+    :rtype: dict(str: float)
+    """
+    sorted_values = sorted(values)
+    return {
+        "Min": sorted_values[0],
+        "Max": sorted_values[-1],
+        "Mean": round(float(sum(sorted_values)) / len(sorted_values), 3),
+        "P50": _percentile(sorted_values, 50),
+        "P95": _percentile(sorted_values, 95),
+        "P99": _percentile(sorted_values, 99),
+    }
+
+
+class CGroupsSampler(object):
+    """
+    Samples the tracked cgroups (CGroupsTelemetry) every 'sampling_period' seconds, on its own thread, into a ring
+    buffer per metric, so that short spikes are visible in the summaries reported once per report period. Memory is
+    bounded by the buffer capacity and by the number of tracked metrics; the buffers of cgroups no longer tracked are
+    dropped when reported.
+    """
+    def __init__(self, sampling_period, capacity=DEFAULT_BUFFER_CAPACITY):
+        self.sampling_period = sampling_period
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.setName("CGroupsSampler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warn("Failed to sample cgroups: {0}", ustr(e))
+                logger.verbose(traceback.format_exc())
+            self._stop_event.wait(self.sampling_period)
+
+    def sample(self):
+        """
+        Collect the metrics of all the tracked cgroups once
+        """
+        samples = CGroupsTelemetry.collect_all_tracked()
+        with self._lock:
+            for cgroup_name, metrics in samples.items():
+                for metric_group, metric_name, value in metrics:
+                    key = (cgroup_name, metric_group, metric_name)
+                    buffer = self._buffers.get(key)
+                    if buffer is None:
+                        buffer = RingBuffer(self.capacity)
+                        self._buffers[key] = buffer
+                    buffer.append(value)
+
+    def get_summaries(self):
+        """
+        Summarize the samples taken since the previous call and start over
+
+        :return: (cgroup name, metric group, metric name, summary) for each metric sampled, where the summary holds
+                 SUMMARY_STATISTICS and the number of samples taken ("Count")
+        :rtype: [(str, str, str, dict(str: float))]
+        """
+        summaries = []
+        with self._lock:
+            for key in sorted(self._buffers.keys()):
+                buffer = self._buffers[key]
+                if len(buffer) == 0:
+                    del self._buffers[key]
+                    continue
+                summary = summarize(buffer.values())
+                summary["Count"] = buffer.count
+                summaries.append(key + (summary,))
+                buffer.clear()
+        return summaries
+
+    def report(self, report_metric):
+        """
+        Report the summaries of the metrics sampled since the previous report, skipping metrics that were always 0
+
+        :param report_metric: function(category, counter, instance, value)
+        """
+        for cgroup_name, metric_group, metric_name, summary in self.get_summaries():
+            if summary["Max"] <= 0:
+                continue
+            for statistic in SUMMARY_STATISTICS + ["Count"]:
+                report_metric(metric_group, "{0} {1}".format(metric_name, statistic), cgroup_name,
+                              summary[statistic])
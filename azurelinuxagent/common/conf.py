@@ -96,6 +96,7 @@ __SWITCH_OPTIONS__ = {
     "OS.UpdateRdmaDriver": False,
     "OS.CheckRdmaDriver": False,
     "Logs.Verbose": False,
+    "Logs.EnableRotation": False,
     "Extensions.Enabled": True,
     "Provisioning.Enabled": True,
     "Provisioning.UseCloudInit": False,
@@ -109,7 +110,9 @@ __SWITCH_OPTIONS__ = {
     "ResourceDisk.Format": False,
     "ResourceDisk.EnableSwap": False,
     "AutoUpdate.Enabled": True,
-    "EnableOverProvisioning": True
+    "EnableOverProvisioning": True,
+    "CGroups.EnableGovernor": False,
+    "Metrics.EnableEndpoint": False
 }
 
 
@@ -139,7 +142,17 @@ __INTEGER_OPTIONS__ = {
     "Provisioning.PasswordCryptSaltLength": 10,
     "HttpProxy.Port": None,
     "ResourceDisk.SwapSizeMB": 0,
-    "Autoupdate.Frequency": 3600
+    "Autoupdate.Frequency": 3600,
+    "Logs.RotationMaxSizeMB": 20,
+    "Logs.RotationMaxAgeDays": 30,
+    "Logs.MaxTotalSizeMB": 200,
+    "CGroups.SamplingPeriod": 15,
+    "CGroups.ExtensionCpuMinPercent": 10,
+    "CGroups.ExtensionCpuMaxPercent": 100,
+    "CGroups.ExtensionMemoryMinMB": 256,
+    "CGroups.ExtensionMemoryMaxMB": 2048,
+    "Agent.CpuBudgetPercent": 10,
+    "Agent.IOBudgetKBps": 1024
 }
 
 
@@ -175,6 +188,58 @@ def get_logs_verbose(conf=__conf__):
     return conf.get_switch("Logs.Verbose", False)
 
 
+def get_logs_rotation_enabled(conf=__conf__):
+    return conf.get_switch("Logs.EnableRotation", False)
+
+
+def get_logs_rotation_max_size(conf=__conf__):
+    return conf.get_int("Logs.RotationMaxSizeMB", 20) * 1024 * 1024
+
+
+def get_logs_rotation_max_age(conf=__conf__):
+    return conf.get_int("Logs.RotationMaxAgeDays", 30) * 24 * 60 * 60
+
+
+def get_logs_max_total_size(conf=__conf__):
+    return conf.get_int("Logs.MaxTotalSizeMB", 200) * 1024 * 1024
+
+
+def get_cgroups_sampling_period(conf=__conf__):
+    return conf.get_int("CGroups.SamplingPeriod", 15)
+
+
+def get_cgroups_governor_enabled(conf=__conf__):
+    return conf.get_switch("CGroups.EnableGovernor", False)
+
+
+def get_cgroups_extension_cpu_min(conf=__conf__):
+    return conf.get_int("CGroups.ExtensionCpuMinPercent", 10)
+
+
+def get_cgroups_extension_cpu_max(conf=__conf__):
+    return conf.get_int("CGroups.ExtensionCpuMaxPercent", 100)
+
+
+def get_cgroups_extension_memory_min(conf=__conf__):
+    return conf.get_int("CGroups.ExtensionMemoryMinMB", 256)
+
+
+def get_cgroups_extension_memory_max(conf=__conf__):
+    return conf.get_int("CGroups.ExtensionMemoryMaxMB", 2048)
+
+
+def get_agent_cpu_budget(conf=__conf__):
+    return conf.get_int("Agent.CpuBudgetPercent", 10)
+
+
+def get_agent_io_budget(conf=__conf__):
+    return conf.get_int("Agent.IOBudgetKBps", 1024) * 1024
+
+
+def get_metrics_endpoint_enabled(conf=__conf__):
+    return conf.get_switch("Metrics.EnableEndpoint", False)
+
+
 def get_lib_dir(conf=__conf__):
     return conf.get("Lib.Dir", "/var/lib/waagent")
 
@@ -28,6 +28,7 @@ from datetime import datetime
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
 
+from azurelinuxagent.common.eventquota import get_event_source_from_data, select_events_to_evict
 from azurelinuxagent.common.exception import EventError
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.protocol.restapi import TelemetryEventParam, \
@@ -82,6 +83,8 @@ class WALAEventOperation:
     Update = "Update"
 
 
+MAX_NUMBER_OF_EVENTS = 1000
+
 SHOULD_ENCODE_MESSAGE_LEN = 80
 SHOULD_ENCODE_MESSAGE_OP = [
     WALAEventOperation.Disable,
@@ -134,8 +137,7 @@ class EventStatus(object):
 
     def _save(self):
         try:
-            with open(self._path, 'w') as f:
-                json.dump(self._status, f)
+            fileutil.write_file_if_changed(self._path, json.dumps(self._status))
         except Exception as e:
             logger.warn("Exception occurred saving event status: {0}".format(e))
 
@@ -196,6 +198,8 @@ class EventLogger(object):
     def __init__(self):
         self.event_dir = None
         self.periodic_events = {}
+        self.evicted_events = {}
+        self._event_sources = {}
 
     def save_event(self, data):
         if self.event_dir is None:
@@ -205,14 +209,11 @@ class EventLogger(object):
         fileutil.mkdir(self.event_dir, mode=0o700)
 
         existing_events = os.listdir(self.event_dir)
-        if len(existing_events) >= 1000:
-            existing_events.sort()
-            oldest_files = existing_events[:-999]
+        if len(existing_events) >= MAX_NUMBER_OF_EVENTS:
             logger.warn("Too many files under: {0}, removing oldest".format(self.event_dir))
             try:
-                for f in oldest_files:
-                    os.remove(os.path.join(self.event_dir, f))
-            except IOError as e:
+                self._evict_events(existing_events, len(existing_events) - MAX_NUMBER_OF_EVENTS + 1)
+            except (IOError, OSError) as e:
                 raise EventError(e)
 
         filename = os.path.join(self.event_dir,
@@ -224,6 +225,36 @@ class EventLogger(object):
         except IOError as e:
             raise EventError("Failed to write events to file:{0}", e)
 
+    def _evict_events(self, existing_events, count):
+        """
+        Delete 'count' event files, taking them from the sources with the
+        most pending events first
+        """
+        # Event files are never modified, so their sources are remembered
+        # across calls to avoid re-reading all of them on every eviction
+        event_sources = {}
+        events_by_source = {}
+        for f in sorted(existing_events):
+            source = self._event_sources.get(f)
+            if source is None:
+                try:
+                    source = get_event_source_from_data(fileutil.read_file(os.path.join(self.event_dir, f)))
+                except (IOError, OSError, UnicodeDecodeError):
+                    source = ""
+            event_sources[f] = source
+            events_by_source.setdefault(source, []).append(f)
+
+        for source, f in select_events_to_evict(events_by_source, count):
+            os.remove(os.path.join(self.event_dir, f))
+            del event_sources[f]
+            self.evicted_events[source] = self.evicted_events.get(source, 0) + 1
+        self._event_sources = event_sources
+
+    def get_and_reset_evicted_events(self):
+        evicted = self.evicted_events
+        self.evicted_events = {}
+        return evicted
+
     def reset_periodic(self):
         self.periodic_events = {}
 
@@ -424,6 +455,10 @@ def add_periodic(
         is_internal=is_internal, log_event=log_event, force=force)
 
 
+def get_and_reset_evicted_events(reporter=__event_logger__):
+    return reporter.get_and_reset_evicted_events()
+
+
 def mark_event_status(name, version, op, status):
     if op in __event_status_operations__:
         __event_status__.mark_event_status(name, version, op, status)
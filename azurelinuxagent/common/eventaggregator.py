@@ -0,0 +1,260 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import re
+
+from datetime import datetime, timedelta
+
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.protocol.restapi import TelemetryEvent, TelemetryEventParam
+
+DEFAULT_AGGREGATION_WINDOW = timedelta(minutes=5)
+
+_GUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+_NUMBER_PATTERN = re.compile(r'\d+(\.\d+)?')
+
+_AGGREGATED_MESSAGE = u"{0} [Aggregated {1} events; first: {2}; last: {3}; " \
+                      u"duration min/mean/max: {4}/{5}/{6}]"
+
+
+def normalize_message(message):
+    """
+    Replace the parts of a message that typically vary between otherwise
+    identical events (GUIDs, counters, timestamps) with placeholders
+    """
+    message = _GUID_PATTERN.sub(u"<guid>", ustr(message))
+    return _NUMBER_PATTERN.sub(u"<n>", message)
+
+
+def _is_success(value):
+    if isinstance(value, bool):
+        return value
+    return ustr(value).lower() == u"true"
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _EventGroup(object):
+    def __init__(self, event, timestamp):
+        self.event = event
+        self.sources = []
+        self.count = 0
+        self.first = timestamp
+        self.last = timestamp
+        self.min_duration = None
+        self.max_duration = None
+        self.total_duration = 0.0
+
+    def add(self, duration, timestamp):
+        self.count += 1
+        self.first = min(self.first, timestamp)
+        self.last = max(self.last, timestamp)
+        self.total_duration += duration
+        self.min_duration = duration if self.min_duration is None else min(self.min_duration, duration)
+        self.max_duration = duration if self.max_duration is None else max(self.max_duration, duration)
+
+    def to_events(self):
+        if self.count == 1:
+            return [self.event]
+
+        mean_duration = int(self.total_duration / self.count)
+        for param in self.event.parameters:
+            if param.name == 'Message':
+                param.value = _AGGREGATED_MESSAGE.format(param.value,
+                                                         self.count,
+                                                         self.first.isoformat(),
+                                                         self.last.isoformat(),
+                                                         int(self.min_duration),
+                                                         mean_duration,
+                                                         int(self.max_duration))
+            elif param.name == 'Duration':
+                param.value = mean_duration
+        return [self.event]
+
+
+class _MetricGroup(object):
+    def __init__(self, event, timestamp):
+        self.event = event
+        self.sources = []
+        self.count = 0
+        self.first = timestamp
+        self.min_value = None
+        self.max_value = None
+        self.total_value = 0.0
+
+    def add(self, value, timestamp):
+        self.count += 1
+        self.first = min(self.first, timestamp)
+        self.total_value += value
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = value if self.max_value is None else max(self.max_value, value)
+
+    def _create_event(self, suffix, value):
+        event = TelemetryEvent(self.event.eventId, self.event.providerId)
+        for param in self.event.parameters:
+            if param.name == 'Counter':
+                event.parameters.append(TelemetryEventParam('Counter', u"{0}{1}".format(param.value, suffix)))
+            elif param.name == 'Value':
+                event.parameters.append(TelemetryEventParam('Value', value))
+            else:
+                event.parameters.append(TelemetryEventParam(param.name, param.value))
+        return event
+
+    def to_events(self):
+        if self.count == 1:
+            return [self.event]
+
+        return [self._create_event(u"", self.total_value / self.count),
+                self._create_event(u" Min", self.min_value),
+                self._create_event(u" Max", self.max_value),
+                self._create_event(u" Count", self.count)]
+
+
+class EventAggregator(object):
+    """
+    Collapses near-identical telemetry events collected within a time window.
+
+    Successful operation events (those carrying the Name/Operation/
+    OperationSuccess/Message parameters) are grouped by provider, event id,
+    name, operation and normalized message. When the window of a group
+    elapses a single event is emitted for it; if the group holds more than
+    one event, its message is annotated with the event count, the first and
+    last timestamps and the duration statistics, and its duration is set to
+    the mean duration.
+
+    Metric events (Category/Counter/Instance/Value) are grouped by provider,
+    event id, category, counter and instance. A group holding more than one
+    event is emitted as the mean value, under the original counter name, and
+    as the min, max and count of the values, under the counter name followed
+    by " Min", " Max" and " Count".
+
+    Failed operations and events with other schemas (logs) are passed
+    through unchanged at the next flush.
+
+    The callers pass the source of each event (its event file): the sources
+    of the events held in a group are returned by pop_released_sources()
+    once the group is flushed, so the files can be kept until then and the
+    events collected again after a restart.
+    """
+
+    def __init__(self, window=DEFAULT_AGGREGATION_WINDOW):
+        self.window = window
+        self.received = 0
+        self.emitted = 0
+        self._groups = {}
+        self._group_order = []
+        self._passthrough = []
+        self._held_sources = set()
+        self._released_sources = []
+
+    def add(self, event, timestamp=None, source=None):
+        """
+        Add an event; return True if it is held in a group (and its source
+        is released when the group is flushed), False if it is passed
+        through
+        """
+        timestamp = datetime.utcnow() if timestamp is None else timestamp
+        self.received += 1
+
+        group_type, key, value = self._get_key(event)
+        if key is None:
+            self._passthrough.append(event)
+            return False
+
+        group = self._groups.get(key)
+        if group is None:
+            group = group_type(event, timestamp)
+            self._groups[key] = group
+            self._group_order.append(key)
+        group.add(value, timestamp)
+        if source is not None:
+            group.sources.append(source)
+            self._held_sources.add(source)
+        return True
+
+    def is_held(self, source):
+        return source in self._held_sources
+
+    def pop_released_sources(self):
+        """
+        Return the sources of the events of the groups flushed since the
+        last call
+        """
+        released = self._released_sources
+        self._released_sources = []
+        return released
+
+    def flush(self, now=None, force=False):
+        """
+        Return the events that are ready to be sent: all pass-through events
+        and the aggregates of the groups whose window has elapsed (or all
+        groups if force is True)
+        """
+        now = datetime.utcnow() if now is None else now
+
+        events = self._passthrough
+        self._passthrough = []
+
+        pending = []
+        for key in self._group_order:
+            group = self._groups[key]
+            if force or group.first + self.window <= now:
+                events.extend(group.to_events())
+                for source in group.sources:
+                    self._held_sources.discard(source)
+                self._released_sources.extend(group.sources)
+                del self._groups[key]
+            else:
+                pending.append(key)
+        self._group_order = pending
+
+        self.emitted += len(events)
+        return events
+
+    @property
+    def pending(self):
+        return len(self._passthrough) + sum([g.count for g in self._groups.values()])
+
+    @staticmethod
+    def _get_key(event):
+        params = dict([(p.name, p.value) for p in event.parameters])
+        if 'Category' in params and 'Counter' in params and 'Value' in params:
+            key = (event.providerId,
+                   ustr(event.eventId),
+                   ustr(params['Category']),
+                   ustr(params['Counter']),
+                   ustr(params.get('Instance')))
+            return _MetricGroup, key, _to_number(params['Value'])
+
+        if 'Operation' not in params or 'OperationSuccess' not in params:
+            return None, None, 0
+
+        if not _is_success(params['OperationSuccess']):
+            return None, None, 0
+
+        key = (event.providerId,
+               ustr(event.eventId),
+               ustr(params.get('Name')),
+               ustr(params.get('Version')),
+               ustr(params['Operation']),
+               normalize_message(params.get('Message', u"")))
+        return _EventGroup, key, _to_number(params.get('Duration', 0))
@@ -0,0 +1,237 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import json
+import re
+import threading
+import time
+
+from collections import deque
+
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.version import AGENT_NAME
+
+AGENT_PROVIDER_ID = "69B669B9-4AF8-4C50-BDC4-6006FA76E975"
+AGENT_LOG_PROVIDER_ID = "FFF0196F-EE4C-4EAF-9AA5-776F622DEB4F"
+
+# Event ids used by the agent for operation, metric and log events
+AGENT_EVENT_IDS = ["4", "6", "7"]
+
+AGENT_SOURCE = AGENT_NAME
+AGENT_WEIGHT = 4
+DEFAULT_WEIGHT = 1
+
+# Token bucket parameters (per source, scaled by the source weight)
+DEFAULT_EVENT_RATE = 1.0            # events per second
+DEFAULT_EVENT_BURST = 300           # events
+
+DEFAULT_MAX_QUEUED_EVENTS = 1000    # per source
+DEFAULT_BATCH_SIZE = 1000           # per upload
+
+_XML_PROVIDER_PATTERN = re.compile(r'<Provider id="([^"]*)"')
+_XML_EVENT_ID_PATTERN = re.compile(r'<Event id="([^"]*)"')
+_XML_NAME_PATTERN = re.compile(r'<Param Name="Name" Value="([^"]*)"')
+
+
+def _get_source(provider_id, event_id, name):
+    provider_id = ustr(provider_id).upper()
+    if provider_id == AGENT_LOG_PROVIDER_ID or \
+            (provider_id == AGENT_PROVIDER_ID and ustr(event_id) in AGENT_EVENT_IDS):
+        return AGENT_SOURCE
+    if name:
+        return ustr(name)
+    return provider_id
+
+
+def get_event_source(event):
+    """
+    Return the source (the agent, or the name of the extension or provider)
+    of a TelemetryEvent
+    """
+    name = None
+    for param in event.parameters:
+        if param.name == 'Name':
+            name = param.value
+            break
+    return _get_source(event.providerId, event.eventId, name)
+
+
+def get_event_source_from_data(data_str):
+    """
+    Return the source of a serialized (JSON or XML) event
+    """
+    try:
+        data = json.loads(data_str)
+        name = None
+        for param in data.get('parameters', []):
+            if param.get('name') == 'Name':
+                name = param.get('value')
+                break
+        return _get_source(data.get('providerId'), data.get('eventId'), name)
+    except (ValueError, AttributeError):
+        provider = _XML_PROVIDER_PATTERN.search(data_str)
+        event_id = _XML_EVENT_ID_PATTERN.search(data_str)
+        name = _XML_NAME_PATTERN.search(data_str)
+        return _get_source(provider.group(1) if provider else u"",
+                           event_id.group(1) if event_id else u"",
+                           name.group(1) if name else None)
+
+
+def get_source_weight(source):
+    return AGENT_WEIGHT if source == AGENT_SOURCE else DEFAULT_WEIGHT
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.timestamp = None
+
+    def consume(self, now=None):
+        now = time.time() if now is None else now
+        if self.timestamp is not None:
+            elapsed = max(0, now - self.timestamp)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.timestamp = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class EventScheduler(object):
+    """
+    Per-source admission control and fair scheduling of telemetry events.
+
+    Each source (the agent itself, or an extension/provider) gets a token
+    bucket scaled by its weight; events arriving when the bucket is empty are
+    throttled. Admitted events are queued per source (up to max_queued
+    events, beyond which they are dropped) and upload batches are built with
+    deficit round robin, so that each source gets a share of a batch
+    proportional to its weight.
+    """
+
+    def __init__(self,
+                 rate=DEFAULT_EVENT_RATE,
+                 burst=DEFAULT_EVENT_BURST,
+                 max_queued=DEFAULT_MAX_QUEUED_EVENTS,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._buckets = {}
+        self._queues = {}
+        self._deficits = {}
+        self._throttled = {}
+        self._dropped = {}
+
+    def add(self, event, now=None):
+        """
+        Queue an event for upload; return False if the event was throttled
+        or dropped
+        """
+        source = get_event_source(event)
+        with self._lock:
+            bucket = self._buckets.get(source)
+            if bucket is None:
+                weight = get_source_weight(source)
+                bucket = TokenBucket(self.rate * weight, self.burst * weight)
+                self._buckets[source] = bucket
+
+            if not bucket.consume(now):
+                self._throttled[source] = self._throttled.get(source, 0) + 1
+                return False
+
+            queue = self._queues.setdefault(source, deque())
+            if len(queue) >= self.max_queued * get_source_weight(source):
+                self._dropped[source] = self._dropped.get(source, 0) + 1
+                return False
+            queue.append(event)
+            return True
+
+    def next_batch(self):
+        """
+        Return up to batch_size queued events, interleaved across sources in
+        proportion to their weights
+        """
+        batch = []
+        with self._lock:
+            while len(batch) < self.batch_size:
+                active = [s for s in sorted(self._queues.keys()) if len(self._queues[s]) > 0]
+                if len(active) == 0:
+                    break
+                for source in active:
+                    queue = self._queues[source]
+                    deficit = self._deficits.get(source, 0) + get_source_weight(source)
+                    while deficit >= 1 and len(queue) > 0 and len(batch) < self.batch_size:
+                        batch.append(queue.popleft())
+                        deficit -= 1
+                    self._deficits[source] = deficit if len(queue) > 0 else 0
+
+            for source in [s for s in self._queues if len(self._queues[s]) == 0]:
+                del self._queues[source]
+        return batch
+
+    @property
+    def pending(self):
+        with self._lock:
+            return sum([len(q) for q in self._queues.values()])
+
+    def record_dropped(self, source, count=1):
+        with self._lock:
+            self._dropped[source] = self._dropped.get(source, 0) + count
+
+    def get_and_reset_counts(self):
+        """
+        Return a dictionary mapping each source to its (throttled, dropped)
+        event counts since the last call
+        """
+        with self._lock:
+            sources = set(self._throttled.keys()) | set(self._dropped.keys())
+            counts = dict([(s, (self._throttled.get(s, 0), self._dropped.get(s, 0))) for s in sources])
+            self._throttled = {}
+            self._dropped = {}
+            return counts
+
+
+def select_events_to_evict(events_by_source, count):
+    """
+    Choose which event files to delete when the events directory is full.
+
+    Files are taken, oldest first, from the source holding the most files
+    relative to its weight, so that a single noisy source cannot crowd out
+    the events of the others.
+
+    :param events_by_source: dictionary of source -> list of file names
+                             (sorted oldest first)
+    :param count: number of files to evict
+    :return: list of (source, file name)
+    """
+    remaining = dict([(s, deque(f)) for s, f in events_by_source.items()])
+    evicted = []
+    while len(evicted) < count:
+        candidates = [s for s in remaining if len(remaining[s]) > 0]
+        if len(candidates) == 0:
+            break
+        source = max(candidates,
+                     key=lambda s: (len(remaining[s]) / float(get_source_weight(s)), s))
+        evicted.append((source, remaining[source].popleft()))
+    return evicted
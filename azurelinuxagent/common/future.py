@@ -14,6 +14,7 @@ Add alias for python2 and python3 libs and functions.
 
 if sys.version_info[0] == 3:
     import http.client as httpclient
+    import queue
     from urllib.parse import urlparse
 
     """Rename Python3 str to ustr"""
@@ -23,6 +24,7 @@ if sys.version_info[0] == 3:
 
 elif sys.version_info[0] == 2:
     import httplib as httpclient
+    import Queue as queue
     from urlparse import urlparse
 
     """Rename Python2 unicode to ustr"""
@@ -17,9 +17,17 @@
 """
 Log utils
 """
+import atexit
+import glob
+import gzip
+import os
+import re
+import shutil
 import sys
+import threading
+import time
 
-from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.future import queue, ustr
 from datetime import datetime, timedelta
 
 EVERY_DAY = timedelta(days=1)
@@ -67,7 +75,26 @@ class Logger(object):
     def error(self, msg_format, *args):
         self.log(LogLevel.ERROR, msg_format, *args)
 
+    def is_enabled(self, level):
+        """
+        True if at least one appender (including those of the parent logger)
+        would accept a message logged at the given level
+        """
+        for appender in self.appenders:
+            if appender.level <= level:
+                return True
+        if self.logger != self:
+            for appender in self.logger.appenders:
+                if appender.level <= level:
+                    return True
+        return False
+
     def log(self, level, msg_format, *args):
+        # Skip the (comparatively expensive) formatting below if no appender
+        # is interested in the message
+        if not self.is_enabled(level):
+            return
+
         #if msg_format is not unicode convert it to unicode
         if type(msg_format) is not ustr:
             msg_format = ustr(msg_format, errors="backslashreplace")
@@ -125,6 +152,359 @@ class FileAppender(object):
                 pass
 
 
+# Seconds flush(), close() and the writes blocked by OverflowPolicy.BLOCK wait
+# for the writer thread of an AsyncFileAppender
+WRITER_TIMEOUT = 5
+
+
+class OverflowPolicy(object):
+    DROP = "drop"
+    BLOCK = "block"
+
+
+class AsyncFileAppender(object):
+    """
+    File appender that hands messages off to a background writer thread.
+
+    The writer drains a bounded queue and writes the messages in batches
+    through a long-lived file handle. The handle is reopened when the file
+    is moved or removed (e.g. by logrotate). When the queue is full, messages
+    are either dropped (and counted) or the caller blocks, depending on the
+    overflow policy; callers never wait for the writer longer than
+    WRITER_TIMEOUT seconds, so a stalled writer cannot hang the agent.
+    """
+    _SHUTDOWN = object()
+
+    def __init__(self, level, path,
+                 max_queue_size=10000,
+                 overflow_policy=OverflowPolicy.DROP,
+                 max_batch_size=256,
+                 flush_interval=1.0):
+        self.level = level
+        self.path = path
+        self.overflow_policy = overflow_policy
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(max_queue_size)
+        self._log_file = None
+        self._closed = False
+        self._writer = threading.Thread(target=self._run)
+        self._writer.setDaemon(True)
+        self._writer.setName("AsyncFileAppender")
+        self._writer.start()
+        _register_async_appender(self)
+
+    def write(self, level, msg):
+        if self.level > level or self._closed:
+            return
+        try:
+            if self.overflow_policy == OverflowPolicy.BLOCK:
+                self._queue.put(msg, timeout=WRITER_TIMEOUT)
+            else:
+                self._queue.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=WRITER_TIMEOUT):
+        """
+        Block until every message queued so far has been written, or for at
+        most timeout seconds; return False on timeout
+        """
+        if self._closed:
+            return True
+        # Queue.join() cannot time out
+        end = time.time() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks > 0:
+                remaining = end - time.time()
+                if remaining <= 0 or not self._writer.is_alive():
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=WRITER_TIMEOUT):
+        """
+        Write any pending messages, stop the writer thread and close the
+        file; wait for at most timeout seconds for the writer
+        """
+        if self._closed:
+            return
+        self._closed = True
+        end = time.time() + timeout
+        try:
+            self._queue.put(AsyncFileAppender._SHUTDOWN, timeout=timeout)
+        except queue.Full:
+            return
+        self._writer.join(max(0, end - time.time()))
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            shutdown = False
+            try:
+                while True:
+                    if item is AsyncFileAppender._SHUTDOWN:
+                        shutdown = True
+                    else:
+                        batch.append(item)
+                    if shutdown or len(batch) >= self.max_batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                if len(batch) > 0:
+                    self._write_batch(u"".join(batch))
+            except Exception:
+                # the batch is lost, but the writer keeps running: flush(),
+                # close() and the writes blocked by OverflowPolicy.BLOCK
+                # wait for it
+                self.errors += 1
+            finally:
+                for _ in range(len(batch) + (1 if shutdown else 0)):
+                    self._queue.task_done()
+
+            if shutdown:
+                self._close_file()
+                return
+
+    def _write_batch(self, data):
+        try:
+            log_file = self._get_file()
+            log_file.write(data)
+            log_file.flush()
+        except (IOError, OSError, ValueError):
+            self._close_file()
+
+    def _get_file(self):
+        if self._log_file is not None and self._is_file_moved():
+            self._close_file()
+        if self._log_file is None:
+            self._log_file = open(self.path, "a+")
+        return self._log_file
+
+    def _is_file_moved(self):
+        try:
+            path_stat = os.stat(self.path)
+        except OSError:
+            return True
+        file_stat = os.fstat(self._log_file.fileno())
+        return path_stat.st_ino != file_stat.st_ino or \
+            path_stat.st_dev != file_stat.st_dev
+
+    def _close_file(self):
+        if self._log_file is not None:
+            try:
+                self._log_file.close()
+            except (IOError, OSError):
+                pass
+            self._log_file = None
+
+
+_ASYNC_APPENDERS = []
+_ASYNC_APPENDERS_LOCK = threading.Lock()
+
+
+def _register_async_appender(appender):
+    with _ASYNC_APPENDERS_LOCK:
+        if len(_ASYNC_APPENDERS) == 0:
+            atexit.register(shutdown)
+        _ASYNC_APPENDERS.append(appender)
+
+
+def shutdown():
+    """
+    Flush and close all asynchronous appenders
+    """
+    with _ASYNC_APPENDERS_LOCK:
+        appenders = list(_ASYNC_APPENDERS)
+        del _ASYNC_APPENDERS[:]
+    for appender in appenders:
+        appender.close()
+
+
+class LogRotator(object):
+    """
+    Size and age based rotation of log files.
+
+    A background thread periodically checks the registered files (and the
+    files matching a pattern in the registered directories). Files larger
+    than max_size bytes, or not rotated for max_age seconds, are moved aside
+    to a timestamped segment which is then gzip-compressed. Once the total
+    size of the live files and their segments exceeds max_total_size bytes,
+    the oldest segments are deleted.
+
+    Files written only through the agent's own appenders are renamed (the
+    appenders reopen the file on the next write); files written by other
+    processes (e.g. extension logs) are copied and truncated in place, since
+    the writer may hold the file open. Writers are never blocked: all work is
+    done on the rotation thread, which runs at low priority.
+
+    If given, can_compress is called before compressing the segments of a
+    pass; when it returns False the compression is left to a later pass.
+    """
+    SEGMENT_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+    def __init__(self, max_size, max_age, max_total_size, check_interval=60, can_compress=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_total_size = max_total_size
+        self.check_interval = check_interval
+        self.can_compress = can_compress
+        self.files = []
+        self.directories = []
+        self._last_rotation = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_file(self, path, copy_truncate=False):
+        self.files.append((path, copy_truncate))
+
+    def add_directory(self, path, pattern="*.log"):
+        self.directories.append((path, pattern))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.setName("LogRotator")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        _lower_thread_priority()
+        while not self._stop_event.is_set():
+            try:
+                self.rotate()
+            except Exception as e:
+                # Do not log to avoid feeding the files being rotated
+                sys.stderr.write("Log rotation failed: {0}\n".format(e))
+            self._stop_event.wait(self.check_interval)
+
+    def rotate(self):
+        """
+        Run a single rotation pass
+        """
+        targets = self._get_targets()
+        for path, copy_truncate in targets:
+            if self._should_rotate(path):
+                self._rotate_file(path, copy_truncate)
+
+        segments = [s for path, _ in targets for s in self._get_segments(path) if not s.endswith(".gz")]
+        if len(segments) > 0 and (self.can_compress is None or self.can_compress()):
+            for segment in segments:
+                self._compress(segment)
+
+        self._enforce_total_size(targets)
+
+    def _get_targets(self):
+        targets = [t for t in self.files if os.path.isfile(t[0])]
+        for directory, pattern in self.directories:
+            for path in glob.glob(os.path.join(directory, "*", pattern)) + \
+                    glob.glob(os.path.join(directory, pattern)):
+                if os.path.isfile(path):
+                    targets.append((path, True))
+        return targets
+
+    def _should_rotate(self, path):
+        now = time.time()
+        size = os.path.getsize(path)
+        if size == 0:
+            return False
+        if size >= self.max_size:
+            return True
+
+        last_rotation = self._last_rotation.get(path)
+        if last_rotation is None:
+            segments = self._get_segments(path)
+            last_rotation = max([os.path.getmtime(s) for s in segments]) \
+                if len(segments) > 0 else now
+            self._last_rotation[path] = last_rotation
+        return now - last_rotation >= self.max_age
+
+    def _rotate_file(self, path, copy_truncate):
+        segment = "{0}.{1}".format(path, time.strftime(LogRotator.SEGMENT_TIME_FORMAT))
+        suffix = 0
+        while os.path.exists(segment) or os.path.exists(segment + ".gz"):
+            suffix += 1
+            segment = "{0}.{1}-{2}".format(path, time.strftime(LogRotator.SEGMENT_TIME_FORMAT), suffix)
+
+        if copy_truncate:
+            shutil.copyfile(path, segment)
+            with open(path, "r+") as log_file:
+                log_file.truncate(0)
+        else:
+            os.rename(path, segment)
+        self._last_rotation[path] = time.time()
+        return segment
+
+    @staticmethod
+    def _get_segments(path):
+        # only the segments named by _rotate_file (<path>.%Y%m%d%H%M%S[-n][.gz]), not those of logrotate
+        # (e.g. waagent.log.1.gz) or of other tools
+        directory = os.path.dirname(path)
+        pattern = re.compile(re.escape(os.path.basename(path)) + r"\.\d{14}(-\d+)?(\.gz)?$")
+        return [os.path.join(directory, name) for name in os.listdir(directory) if pattern.match(name)]
+
+    @staticmethod
+    def _compress(segment):
+        compressed = segment + ".gz"
+        with open(segment, "rb") as src:
+            dst = gzip.open(compressed + ".tmp", "wb")
+            try:
+                shutil.copyfileobj(src, dst)
+            finally:
+                dst.close()
+        os.rename(compressed + ".tmp", compressed)
+        os.remove(segment)
+
+    def _enforce_total_size(self, targets):
+        total = 0
+        segments = []
+        for path, _ in targets:
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+            for segment in self._get_segments(path):
+                segments.append((os.path.getmtime(segment), segment))
+                total += os.path.getsize(segment)
+
+        segments.sort()
+        for _, segment in segments:
+            if total <= self.max_total_size:
+                break
+            total -= os.path.getsize(segment)
+            os.remove(segment)
+
+
+def _lower_thread_priority():
+    # On Linux the nice value set through setpriority(PRIO_PROCESS, 0) only
+    # applies to the calling thread
+    try:
+        if hasattr(os, "setpriority"):
+            os.setpriority(os.PRIO_PROCESS, 0, 19)
+        else:
+            # Python < 3.3; nice() also applies to the calling thread only
+            os.nice(19)
+    except OSError as e:
+        # not logged: the logger writes to the files being rotated
+        sys.stderr.write("Could not lower the priority of the log rotation thread: {0}\n".format(e))
+
+
 class StdoutAppender(object):
     def __init__(self, level):
         self.level = level
@@ -172,6 +552,7 @@ class AppenderType(object):
     CONSOLE = 1
     STDOUT = 2
     TELEMETRY = 3
+    ASYNC_FILE = 4
 
 
 def add_logger_appender(appender_type, level=LogLevel.INFO, path=None):
@@ -217,6 +598,8 @@ def _create_logger_appender(appender_type, level=LogLevel.INFO, path=None):
         return StdoutAppender(level)
     elif appender_type == AppenderType.TELEMETRY:
         return TelemetryAppender(level, path)
+    elif appender_type == AppenderType.ASYNC_FILE:
+        return AsyncFileAppender(level, path)
     else:
         raise ValueError("Unknown appender type")
 
@@ -0,0 +1,355 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Counters, gauges and histograms shared by the agent's subsystems.
+
+Each metric has a category and a name, as the metric events sent by
+report_metric, and its values are kept per instance (a single label, e.g.
+the endpoint class or the extension name). The number of instances of a
+metric is bounded, and the instances past the bound are counted under
+OVERFLOW_INSTANCE, so the label must have a low cardinality.
+
+The values are cumulative. MetricsRegistry.flush() reports what changed
+since the previous flush, so that the telemetry is a compact aggregate of
+the period, while snapshot() returns the cumulative values.
+"""
+
+import bisect
+import os
+import re
+import threading
+
+import azurelinuxagent.common.logger as logger
+
+METRICS_DUMP_FILE_NAME = "metrics.txt"
+
+MAX_INSTANCES = 64
+OVERFLOW_INSTANCE = "[other]"
+
+# Upper bounds of the buckets of the latency histograms, in milliseconds
+LATENCY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Upper bounds of the buckets of the histograms of longer operations (e.g. the extension commands), in milliseconds
+DURATION_BUCKETS = (100, 1000, 5000, 10000, 30000, 60000, 300000, 600000, 1800000, 3600000)
+
+
+class _Metric(object):
+    def __init__(self, category, name):
+        self.category = category
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _get(self, instance):
+        """
+        Return the value of the instance, creating it if needed; the caller holds the lock
+        """
+        value = self._values.get(instance)
+        if value is None:
+            if len(self._values) >= MAX_INSTANCES and instance != OVERFLOW_INSTANCE:
+                return self._get(OVERFLOW_INSTANCE)
+            value = self._new_value()
+            self._values[instance] = value
+        return value
+
+    def _new_value(self):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """
+    A value that only increases, e.g. the number of requests
+    """
+    def _new_value(self):
+        return [0]
+
+    def inc(self, instance="", value=1):
+        with self._lock:
+            self._get(instance)[0] += value
+
+    def value(self, instance=""):
+        with self._lock:
+            value = self._values.get(instance)
+            return 0 if value is None else value[0]
+
+    def values(self):
+        """
+        Return the value of each instance
+
+        :rtype: dict(str: int)
+        """
+        with self._lock:
+            return dict((instance, value[0]) for instance, value in self._values.items())
+
+
+class Gauge(_Metric):
+    """
+    A value that is set, e.g. the depth of a queue
+    """
+    def _new_value(self):
+        return [0]
+
+    def set(self, value, instance=""):
+        with self._lock:
+            self._get(instance)[0] = value
+
+    def value(self, instance=""):
+        with self._lock:
+            value = self._values.get(instance)
+            return 0 if value is None else value[0]
+
+    def values(self):
+        with self._lock:
+            return dict((instance, value[0]) for instance, value in self._values.items())
+
+
+class HistogramValue(object):
+    """
+    The observations of an instance of a histogram: the count per bucket (the last one counts the observations
+    larger than the largest bound), their sum, the largest observation, and the largest observation since the
+    previous flush
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self.recent_max = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value > self.recent_max:
+            self.recent_max = value
+
+    def copy(self):
+        value = HistogramValue(self.bounds)
+        value.buckets = list(self.buckets)
+        value.count, value.sum, value.max, value.recent_max = self.count, self.sum, self.max, self.recent_max
+        return value
+
+    def subtract(self, other):
+        """
+        Return the observations made since 'other', a copy of this value taken at the previous flush
+        """
+        value = HistogramValue(self.bounds)
+        value.buckets = [a - b for a, b in zip(self.buckets, other.buckets)]
+        value.count, value.sum = self.count - other.count, self.sum - other.sum
+        value.max = value.recent_max = self.recent_max
+        return value
+
+    def percentile(self, percent):
+        """
+        Return the upper bound of the bucket that holds the observation of the given nearest rank, or the largest
+        observation if it is in the last bucket
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, (percent * self.count + 99) // 100)
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+
+class Histogram(_Metric):
+    """
+    The distribution of a value, e.g. the latency of requests, over fixed buckets
+    """
+    def __init__(self, category, name, bounds=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(category, name)
+        self.bounds = tuple(sorted(bounds))
+
+    def _new_value(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value, instance=""):
+        with self._lock:
+            self._get(instance).observe(value)
+
+    def values(self, flush=False):
+        """
+        Return a copy of the HistogramValue of each instance; if 'flush', start a new period for recent_max
+
+        :rtype: dict(str: HistogramValue)
+        """
+        with self._lock:
+            values = dict((instance, value.copy()) for instance, value in self._values.items())
+            if flush:
+                for value in self._values.values():
+                    value.recent_max = 0
+            return values
+
+
+class MetricsRegistry(object):
+    """
+    The metrics, by category and name. Getting a metric that is already registered returns it, so the subsystems
+    can get their metrics at import time, or when they use them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._flush_lock = threading.Lock()
+        self._flushed = {}
+
+    def _register(self, metric_type, category, name, *args):
+        with self._lock:
+            metric = self._metrics.get((category, name))
+            if metric is None:
+                metric = metric_type(category, name, *args)
+                self._metrics[(category, name)] = metric
+            elif not isinstance(metric, metric_type):
+                raise ValueError("Metric {0}/{1} is a {2}".format(category, name, type(metric).__name__))
+            return metric
+
+    def counter(self, category, name):
+        return self._register(Counter, category, name)
+
+    def gauge(self, category, name):
+        return self._register(Gauge, category, name)
+
+    def histogram(self, category, name, bounds=LATENCY_BUCKETS):
+        return self._register(Histogram, category, name, bounds)
+
+    def metrics(self):
+        """
+        Return the registered metrics, sorted by category and name
+        """
+        with self._lock:
+            return [self._metrics[key] for key in sorted(self._metrics.keys())]
+
+    def snapshot(self):
+        """
+        Return the cumulative values of the metrics, as a list of (metric, values by instance)
+        """
+        return [(metric, metric.values()) for metric in self.metrics()]
+
+    def flush(self, report):
+        """
+        Report the changes since the previous flush: the increase of each counter, the value of each gauge that
+        changed, and the count, mean, percentiles and max of the observations of each histogram.
+
+        :param report: Function with the signature of report_metric(category, counter, instance, value)
+        """
+        with self._flush_lock:
+            for metric in self.metrics():
+                self._flush_metric(metric, report)
+
+    def _flush_metric(self, metric, report):
+        values = metric.values(flush=True) if isinstance(metric, Histogram) else metric.values()
+        for instance in sorted(values.keys()):
+            value = values[instance]
+            key = (metric.category, metric.name, instance)
+            last = self._flushed.get(key)
+            self._flushed[key] = value
+
+            if isinstance(metric, Counter):
+                if value - (last or 0) > 0:
+                    report(metric.category, metric.name, instance, value - (last or 0))
+            elif isinstance(metric, Gauge):
+                if value != last:
+                    report(metric.category, metric.name, instance, value)
+            else:
+                if last is not None:
+                    value = value.subtract(last)
+                if value.count > 0:
+                    _report_histogram(report, metric, instance, value)
+
+    def reset(self):
+        """
+        Drop the values of all the metrics; the metrics stay registered
+        """
+        with self._flush_lock:
+            for metric in self.metrics():
+                with metric._lock:
+                    metric._values = {}
+            self._flushed = {}
+
+
+def _get_text_name(metric):
+    return "waagent_{0}_{1}".format(*[re.sub(r"[^a-z0-9]+", "_", part.lower()).strip("_")
+                                      for part in (metric.category, metric.name)])
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_text(snapshot):
+    """
+    Format a snapshot of the registry in the Prometheus text format, e.g.
+
+        # TYPE waagent_http_requests counter
+        waagent_http_requests{instance="wireserver"} 42
+    """
+    lines = []
+    for metric, values in snapshot:
+        name = _get_text_name(metric)
+        if isinstance(metric, Counter):
+            lines.append("# TYPE {0} counter".format(name))
+        elif isinstance(metric, Gauge):
+            lines.append("# TYPE {0} gauge".format(name))
+        else:
+            lines.append("# TYPE {0} histogram".format(name))
+
+        for instance in sorted(values.keys()):
+            value = values[instance]
+            label = 'instance="{0}"'.format(_escape_label(instance))
+            if not isinstance(metric, Histogram):
+                lines.append("{0}{{{1}}} {2}".format(name, label, value))
+                continue
+            cumulative = 0
+            for bound, count in zip(list(value.bounds) + ["+Inf"], value.buckets):
+                cumulative += count
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, label, bound, cumulative))
+            lines.append("{0}_sum{{{1}}} {2}".format(name, label, value.sum))
+            lines.append("{0}_count{{{1}}} {2}".format(name, label, value.count))
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    """
+    Write a snapshot of the registry, in the text format, to the given path
+    """
+    try:
+        temp_path = "{0}.tmp".format(path)
+        with open(temp_path, "w") as dump_file:
+            dump_file.write(format_text(registry.snapshot()))
+        os.rename(temp_path, path)
+        logger.info("Wrote the metrics to {0}", path)
+    except Exception as e:
+        logger.warn("Failed to write the metrics to {0}: {1}", path, e)
+
+
+def _report_histogram(report, metric, instance, value):
+    report(metric.category, "{0} Count".format(metric.name), instance, value.count)
+    report(metric.category, "{0} Mean".format(metric.name), instance, round(float(value.sum) / value.count, 3))
+    for percent in (50, 90, 99):
+        report(metric.category, "{0} P{1}".format(metric.name, percent), instance, value.percentile(percent))
+    report(metric.category, "{0} Max".format(metric.name), instance, value.max)
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,130 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+A Unix domain socket that serves a snapshot of the metrics registry, in the
+text format of metrics.format_text(), to each client that connects to it.
+The endpoint is read-only: it does not read what the clients send.
+"""
+
+import os
+import socket
+import threading
+
+import azurelinuxagent.common.conf as conf
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.metrics import registry, format_text
+
+METRICS_SOCKET_FILE_NAME = "metrics.sock"
+
+# Seconds a client is given to receive the snapshot
+CLIENT_TIMEOUT = 1
+
+# Seconds the server waits for a client before checking whether it was stopped
+ACCEPT_TIMEOUT = 1
+
+
+def get_metrics_socket_path():
+    return os.path.join(conf.get_lib_dir(), METRICS_SOCKET_FILE_NAME)
+
+
+class MetricsEndpoint(object):
+    """
+    Serves the snapshots from a daemon thread, one client at a time; a client that does not receive its snapshot
+    within CLIENT_TIMEOUT seconds is disconnected, so it cannot hold the endpoint.
+    """
+    def __init__(self, path, metrics_registry=registry):
+        self.path = path
+        self.registry = metrics_registry
+        self._socket = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        # the socket of a previous extension handler process
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._socket.listen(4)
+        self._socket.settimeout(ACCEPT_TIMEOUT)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="MetricsEndpoint")
+        self._thread.setDaemon(True)
+        self._thread.start()
+        logger.info("Serving the metrics on {0}", self.path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(ACCEPT_TIMEOUT * 2)
+            self._thread = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logger.warn("Metrics endpoint failed to accept a client: {0}", e)
+                self._stop.wait(ACCEPT_TIMEOUT)
+                continue
+            self._serve(client)
+
+    def _serve(self, client):
+        try:
+            client.settimeout(CLIENT_TIMEOUT)
+            client.sendall(format_text(self.registry.snapshot()).encode("utf-8"))
+        except Exception as e:
+            logger.verbose("Metrics endpoint failed to serve a client: {0}", e)
+        finally:
+            client.close()
+
+
+def query_metrics(path, timeout=5):
+    """
+    Return the snapshot served by the endpoint listening on the given path; raises socket.error if there is none
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        client.connect(path)
+        chunks = []
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+        return b"".join(chunks).decode("utf-8")
+    finally:
+        client.close()
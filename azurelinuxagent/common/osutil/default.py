@@ -43,6 +43,7 @@ from azurelinuxagent.common.exception import OSUtilError
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
+from azurelinuxagent.common.utils.metricsource import metric_sources, parse_proc_stat_cpu_ticks, PROC_STAT
 from azurelinuxagent.common.utils.networkutil import RouteEntry, NetworkInterfaceCard
 
 from pwd import getpwall
@@ -77,7 +78,6 @@ FIREWALL_DELETE_OWNER_ACCEPT = "iptables {0} -t security -D OUTPUT -d {1} -p tcp
 FIREWALL_DELETE_CONNTRACK_DROP = "iptables {0} -t security -D OUTPUT -d {1} -p tcp -m conntrack --ctstate INVALID,NEW -j DROP"
 
 PACKET_PATTERN = "^\s*(\d+)\s+(\d+)\s+DROP\s+.*{0}[^\d]*$"
-ALL_CPUS_REGEX = re.compile('^cpu .*')
 
 
 _enable_firewall = True
@@ -1260,17 +1260,17 @@ class DefaultOSUtil(object):
     @staticmethod
     def _get_proc_stat():
         """
-        Get the contents of /proc/stat.
+        Get the contents of /proc/stat, read through a descriptor kept open across calls.
         # cpu  813599 3940 909253 154538746 874851 0 6589 0 0 0
         # cpu0 401094 1516 453006 77276738 452939 0 3312 0 0 0
         # cpu1 412505 2423 456246 77262007 421912 0 3276 0 0 0
 
-        :return: A single string with the contents of /proc/stat
-        :rtype: str
+        :return: The contents of /proc/stat
+        :rtype: bytes
         """
         results = None
         try:
-            results = fileutil.read_file('/proc/stat')
+            results = metric_sources.read(PROC_STAT)
         except (OSError, IOError) as ex:
             logger.warn("Couldn't read /proc/stat: {0}".format(ex.strerror))
 
@@ -1283,14 +1283,10 @@ class DefaultOSUtil(object):
 
         :return: int
         """
-        system_cpu = 0
         proc_stat = DefaultOSUtil._get_proc_stat()
-        if proc_stat is not None:
-            for line in proc_stat.splitlines():
-                if ALL_CPUS_REGEX.match(line):
-                    system_cpu = sum(int(i) for i in line.split()[1:7])
-                    break
-        return system_cpu
+        if proc_stat is None:
+            return 0
+        return parse_proc_stat_cpu_ticks(proc_stat)
 
     def get_nic_state(self):
         """
@@ -0,0 +1,227 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+A sampling profiler of the agent's processes, toggled by SIGUSR2.
+
+While it runs, the profiler takes a sample of the stacks of all the threads
+of the process (sys._current_frames()) every SAMPLING_INTERVAL seconds.
+When it is stopped, or after MAX_DURATION seconds, it writes the number of
+samples of each stack, in the collapsed format of the flame graph tools
+("thread;module.function;module.function count"), to a file in the lib
+dir. The number of distinct stacks and the number of profiles kept are
+bounded, and so is the size of the files.
+"""
+
+import glob
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+import azurelinuxagent.common.conf as conf
+import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.utils.fileutil as fileutil
+
+SAMPLING_INTERVAL = 0.02
+MAX_DURATION = 10 * 60
+MAX_DEPTH = 64
+MAX_STACKS = 5000
+MAX_PROFILES = 10
+
+TRUNCATED_STACK = "[truncated]"
+
+PROFILE_FILE_NAME = "profile.{0}.{1}.{2}.collapsed"
+PROFILE_FILE_PATTERN = "profile.*.collapsed"
+PROFILER_PID_FILE_NAME = "profiler.{0}.pid"
+PROFILER_PID_FILE_PATTERN = "profiler.*.pid"
+
+
+def _get_frame_label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return re.sub(r"[; ]", "_", "{0}.{1}".format(module, code.co_name))
+
+
+def collapse_stack(thread_name, frame, max_depth=MAX_DEPTH):
+    """
+    Return the stack of the frame, from the outermost frame, in the collapsed format; the frames past max_depth
+    (from the innermost one) are dropped
+    """
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_get_frame_label(frame))
+        frame = frame.f_back
+    labels.append(re.sub(r"[; ]", "_", thread_name))
+    labels.reverse()
+    return ";".join(labels)
+
+
+class SamplingProfiler(object):
+    def __init__(self, name, output_dir, interval=SAMPLING_INTERVAL, max_duration=MAX_DURATION,
+                 max_stacks=MAX_STACKS, max_profiles=MAX_PROFILES):
+        """
+        :param str name: Name of the process (e.g. daemon), part of the file names of the profiles
+        """
+        self.name = name
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self.max_stacks = max_stacks
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stacks = {}
+        self.samples = 0
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def toggle(self):
+        """
+        Start the profiler, or stop it and write the profile; returns the path of the profile, or None
+        """
+        with self._lock:
+            if self.is_running():
+                return self._stop_and_write()
+            self._start()
+            return None
+
+    def start(self):
+        with self._lock:
+            if not self.is_running():
+                self._start()
+
+    def stop(self):
+        """
+        Stop the profiler and write the profile; returns its path, or None if the profiler was not running
+        """
+        with self._lock:
+            if self.is_running():
+                return self._stop_and_write()
+            return None
+
+    def _start(self):
+        self._stacks = {}
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler")
+        self._thread.setDaemon(True)
+        self._thread.start()
+        logger.info("Started the sampling profiler ({0} samples per second, for up to {1} seconds)",
+                    int(1 / self.interval), self.max_duration)
+
+    def _stop_and_write(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self._write()
+
+    def _run(self):
+        end = time.time() + self.max_duration
+        while not self._stop.is_set():
+            self.sample()
+            if time.time() >= end:
+                logger.info("The sampling profiler ran for {0} seconds, stopping it", self.max_duration)
+                self._write()
+                return
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        """
+        Add a sample of the stacks of the threads other than the current one
+        """
+        current = threading.current_thread().ident
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            stack = collapse_stack(names.get(ident, "Thread-{0}".format(ident)), frame)
+            if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                stack = TRUNCATED_STACK
+            self._stacks[stack] = self._stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def _write(self):
+        stacks = self._stacks
+        self._stacks = {}
+        if len(stacks) == 0:
+            return None
+
+        path = os.path.join(self.output_dir, PROFILE_FILE_NAME.format(self.name, os.getpid(),
+                                                                       time.strftime("%Y%m%d%H%M%S")))
+        try:
+            lines = ["{0} {1}".format(stack, count)
+                     for stack, count in sorted(stacks.items(), key=lambda item: (-item[1], item[0]))]
+            fileutil.write_file(path, "\n".join(lines) + "\n")
+            logger.info("Wrote the profile of {0} samples to {1}", self.samples, path)
+        except Exception as e:
+            logger.warn("Failed to write the profile to {0}: {1}", path, e)
+            return None
+
+        self._remove_old_profiles()
+        return path
+
+    def _remove_old_profiles(self):
+        profiles = sorted(glob.glob(os.path.join(self.output_dir, PROFILE_FILE_PATTERN)), key=os.path.getmtime)
+        for profile in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            try:
+                os.remove(profile)
+            except OSError as e:
+                logger.warn("Failed to remove the profile {0}: {1}", profile, e)
+
+
+def install_profiler(name):
+    """
+    Toggle the profiler of this process on SIGUSR2, and record the process in the lib dir for get_profiled_pids()
+    """
+    profiler = SamplingProfiler(name, conf.get_lib_dir())
+
+    def toggle(signum, frame):
+        # the signal may interrupt a thread holding a lock the profiler needs; toggle it from another thread
+        thread = threading.Thread(target=profiler.toggle, name="SamplingProfilerToggle")
+        thread.setDaemon(True)
+        thread.start()
+
+    signal.signal(signal.SIGUSR2, toggle)
+    # restart the system calls the signal interrupts (on Python 2 they would fail with EINTR)
+    signal.siginterrupt(signal.SIGUSR2, False)
+    fileutil.write_file(os.path.join(conf.get_lib_dir(), PROFILER_PID_FILE_NAME.format(name)), str(os.getpid()))
+    return profiler
+
+
+def get_profiled_pids():
+    """
+    Return the (name, pid) of the running processes that installed the profiler
+    """
+    pids = []
+    for pid_file in sorted(glob.glob(os.path.join(conf.get_lib_dir(), PROFILER_PID_FILE_PATTERN))):
+        name = os.path.basename(pid_file)[len("profiler."):-len(".pid")]
+        try:
+            pid = int(fileutil.read_file(pid_file).strip())
+            # the pid may have been reused by another process; the default action of SIGUSR2 terminates it
+            cmdline = fileutil.read_file("/proc/{0}/cmdline".format(pid)).split("\0")
+        except (IOError, OSError, ValueError):
+            continue
+        if any(arg.lstrip("-/") == name for arg in cmdline):
+            pids.append((name, pid))
+    return pids
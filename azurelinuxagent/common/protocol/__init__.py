@@ -16,6 +16,7 @@
 #
 
 from azurelinuxagent.common.protocol.util import get_protocol_util, \
+                                                 reset_protocol_util, \
                                                  OVF_FILE_NAME, \
                                                  TAG_FILE_NAME
 
@@ -33,10 +33,133 @@ def validate_param(name, val, expected_type):
                              "").format(name, expected_type, type(val)))
 
 
+# Types that get_properties and set_properties return as-is
+_SCALAR_TYPES = set([type(None), bool, int, float, str, ustr])
+try:
+    _SCALAR_TYPES.add(long)
+except NameError:
+    pass
+
+# Per-class serializers and field lists, built once per DataContract class
+_SLOTS = {}
+_TO_DATA_FUNCTIONS = {}
+_FROM_DATA_FIELDS = {}
+
+
+def _get_slots(cls):
+    """
+    Return the fields declared through __slots__ by the class and its bases,
+    or None if instances of the class have a __dict__
+    """
+    if cls in _SLOTS:
+        return _SLOTS[cls]
+    slots = []
+    for klass in reversed(cls.__mro__):
+        if klass is object:
+            continue
+        if '__slots__' not in klass.__dict__:
+            slots = None
+            break
+        klass_slots = klass.__dict__['__slots__']
+        if isinstance(klass_slots, str):
+            klass_slots = (klass_slots,)
+        slots.extend([f for f in klass_slots if f not in ('__dict__', '__weakref__')])
+    _SLOTS[cls] = None if slots is None else tuple(slots)
+    return _SLOTS[cls]
+
+
+def get_attributes(obj):
+    """
+    Return a dictionary with the attributes of a DataContract; the
+    equivalent of vars() that also supports classes using __slots__
+    """
+    slots = _get_slots(type(obj))
+    if slots is None:
+        return vars(obj)
+    attributes = {}
+    for field in slots:
+        if hasattr(obj, field):
+            attributes[field] = getattr(obj, field)
+    return attributes
+
+
+def _compile_to_data(fields, slotted):
+    """
+    Generate a function converting an object with the given attributes to a
+    dictionary, equivalent to the reflective conversion done by
+    get_properties. The function returns None if the object's attributes
+    differ from 'fields' (e.g. attributes added after construction, or slots
+    that were never assigned).
+    """
+    items = []
+    for i, field in enumerate(fields):
+        items.append("{0!r}: v{1} if type(v{1}) in scalar_types else get_properties(v{1})".format(field, i))
+    variables = ", ".join(["v{0}".format(i) for i in range(len(fields))] + [""])
+    if slotted:
+        source = "def to_data(obj):\n"
+        if len(fields) > 0:
+            source += "    try:\n" \
+                      "        {0} = {1}\n" \
+                      "    except AttributeError:\n" \
+                      "        return None\n".format(variables,
+                                                      ", ".join(["obj.{0}".format(f) for f in fields] + [""]))
+    else:
+        source = "def to_data(obj):\n" \
+                 "    attributes = obj.__dict__\n" \
+                 "    if len(attributes) != {0}:\n" \
+                 "        return None\n".format(len(fields))
+        if len(fields) > 0:
+            source += "    try:\n" \
+                      "        {0} = {1}\n" \
+                      "    except KeyError:\n" \
+                      "        return None\n".format(variables,
+                                                     ", ".join(["attributes[{0!r}]".format(f) for f in fields] + [""]))
+    source += "    return {{{0}}}\n".format(", ".join(items))
+    namespace = {"scalar_types": _SCALAR_TYPES, "get_properties": get_properties}
+    exec(compile(source, "<to_data>", "exec"), namespace)
+    return namespace["to_data"]
+
+
+def _get_to_data(obj):
+    to_data = _TO_DATA_FUNCTIONS.get(type(obj))
+    if to_data is None:
+        slots = _get_slots(type(obj))
+        if slots is None:
+            to_data = _compile_to_data(tuple(obj.__dict__), False)
+        else:
+            to_data = _compile_to_data(slots, True)
+        _TO_DATA_FUNCTIONS[type(obj)] = to_data
+    return to_data
+
+
+def _get_from_data_fields(obj):
+    """
+    Return a dictionary mapping each field of the object's class to True if
+    the field holds a nested DataContract or DataContractList
+    """
+    fields = _FROM_DATA_FIELDS.get(type(obj))
+    if fields is None:
+        fields = {}
+        for field, value in get_attributes(obj).items():
+            fields[field] = isinstance(value, (DataContract, DataContractList))
+        _FROM_DATA_FIELDS[type(obj)] = fields
+    return fields
+
+
 def set_properties(name, obj, data):
     if isinstance(obj, DataContract):
         validate_param("Property '{0}'".format(name), data, dict)
+        fields = _get_from_data_fields(obj)
+        attributes = None if _get_slots(type(obj)) is not None else obj.__dict__
         for prob_name, prob_val in data.items():
+            if fields.get(prob_name) is False:
+                if attributes is None:
+                    setattr(obj, prob_name, prob_val)
+                    continue
+                elif prob_name in attributes:
+                    attributes[prob_name] = prob_val
+                    continue
+
             prob_full_name = "{0}.{1}".format(name, prob_name)
             try:
                 prob = getattr(obj, prob_name)
@@ -58,24 +181,28 @@ def set_properties(name, obj, data):
 
 
 def get_properties(obj):
-    if isinstance(obj, DataContract):
-        data = {}
-        props = vars(obj)
-        for prob_name, prob in list(props.items()):
-            data[prob_name] = get_properties(prob)
+    if type(obj) in _SCALAR_TYPES:
+        return obj
+    elif isinstance(obj, DataContract):
+        data = _get_to_data(obj)(obj)
+        if data is None:
+            data = {}
+            for prob_name, prob in list(get_attributes(obj).items()):
+                data[prob_name] = get_properties(prob)
         return data
     elif isinstance(obj, DataContractList):
-        data = []
-        for item in obj:
-            item_data = get_properties(item)
-            data.append(item_data)
-        return data
+        return [get_properties(item) for item in obj]
     else:
         return obj
 
 
 class DataContract(object):
-    pass
+    """
+    Base class of the objects exchanged with the host. Frequently allocated
+    contracts declare their fields through __slots__ to avoid a per-instance
+    __dict__; the others keep a __dict__ and may hold any attribute.
+    """
+    __slots__ = ()
 
 
 class DataContractList(list):
@@ -130,6 +257,8 @@ class CertList(DataContract):
 
 # TODO: confirm vmagent manifest schema
 class VMAgentManifestUri(DataContract):
+    __slots__ = ("uri",)
+
     def __init__(self, uri=None):
         self.uri = uri
 
@@ -146,6 +275,8 @@ class VMAgentManifestList(DataContract):
 
 
 class Extension(DataContract):
+    __slots__ = ("name", "sequenceNumber", "publicSettings", "protectedSettings", "certificateThumbprint")
+
     def __init__(self,
                  name=None,
                  sequenceNumber=None,
@@ -160,6 +291,8 @@ class Extension(DataContract):
 
 
 class ExtHandlerProperties(DataContract):
+    __slots__ = ("version", "dependencyLevel", "state", "extensions")
+
     def __init__(self):
         self.version = None
         self.dependencyLevel = None
@@ -168,11 +301,15 @@ class ExtHandlerProperties(DataContract):
 
 
 class ExtHandlerVersionUri(DataContract):
+    __slots__ = ("uri",)
+
     def __init__(self):
         self.uri = None
 
 
 class ExtHandler(DataContract):
+    __slots__ = ("name", "properties", "versionUris")
+
     def __init__(self, name=None):
         self.name = name
         self.properties = ExtHandlerProperties()
@@ -195,6 +332,8 @@ class ExtHandlerList(DataContract):
 
 
 class ExtHandlerPackageUri(DataContract):
+    __slots__ = ("uri",)
+
     def __init__(self, uri=None):
         self.uri = uri
 
@@ -228,6 +367,8 @@ class ProvisionStatus(DataContract):
 
 
 class ExtensionSubStatus(DataContract):
+    __slots__ = ("name", "status", "code", "message")
+
     def __init__(self, name=None, status=None, code=None, message=None):
         self.name = name
         self.status = status
@@ -236,6 +377,8 @@ class ExtensionSubStatus(DataContract):
 
 
 class ExtensionStatus(DataContract):
+    __slots__ = ("configurationAppliedTime", "operation", "status", "sequenceNumber", "code", "message", "substatusList")
+
     def __init__(self,
                  configurationAppliedTime=None,
                  operation=None,
@@ -253,6 +396,8 @@ class ExtensionStatus(DataContract):
 
 
 class ExtHandlerStatus(DataContract):
+    __slots__ = ("name", "version", "status", "code", "message", "extensions")
+
     def __init__(self,
                  name=None,
                  version=None,
@@ -284,12 +429,16 @@ class VMStatus(DataContract):
 
 
 class TelemetryEventParam(DataContract):
+    __slots__ = ("name", "value")
+
     def __init__(self, name=None, value=None):
         self.name = name
         self.value = value
 
 
 class TelemetryEvent(DataContract):
+    __slots__ = ("eventId", "providerId", "parameters")
+
     def __init__(self, eventId=None, providerId=None):
         self.eventId = eventId
         self.providerId = providerId
@@ -59,8 +59,30 @@ class _nameset(set):
 prots = _nameset(("WireProtocol", "MetadataProtocol"))
 
 
+_protocol_util = None
+_protocol_util_lock = threading.Lock()
+
+
 def get_protocol_util():
-    return ProtocolUtil()
+    """
+    Return the ProtocolUtil shared by all the handlers of the process, so
+    that they all use the same protocol instance (and WireClient)
+    """
+    global _protocol_util
+    with _protocol_util_lock:
+        if _protocol_util is None:
+            _protocol_util = ProtocolUtil()
+        return _protocol_util
+
+
+def reset_protocol_util():
+    """
+    Discard the shared ProtocolUtil; the next call to get_protocol_util
+    creates a new one
+    """
+    global _protocol_util
+    with _protocol_util_lock:
+        _protocol_util = None
 
 
 class ProtocolUtil(object):
@@ -70,7 +92,7 @@ class ProtocolUtil(object):
     are invoked, wire protocol and metadata protocols.
     """
     def __init__(self):
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
         self.protocol = None
         self.osutil = get_osutil()
         self.dhcp_handler = get_dhcp_handler()
@@ -262,18 +284,19 @@ class ProtocolUtil(object):
         Cleanup previous saved endpoint.
         """
         logger.info("Clean protocol")
-        self.protocol = None
-        protocol_file_path = self._get_protocol_file_path()
-        if not os.path.isfile(protocol_file_path):
-            return
-
-        try:
-            os.remove(protocol_file_path)
-        except IOError as e:
-            # Ignore file-not-found errors (since the file is being removed)
-            if e.errno == errno.ENOENT:
+        with self.lock:
+            self.protocol = None
+            protocol_file_path = self._get_protocol_file_path()
+            if not os.path.isfile(protocol_file_path):
                 return
-            logger.error("Failed to clear protocol endpoint: {0}", e)
+
+            try:
+                os.remove(protocol_file_path)
+            except IOError as e:
+                # Ignore file-not-found errors (since the file is being removed)
+                if e.errno == errno.ENOENT:
+                    return
+                logger.error("Failed to clear protocol endpoint: {0}", e)
 
     def get_protocol(self, by_file=False):
         """
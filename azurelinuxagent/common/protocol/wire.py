@@ -16,11 +16,13 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 import datetime
+import hashlib
 import json
 import os
 import random
 import re
 import sys
+import threading
 import time
 import traceback
 import xml.sax.saxutils as saxutils
@@ -31,14 +33,16 @@ import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.utils.fileutil as fileutil
 import azurelinuxagent.common.utils.textutil as textutil
 
-from azurelinuxagent.common.exception import ProtocolNotFoundError, \
+from azurelinuxagent.common.exception import CryptError, ProtocolNotFoundError, \
                                             ResourceGoneError
 from azurelinuxagent.common.future import httpclient, bytebuffer
+from azurelinuxagent.common.metrics import registry
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol, URI_FORMAT_GET_EXTENSION_ARTIFACT, \
     HOST_PLUGIN_PORT
 from azurelinuxagent.common.protocol.restapi import *
 from azurelinuxagent.common.utils.archive import StateFlusher
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
+from azurelinuxagent.common.utils.filecache import FileCache
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, \
     findtext, getattrib, gettext, remove_bom, get_bytes_from_pem, parse_json
 from azurelinuxagent.common.version import AGENT_NAME
@@ -59,17 +63,25 @@ CERTS_FILE_NAME = "Certificates.xml"
 REMOTE_ACCESS_FILE_NAME = "RemoteAccess.{0}.xml"
 P7M_FILE_NAME = "Certificates.p7m"
 PEM_FILE_NAME = "Certificates.pem"
+CERTS_STATE_FILE_NAME = "Certificates.json"
 EXT_CONF_FILE_NAME = "ExtensionsConfig.{0}.xml"
 MANIFEST_FILE_NAME = "{0}.{1}.manifest.xml"
 AGENTS_MANIFEST_FILE_NAME = "{0}.{1}.agentsManifest"
 TRANSPORT_CERT_FILE_NAME = "TransportCert.pem"
 TRANSPORT_PRV_FILE_NAME = "TransportPrivate.pem"
 
+MAX_EVENT_BUFFER_SIZE = 63 * 1024
+MAX_CONCURRENT_TELEMETRY_REQUESTS = 4
+TELEMETRY_DATA_FORMAT = u'<?xml version="1.0"?><TelemetryData version="1.0">{0}</TelemetryData>'
+
 PROTOCOL_VERSION = "2012-11-30"
 ENDPOINT_FINE_NAME = "WireServer"
 
 SHORT_WAITING_INTERVAL = 1  # 1 second
 
+# The status uploads by route (hostplugin, direct), and those skipped (the goal state is stale) or failed
+_status_uploads = registry.counter("status", "Uploads")
+
 
 class UploadError(HttpError):
     pass
@@ -128,7 +140,7 @@ class WireProtocol(Protocol):
     def get_incarnation(self):
         path = os.path.join(conf.get_lib_dir(), INCARNATION_FILE_NAME)
         if os.path.exists(path):
-            return fileutil.read_file(path)
+            return self.client.fetch_incarnation()
         else:
             return 0
 
@@ -494,39 +506,214 @@ class StatusBlob(object):
             start = end
 
 
+_EVENT_PARAM_TYPES = {
+    int: 'mt:uint64',
+    str: 'mt:wstr',
+    bool: 'mt:bool',
+    float: 'mt:float64'
+}
+
+
 def event_param_to_v1(param):
     param_format = '<Param Name="{0}" Value={1} T="{2}" />'
     param_type = type(param.value)
-    attr_type = ""
-    if param_type is int:
-        attr_type = 'mt:uint64'
-    elif param_type is str:
-        attr_type = 'mt:wstr'
-    elif ustr(param_type).count("'unicode'") > 0:
-        attr_type = 'mt:wstr'
-    elif param_type is bool:
-        attr_type = 'mt:bool'
-    elif param_type is float:
-        attr_type = 'mt:float64'
+    attr_type = _EVENT_PARAM_TYPES.get(param_type)
+    if attr_type is None:
+        attr_type = 'mt:wstr' if ustr(param_type).count("'unicode'") > 0 else ""
     return param_format.format(param.name,
                                saxutils.quoteattr(ustr(param.value)),
                                attr_type)
 
 
 def event_to_v1(event):
-    params = ""
-    for param in event.parameters:
-        params += event_param_to_v1(param)
+    params = "".join([event_param_to_v1(param) for param in event.parameters])
     event_str = ('<Event id="{0}">'
                  '<![CDATA[{1}]]>'
                  '</Event>').format(event.eventId, params)
     return event_str
 
 
+class TelemetryBatchPacker(object):
+    """
+    Packs serialized events into TelemetryData payloads of at most max_size
+    bytes.
+
+    Event sizes are computed once, when the events are added. Payloads may
+    hold events from several providers (one <Provider> element each) and are
+    filled first-fit, in the order the events were added, which leaves far
+    less unused space than flushing a per-provider buffer whenever the next
+    event does not fit. An event never goes to a payload before the one
+    holding the previous event of its provider, so the events of a provider
+    keep their order within and across payloads, provided the payloads are
+    sent in order (see get_batches()).
+    """
+    _PROVIDER_FORMAT = u'<Provider id="{0}">{1}</Provider>'
+
+    def __init__(self, max_size=MAX_EVENT_BUFFER_SIZE):
+        self.max_size = max_size
+        self._events = []
+
+    def add(self, provider_id, event_str):
+        """
+        Add a serialized event; return False if the event alone exceeds the
+        payload size
+        """
+        size = len(event_str.encode('utf-8'))
+        if size + self._get_overhead(provider_id) > self.max_size:
+            return False
+        self._events.append((size, len(self._events), provider_id, event_str))
+        return True
+
+    def get_payloads(self):
+        return [payload for _, payload in self.get_batches()]
+
+    def get_batches(self):
+        """
+        Return the (provider ids, payload) of the payloads, in order: for
+        each provider, the payloads holding its events must be sent in the
+        order they are returned
+        """
+        bins = []
+        last_bin = {}
+        for size, index, provider_id, event_str in self._events:
+            bin_index = last_bin.get(provider_id, 0)
+            while bin_index < len(bins) and not bins[bin_index].fits(provider_id, size):
+                bin_index += 1
+            if bin_index == len(bins):
+                bins.append(_TelemetryPayloadBin(self.max_size))
+            bins[bin_index].add(provider_id, size, index, event_str)
+            last_bin[provider_id] = bin_index
+
+        batches = [(frozenset(b.providers.keys()), b.to_payload()) for b in bins]
+        self._events = []
+        return batches
+
+    @staticmethod
+    def _get_payload_overhead():
+        return len(TELEMETRY_DATA_FORMAT.format(u"").encode('utf-8'))
+
+    @staticmethod
+    def _get_provider_overhead(provider_id):
+        return len(TelemetryBatchPacker._PROVIDER_FORMAT.format(provider_id, u"").encode('utf-8'))
+
+    def _get_overhead(self, provider_id):
+        return self._get_payload_overhead() + self._get_provider_overhead(provider_id)
+
+
+class _TelemetryPayloadBin(object):
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = TelemetryBatchPacker._get_payload_overhead()
+        self.providers = {}
+
+    def _get_cost(self, provider_id, size):
+        if provider_id in self.providers:
+            return size
+        return size + TelemetryBatchPacker._get_provider_overhead(provider_id)
+
+    def fits(self, provider_id, size):
+        return self.size + self._get_cost(provider_id, size) <= self.max_size
+
+    def add(self, provider_id, size, index, event_str):
+        self.size += self._get_cost(provider_id, size)
+        self.providers.setdefault(provider_id, []).append((index, event_str))
+
+    def to_payload(self):
+        providers = []
+        for provider_id in sorted(self.providers.keys(), key=lambda p: min(self.providers[p])[0]):
+            events = [e[1] for e in sorted(self.providers[provider_id])]
+            providers.append(TelemetryBatchPacker._PROVIDER_FORMAT.format(provider_id, u"".join(events)))
+        return TELEMETRY_DATA_FORMAT.format(u"".join(providers))
+
+
+class GoalStateCache(object):
+    """
+    Parsed goal state documents of the current incarnation, shared by all the
+    threads using a WireClient. Each document is parsed once per incarnation.
+    The current incarnation is switched only by WireClient._update_goal_state
+    (under its goal_state_lock), which drops the documents of the previous
+    one; documents of any other incarnation are parsed but not cached, so a
+    thread still reading an older incarnation cannot evict the current one.
+    """
+    GOAL_STATE = "GoalState"
+    HOSTING_ENV = "HostingEnvironmentConfig"
+    SHARED_CONF = "SharedConfig"
+    CERTS = "Certificates"
+    EXT_CONF = "ExtensionsConfig"
+    REMOTE_ACCESS = "RemoteAccess"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._incarnation = None
+        self._documents = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def incarnation(self):
+        return self._incarnation
+
+    def set_incarnation(self, incarnation):
+        """
+        Make the given incarnation the current one, dropping the documents of
+        the previous incarnation
+        """
+        with self._lock:
+            if incarnation != self._incarnation:
+                self._incarnation = incarnation
+                self._documents = {}
+
+    def get(self, name, incarnation, parse):
+        """
+        Return the document of the given incarnation, invoking 'parse' to
+        create it if it is not in the cache. The document is cached only if
+        its incarnation is the current one (or if there is no current
+        incarnation yet, e.g. before the first goal state update of the
+        process).
+        """
+        with self._lock:
+            if incarnation == self._incarnation and name in self._documents:
+                self.hits += 1
+                return self._documents[name]
+            self.misses += 1
+            document = parse()
+            if self._incarnation is None:
+                self._incarnation = incarnation
+            self.add(name, incarnation, document)
+            return document
+
+    def add(self, name, incarnation, document):
+        """
+        Cache the document if its incarnation is the current one
+        """
+        with self._lock:
+            if incarnation == self._incarnation:
+                self._documents[name] = document
+
+    def clear(self):
+        with self._lock:
+            self._incarnation = None
+            self._documents = {}
+
+    def get_and_reset_counts(self):
+        """
+        Return the (hits, misses) since the last call
+        """
+        with self._lock:
+            counts = (self.hits, self.misses)
+            self.hits = 0
+            self.misses = 0
+            return counts
+
+
 class WireClient(object):
     def __init__(self, endpoint):
         logger.info("Wire server endpoint:{0}", endpoint)
         self.endpoint = endpoint
+        self.goal_state_cache = GoalStateCache()
+        self.goal_state_lock = threading.RLock()
+        self.file_cache = FileCache()
+        self.cached_incarnation = None
         self.goal_state = None
         self.updated = None
         self.hosting_env = None
@@ -573,20 +760,38 @@ class WireClient(object):
                                     headers=headers)
         return self.decode_config(resp.read())
 
-    def fetch_cache(self, local_file):
+    def fetch_cache(self, local_file, parse=None):
+        """
+        Read a file of the lib dir, and optionally parse it, through the file
+        cache (see FileCache.read)
+        """
         if not os.path.isfile(local_file):
             raise ProtocolError("{0} is missing.".format(local_file))
         try:
-            return fileutil.read_file(local_file)
-        except IOError as e:
+            return self.file_cache.read(local_file, parse)
+        except (IOError, OSError) as e:
             raise ProtocolError("Failed to read cache: {0}".format(e))
 
-    def save_cache(self, local_file, data):
+    def fetch_incarnation(self):
+        """
+        Return the incarnation saved in the lib dir. When it changes, the
+        cached contents of the goal state files are evicted.
+        """
+        incarnation_file = os.path.join(conf.get_lib_dir(), INCARNATION_FILE_NAME)
+        incarnation = self.fetch_cache(incarnation_file)
+        if incarnation != self.cached_incarnation:
+            self.file_cache.evict(keep=[incarnation_file])
+            self.cached_incarnation = incarnation
+        return incarnation
+
+    def save_cache(self, local_file, data, fsync_directory=False):
         try:
-            fileutil.write_file(local_file, data)
+            fileutil.write_file_if_changed(local_file, data, fsync_directory=fsync_directory)
         except IOError as e:
             fileutil.clean_ioerror(e, paths=[local_file])
             raise ProtocolError("Failed to write cache: {0}".format(e))
+        finally:
+            self.file_cache.invalidate(local_file)
 
     @staticmethod
     def call_storage_service(http_req, *args, **kwargs):
@@ -707,6 +912,7 @@ class WireClient(object):
                                      self.get_header())
         self.save_cache(local_file, xml_text)
         self.hosting_env = HostingEnv(xml_text)
+        self.goal_state_cache.add(GoalStateCache.HOSTING_ENV, goal_state.incarnation, self.hosting_env)
 
     def update_shared_conf(self, goal_state):
         if goal_state.shared_conf_uri is None:
@@ -716,6 +922,7 @@ class WireClient(object):
                                      self.get_header())
         self.save_cache(local_file, xml_text)
         self.shared_conf = SharedConfig(xml_text)
+        self.goal_state_cache.add(GoalStateCache.SHARED_CONF, goal_state.incarnation, self.shared_conf)
 
     def update_certs(self, goal_state):
         if goal_state.certs_uri is None:
@@ -725,34 +932,38 @@ class WireClient(object):
                                      self.get_header_for_cert())
         self.save_cache(local_file, xml_text)
         self.certs = Certificates(self, xml_text)
+        self.goal_state_cache.add(GoalStateCache.CERTS, goal_state.incarnation, self.certs)
 
     def update_remote_access_conf(self, goal_state):
         if goal_state.remote_access_uri is None:
             # Nothing in accounts data.  Just return, nothing to do.
+            self.goal_state_cache.add(GoalStateCache.REMOTE_ACCESS, goal_state.incarnation, None)
             return
         xml_text = self.fetch_config(goal_state.remote_access_uri, 
                                      self.get_header_for_cert())
         self.remote_access = RemoteAccess(xml_text)
         local_file = os.path.join(conf.get_lib_dir(), REMOTE_ACCESS_FILE_NAME.format(self.remote_access.incarnation))
         self.save_cache(local_file, xml_text)
+        self.goal_state_cache.add(GoalStateCache.REMOTE_ACCESS, goal_state.incarnation, self.remote_access)
 
     def get_remote_access(self):
-        incarnation_file = os.path.join(conf.get_lib_dir(),
-                                        INCARNATION_FILE_NAME)
-        incarnation = self.fetch_cache(incarnation_file)
-        file_name = REMOTE_ACCESS_FILE_NAME.format(incarnation)
-        remote_access_file = os.path.join(conf.get_lib_dir(), file_name)
-        if not os.path.isfile(remote_access_file):
-            # no remote access data.
-            return None
-        xml_text = self.fetch_cache(remote_access_file)
-        remote_access = RemoteAccess(xml_text)
-        return remote_access
+        incarnation = self.fetch_incarnation()
+
+        def parse():
+            file_name = REMOTE_ACCESS_FILE_NAME.format(incarnation)
+            remote_access_file = os.path.join(conf.get_lib_dir(), file_name)
+            if not os.path.isfile(remote_access_file):
+                # no remote access data.
+                return None
+            return self.fetch_cache(remote_access_file, RemoteAccess)
+
+        return self.goal_state_cache.get(GoalStateCache.REMOTE_ACCESS, incarnation, parse)
         
     def update_ext_conf(self, goal_state):
         if goal_state.ext_uri is None:
             logger.info("ExtensionsConfig.xml uri is empty")
             self.ext_conf = ExtensionsConfig(None)
+            self.goal_state_cache.add(GoalStateCache.EXT_CONF, goal_state.incarnation, self.ext_conf)
             return
         incarnation = goal_state.incarnation
         local_file = os.path.join(conf.get_lib_dir(),
@@ -760,8 +971,18 @@ class WireClient(object):
         xml_text = self.fetch_config(goal_state.ext_uri, self.get_header())
         self.save_cache(local_file, xml_text)
         self.ext_conf = ExtensionsConfig(xml_text)
+        self.goal_state_cache.add(GoalStateCache.EXT_CONF, incarnation, self.ext_conf)
 
     def update_goal_state(self, forced=False, max_retry=3):
+        """
+        Fetch the goal state and, if its incarnation changed (or if forced),
+        all its documents. Concurrent callers are serialized, so the documents
+        of an incarnation are fetched and parsed only once.
+        """
+        with self.goal_state_lock:
+            self._update_goal_state(forced, max_retry)
+
+    def _update_goal_state(self, forced, max_retry):
         incarnation_file = os.path.join(conf.get_lib_dir(),
                                         INCARNATION_FILE_NAME)
         uri = GOAL_STATE_URI.format(self.endpoint)
@@ -772,12 +993,12 @@ class WireClient(object):
                 if goal_state is None:
                     xml_text = self.fetch_config(uri, self.get_header())
                     goal_state = GoalState(xml_text)
+                    self.goal_state_cache.set_incarnation(goal_state.incarnation)
 
                     if not forced:
                         last_incarnation = None
                         if os.path.isfile(incarnation_file):
-                            last_incarnation = fileutil.read_file(
-                                                    incarnation_file)
+                            last_incarnation = self.fetch_incarnation()
                         new_incarnation = goal_state.incarnation
                         if last_incarnation is not None and \
                                         last_incarnation == new_incarnation:
@@ -786,6 +1007,7 @@ class WireClient(object):
                 self.goal_state_flusher.flush(datetime.utcnow())
 
                 self.goal_state = goal_state
+                self.goal_state_cache.add(GoalStateCache.GOAL_STATE, goal_state.incarnation, goal_state)
                 file_name = GOAL_STATE_FILE_NAME.format(goal_state.incarnation)
                 goal_state_file = os.path.join(conf.get_lib_dir(), file_name)
                 self.save_cache(goal_state_file, xml_text)
@@ -794,7 +1016,9 @@ class WireClient(object):
                 self.update_certs(goal_state)
                 self.update_ext_conf(goal_state)
                 self.update_remote_access_conf(goal_state)
-                self.save_cache(incarnation_file, goal_state.incarnation)
+                # the goal state files are all in the lib dir; syncing it once, when
+                # the incarnation is saved, persists their renames as well
+                self.save_cache(incarnation_file, goal_state.incarnation, fsync_directory=True)
 
                 if self.host_plugin is not None:
                     self.host_plugin.container_id = goal_state.container_id
@@ -825,30 +1049,28 @@ class WireClient(object):
 
     def get_goal_state(self):
         if self.goal_state is None:
-            incarnation_file = os.path.join(conf.get_lib_dir(),
-                                            INCARNATION_FILE_NAME)
-            incarnation = self.fetch_cache(incarnation_file)
-
-            file_name = GOAL_STATE_FILE_NAME.format(incarnation)
-            goal_state_file = os.path.join(conf.get_lib_dir(), file_name)
-            xml_text = self.fetch_cache(goal_state_file)
-            self.goal_state = GoalState(xml_text)
+            incarnation = self.fetch_incarnation()
+
+            def parse():
+                file_name = GOAL_STATE_FILE_NAME.format(incarnation)
+                goal_state_file = os.path.join(conf.get_lib_dir(), file_name)
+                return self.fetch_cache(goal_state_file, GoalState)
+
+            self.goal_state = self.goal_state_cache.get(GoalStateCache.GOAL_STATE, incarnation, parse)
         return self.goal_state
 
     def get_hosting_env(self):
         if self.hosting_env is None:
             local_file = os.path.join(conf.get_lib_dir(),
                                       HOSTING_ENV_FILE_NAME)
-            xml_text = self.fetch_cache(local_file)
-            self.hosting_env = HostingEnv(xml_text)
+            self.hosting_env = self.fetch_cache(local_file, HostingEnv)
         return self.hosting_env
 
     def get_shared_conf(self):
         if self.shared_conf is None:
             local_file = os.path.join(conf.get_lib_dir(),
                                       SHARED_CONF_FILE_NAME)
-            xml_text = self.fetch_cache(local_file)
-            self.shared_conf = SharedConfig(xml_text)
+            self.shared_conf = self.fetch_cache(local_file, SharedConfig)
         return self.shared_conf
 
     def get_certs(self):
@@ -863,10 +1085,12 @@ class WireClient(object):
     def get_current_handlers(self):
         handler_list = list()
         try:
-            incarnation = self.fetch_cache(os.path.join(conf.get_lib_dir(),
-                                                        INCARNATION_FILE_NAME))
-            ext_conf = ExtensionsConfig(self.fetch_cache(os.path.join(conf.get_lib_dir(),
-                                                                      EXT_CONF_FILE_NAME.format(incarnation))))
+            incarnation = self.fetch_incarnation()
+            ext_conf = self.goal_state_cache.get(
+                GoalStateCache.EXT_CONF,
+                incarnation,
+                lambda: self.fetch_cache(os.path.join(conf.get_lib_dir(), EXT_CONF_FILE_NAME.format(incarnation)),
+                                         ExtensionsConfig))
             handler_list = ext_conf.ext_handlers.extHandlers
         except ProtocolError as pe:
             # cache file is missing, nothing to do
@@ -879,14 +1103,16 @@ class WireClient(object):
     def get_ext_conf(self):
         if self.ext_conf is None:
             goal_state = self.get_goal_state()
-            if goal_state.ext_uri is None:
-                self.ext_conf = ExtensionsConfig(None)
-            else:
+
+            def parse():
+                if goal_state.ext_uri is None:
+                    return ExtensionsConfig(None)
                 local_file = EXT_CONF_FILE_NAME.format(goal_state.incarnation)
                 local_file = os.path.join(conf.get_lib_dir(), local_file)
-                xml_text = self.fetch_cache(local_file)
-                self.ext_conf = ExtensionsConfig(xml_text)
-        return self.ext_conf      
+                return self.fetch_cache(local_file, ExtensionsConfig)
+
+            self.ext_conf = self.goal_state_cache.get(GoalStateCache.EXT_CONF, goal_state.incarnation, parse)
+        return self.ext_conf
 
     def get_ext_manifest(self, ext_handler, goal_state):
         for update_goal_state in [False, True]:
@@ -1038,9 +1264,11 @@ class WireClient(object):
             host.put_vm_status(self.status_blob,
                                ext_conf.status_upload_blob,
                                ext_conf.status_upload_blob_type)
+            _status_uploads.inc("hostplugin")
             return
         except ResourceGoneError:
             # do not attempt direct, force goal state update and wait to try again
+            _status_uploads.inc("skipped")
             self.update_goal_state(forced=True)
             return
         except Exception as e:
@@ -1050,11 +1278,13 @@ class WireClient(object):
 
         try:
             if self.status_blob.upload(ext_conf.status_upload_blob):
+                _status_uploads.inc("direct")
                 return
         except Exception as e:
             msg = "Exception uploading status blob: {0}".format(ustr(e))
             self.report_status_event(msg, is_success=False)
 
+        _status_uploads.inc("failed")
         raise ProtocolError("Failed to upload status blob via either channel")
 
     def report_role_prop(self, thumbprint):
@@ -1108,13 +1338,12 @@ class WireClient(object):
                                                       resp.read()))
 
     def send_event(self, provider_id, event_str):
+        data = TELEMETRY_DATA_FORMAT.format(
+            u'<Provider id="{0}">{1}</Provider>'.format(provider_id, event_str))
+        self.send_telemetry_data(data)
+
+    def send_telemetry_data(self, data):
         uri = TELEMETRY_URI.format(self.endpoint)
-        data_format = ('<?xml version="1.0"?>'
-                       '<TelemetryData version="1.0">'
-                       '<Provider id="{0}">{1}'
-                       '</Provider>'
-                       '</TelemetryData>')
-        data = data_format.format(provider_id, event_str)
         try:
             header = self.get_header_for_xml_content()
             resp = self.call_wireserver(restutil.http_post, uri, data, header)
@@ -1127,24 +1356,68 @@ class WireClient(object):
                 "Failed to send events:{0}".format(resp.status))
 
     def report_event(self, event_list):
-        buf = {}
-        # Group events by providerId
+        packer = TelemetryBatchPacker()
         for event in event_list.events:
-            if event.providerId not in buf:
-                buf[event.providerId] = ""
             event_str = event_to_v1(event)
-            if len(event_str) >= 63 * 1024:
+            if not packer.add(event.providerId, event_str):
                 logger.warn("Single event too large: {0}", event_str[300:])
-                continue
-            if len(buf[event.providerId] + event_str) >= 63 * 1024:
-                self.send_event(event.providerId, buf[event.providerId])
-                buf[event.providerId] = ""
-            buf[event.providerId] = buf[event.providerId] + event_str
 
-        # Send out all events left in buffer.
-        for provider_id in list(buf.keys()):
-            if len(buf[provider_id]) > 0:
-                self.send_event(provider_id, buf[provider_id])
+        batches = packer.get_batches()
+        if len(batches) <= 1:
+            for _, data in batches:
+                self.send_telemetry_data(data)
+            return
+
+        # Send the payloads concurrently, on a bounded number of threads; a
+        # payload is sent only once the previous payloads holding events of
+        # the same providers were, so the events of each provider keep their
+        # order
+        errors = []
+        pending = list(batches)
+        in_flight = []
+        condition = threading.Condition()
+
+        def next_batch():
+            busy = set()
+            for providers in in_flight:
+                busy.update(providers)
+            for batch in pending:
+                if busy.isdisjoint(batch[0]):
+                    return batch
+                busy.update(batch[0])
+            return None
+
+        def send_payloads():
+            while True:
+                with condition:
+                    batch = next_batch()
+                    while batch is None and len(pending) > 0:
+                        condition.wait()
+                        batch = next_batch()
+                    if batch is None:
+                        return
+                    pending.remove(batch)
+                    in_flight.append(batch[0])
+                try:
+                    self.send_telemetry_data(batch[1])
+                except Exception as e:
+                    with condition:
+                        errors.append(e)
+                finally:
+                    with condition:
+                        in_flight.remove(batch[0])
+                        condition.notify_all()
+
+        threads = [threading.Thread(target=send_payloads)
+                   for _ in range(min(len(batches), MAX_CONCURRENT_TELEMETRY_REQUESTS))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[0] if isinstance(errors[0], ProtocolError) \
+                else ProtocolError("Failed to send events:{0}".format(errors[0]))
 
     def report_status_event(self, message, is_success):
         from azurelinuxagent.common.event import report_event, \
@@ -1452,6 +1725,63 @@ class Certificates(object):
         if data is None:
             return
 
+        # Decrypting the certificates is skipped if the payload is the same
+        # as the one processed last (e.g. on forced goal state refreshes)
+        data_hash = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        thumbprints = self.get_processed_thumbprints(data_hash)
+        if thumbprints is None:
+            thumbprints, prv_thumbprints, complete = self.decrypt(data)
+            # a payload whose certificates were not all extracted is
+            # decrypted again on the next refresh
+            if complete:
+                self.save_processed_thumbprints(data_hash, thumbprints, prv_thumbprints)
+        else:
+            logger.verbose("Certificates are unchanged, skipping decryption")
+
+        for thumbprint in thumbprints:
+            cert = Cert()
+            set_properties("certs", cert, {"name": None, "thumbprint": thumbprint})
+            self.cert_list.certificates.append(cert)
+
+    @staticmethod
+    def get_processed_thumbprints(data_hash):
+        """
+        Return the thumbprints of the certificates extracted from the payload
+        with the given hash, or None if that payload was not the last one
+        processed or if any of its files is missing
+        """
+        state_file = os.path.join(conf.get_lib_dir(), CERTS_STATE_FILE_NAME)
+        if not os.path.isfile(state_file):
+            return None
+        try:
+            state = json.loads(fileutil.read_file(state_file))
+            if state.get("hash") != data_hash:
+                return None
+            files = ["{0}.crt".format(t) for t in state["thumbprints"]] + \
+                    ["{0}.prv".format(t) for t in state["privateKeys"]]
+            for file_name in files:
+                if not os.path.isfile(os.path.join(conf.get_lib_dir(), file_name)):
+                    return None
+            return state["thumbprints"]
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            logger.warn("Invalid certificates state {0}: {1}", state_file, ustr(e))
+            return None
+
+    def save_processed_thumbprints(self, data_hash, thumbprints, prv_thumbprints):
+        state_file = os.path.join(conf.get_lib_dir(), CERTS_STATE_FILE_NAME)
+        state = json.dumps({"hash": data_hash, "thumbprints": thumbprints, "privateKeys": prv_thumbprints})
+        try:
+            self.client.save_cache(state_file, state)
+        except ProtocolError as e:
+            logger.warn("Failed to save certificates state: {0}", ustr(e))
+
+    def decrypt(self, data):
+        """
+        Decrypt the certificates and save them to the lib dir, as
+        <thumbprint>.crt and <thumbprint>.prv. Return the thumbprints of the
+        certificates and of the private keys, and whether every certificate
+        and private key was extracted (and every key matched a certificate).
+        """
         cryptutil = CryptUtil(conf.get_openssl_cmd())
         p7m_file = os.path.join(conf.get_lib_dir(), P7M_FILE_NAME)
         p7m = ("MIME-Version:1.0\n"
@@ -1469,59 +1799,71 @@ class Certificates(object):
                                        TRANSPORT_CERT_FILE_NAME)
         pem_file = os.path.join(conf.get_lib_dir(), PEM_FILE_NAME)
         # decrypt certificates
-        cryptutil.decrypt_p7m(p7m_file, trans_prv_file, trans_cert_file,
-                              pem_file)
+        try:
+            cryptutil.decrypt_p7m(p7m_file, trans_prv_file, trans_cert_file,
+                                  pem_file)
+        except CryptError as e:
+            logger.error("Failed to decrypt the certificates: {0}", ustr(e))
+            return [], [], False
 
-        # The parsing process use public key to match prv and crt.
+        # Split the certificates and private keys into separate files
         buf = []
-        begin_crt = False
-        begin_prv = False
-        prvs = {}
-        thumbprints = {}
         index = 0
-        v1_cert_list = []
+        crt_files = []
+        prv_files = []
         with open(pem_file) as pem:
             for line in pem.readlines():
                 buf.append(line)
-                if re.match(r'[-]+BEGIN.*KEY[-]+', line):
-                    begin_prv = True
-                elif re.match(r'[-]+BEGIN.*CERTIFICATE[-]+', line):
-                    begin_crt = True
-                elif re.match(r'[-]+END.*KEY[-]+', line):
-                    tmp_file = self.write_to_tmp_file(index, 'prv', buf)
-                    pub = cryptutil.get_pubkey_from_prv(tmp_file)
-                    prvs[pub] = tmp_file
+                if re.match(r'[-]+END.*KEY[-]+', line):
+                    prv_files.append(self.write_to_tmp_file(index, 'prv', buf))
                     buf = []
                     index += 1
-                    begin_prv = False
                 elif re.match(r'[-]+END.*CERTIFICATE[-]+', line):
-                    tmp_file = self.write_to_tmp_file(index, 'crt', buf)
-                    pub = cryptutil.get_pubkey_from_crt(tmp_file)
-                    thumbprint = cryptutil.get_thumbprint_from_crt(tmp_file)
-                    thumbprints[pub] = thumbprint
-                    # Rename crt with thumbprint as the file name
-                    crt = "{0}.crt".format(thumbprint)
-                    v1_cert_list.append({
-                        "name": None,
-                        "thumbprint": thumbprint
-                    })
-                    os.rename(tmp_file, os.path.join(conf.get_lib_dir(), crt))
+                    crt_files.append(self.write_to_tmp_file(index, 'crt', buf))
                     buf = []
                     index += 1
-                    begin_crt = False
+
+        # The parsing process use public key to match prv and crt.
+        complete = True
+        thumbprints = {}
+        cert_thumbprints = []
+        prv_thumbprints = []
+        crt_infos = cryptutil.get_thumbprints_and_pubkeys_from_crts(crt_files)
+        for tmp_file, (thumbprint, pub) in zip(crt_files, crt_infos):
+            if not thumbprint or not pub:
+                logger.error("Failed to extract the certificate in {0}", tmp_file)
+                complete = False
+                continue
+            thumbprints[pub] = thumbprint
+            # Rename crt with thumbprint as the file name
+            crt = "{0}.crt".format(thumbprint)
+            cert_thumbprints.append(thumbprint)
+            self.replace_if_changed(tmp_file, os.path.join(conf.get_lib_dir(), crt))
 
         # Rename prv key with thumbprint as the file name
-        for pubkey in prvs:
-            thumbprint = thumbprints[pubkey]
+        for tmp_file, pub in zip(prv_files, cryptutil.get_pubkeys_from_prvs(prv_files)):
+            thumbprint = thumbprints.get(pub)
             if thumbprint:
-                tmp_file = prvs[pubkey]
                 prv = "{0}.prv".format(thumbprint)
-                os.rename(tmp_file, os.path.join(conf.get_lib_dir(), prv))
+                prv_thumbprints.append(thumbprint)
+                self.replace_if_changed(tmp_file, os.path.join(conf.get_lib_dir(), prv))
+            else:
+                logger.error("No certificate matches the private key in {0}", tmp_file)
+                complete = False
 
-        for v1_cert in v1_cert_list:
-            cert = Cert()
-            set_properties("certs", cert, v1_cert)
-            self.cert_list.certificates.append(cert)
+        return cert_thumbprints, prv_thumbprints, complete
+
+    @staticmethod
+    def replace_if_changed(tmp_file, file_name):
+        """
+        Atomically replace file_name with tmp_file, unless both have the
+        same contents (then tmp_file is just removed)
+        """
+        if os.path.isfile(file_name) and \
+                fileutil.read_file(tmp_file, asbin=True) == fileutil.read_file(file_name, asbin=True):
+            os.remove(tmp_file)
+        else:
+            os.rename(tmp_file, file_name)
 
     def write_to_tmp_file(self, index, suffix, buf):
         file_name = os.path.join(conf.get_lib_dir(),
@@ -0,0 +1,159 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+
+import os
+import threading
+import time
+
+import azurelinuxagent.common.conf as conf
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.cgroups import SystemLoad, LOAD_HIGH
+from azurelinuxagent.common.utils.metricsource import metric_sources
+
+PROC_SELF_IO = "/proc/self/io"
+
+
+class TaskPriority(object):
+    """
+    Priority classes of the agent's own work. CRITICAL work (goal state processing, status reporting) is never
+    deferred; NORMAL work (telemetry collection) is deferred while the agent is over its budget and the system is
+    under pressure; LOW work (history archiving, log compression, metric flushing) is deferred while either is true.
+    """
+    CRITICAL = 0
+    NORMAL = 1
+    LOW = 2
+
+
+def get_process_cpu_time():
+    """
+    CPU time (user and system, in seconds) used by this process, excluding its children (i.e. the extensions)
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def get_process_io():
+    """
+    Bytes read from and written to storage by this process, or (0, 0) if /proc/self/io is not available
+
+    :rtype: (int, int)
+    """
+    try:
+        values = {}
+        for line in metric_sources.read_text(PROC_SELF_IO).splitlines():
+            key, _, value = line.partition(":")
+            values[key] = value.strip()
+        return int(values.get("read_bytes", 0)), int(values.get("write_bytes", 0))
+    except (IOError, OSError, ValueError):
+        return 0, 0
+
+
+class ResourceBudget(object):
+    """
+    Tracks the CPU time and the I/O of this process against a budget, and decides whether deferrable work should
+    run now. The usage is measured over sample_interval seconds, and updated when a decision is requested. Work is
+    deferred at most max_deferral seconds; past that it runs regardless of the budget, so that it is delayed rather
+    than starved.
+    """
+    def __init__(self, cpu_budget, io_budget, sample_interval=10, max_deferral=3600, system_load=None):
+        """
+        :param int cpu_budget: CPU budget, in percent of a single core (0 for none)
+        :param int io_budget: I/O budget, in bytes read and written per second (0 for none)
+        """
+        self.cpu_budget = cpu_budget
+        self.io_budget = io_budget
+        self.sample_interval = sample_interval
+        self.max_deferral = max_deferral
+        self.system_load = SystemLoad() if system_load is None else system_load
+        self._lock = threading.Lock()
+
+        self.cpu_percent = 0.0
+        self.io_rate = 0.0
+        self.over_budget = False
+        self.under_pressure = False
+        self._last_sample_time = time.time()
+        self._last_cpu_time = get_process_cpu_time()
+        self._last_io = sum(get_process_io())
+        self._deferred_since = {}
+        self._deferrals = {}
+
+    def _update(self):
+        now = time.time()
+        elapsed = now - self._last_sample_time
+        if elapsed < self.sample_interval:
+            return
+
+        cpu_time = get_process_cpu_time()
+        io = sum(get_process_io())
+        self.cpu_percent = round(100.0 * (cpu_time - self._last_cpu_time) / elapsed, 3)
+        self.io_rate = round(max(0, io - self._last_io) / elapsed, 3)
+        self._last_sample_time, self._last_cpu_time, self._last_io = now, cpu_time, io
+
+        self.over_budget = (0 < self.cpu_budget <= self.cpu_percent) or (0 < self.io_budget <= self.io_rate)
+        self.under_pressure = LOAD_HIGH in self.system_load.sample()
+
+    def should_run(self, task, priority):
+        """
+        Return whether the task should run now, or be deferred to a later attempt
+
+        :param str task: Name of the task, used to bound its deferral and in the telemetry
+        :param int priority: TaskPriority of the task
+        """
+        if priority == TaskPriority.CRITICAL:
+            return True
+
+        with self._lock:
+            self._update()
+            if priority == TaskPriority.LOW:
+                defer = self.over_budget or self.under_pressure
+            else:
+                defer = self.over_budget and self.under_pressure
+
+            now = time.time()
+            if defer:
+                deferred_since = self._deferred_since.setdefault(task, now)
+                if now - deferred_since < self.max_deferral:
+                    self._deferrals[task] = self._deferrals.get(task, 0) + 1
+                    return False
+                logger.info("Running {0}, deferred for {1} seconds", task, int(now - deferred_since))
+            self._deferred_since.pop(task, None)
+            return True
+
+    def get_and_reset_deferrals(self):
+        """
+        Return the number of times each task was deferred since the previous call
+
+        :rtype: dict(str: int)
+        """
+        with self._lock:
+            deferrals = self._deferrals
+            self._deferrals = {}
+        return deferrals
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_resource_budget():
+    """
+    Return the budget of this process, as configured by Agent.CpuBudgetPercent and Agent.IOBudgetKBps
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = ResourceBudget(conf.get_agent_cpu_budget(), conf.get_agent_io_budget())
+        return _budget
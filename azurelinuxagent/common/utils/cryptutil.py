@@ -28,6 +28,8 @@ from azurelinuxagent.common.future import ustr, bytebuffer
 from azurelinuxagent.common.exception import CryptError
 
 import azurelinuxagent.common.logger as logger
+import azurelinuxagent.common.utils.derutil as derutil
+import azurelinuxagent.common.utils.fileutil as fileutil
 import azurelinuxagent.common.utils.shellutil as shellutil
 import azurelinuxagent.common.utils.textutil as textutil
 
@@ -49,10 +51,30 @@ class CryptUtil(object):
             logger.error("Failed to create {0} and {1} certificates".format(
                 prv_file, crt_file))
 
+    @staticmethod
+    def _read_der(file_name):
+        """
+        Return the label and DER encoding of the PEM object in the file, or
+        (None, None) if it cannot be decoded in-process
+        """
+        try:
+            return derutil.pem_to_der(fileutil.read_file(file_name))
+        except CryptError as e:
+            logger.verbose("Cannot decode {0}, using openssl: {1}", file_name, ustr(e))
+            return None, None
+
     def get_pubkey_from_prv(self, file_name):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
         else:
+            label, der = self._read_der(file_name)
+            if der is not None:
+                try:
+                    return derutil.der_to_pem(derutil.get_public_key_info_from_private_key(der, label),
+                                              "PUBLIC KEY")
+                except CryptError as e:
+                    logger.verbose("Cannot extract the public key of {0}, using openssl: {1}", file_name, ustr(e))
+
             cmd = "{0} rsa -in {1} -pubout 2>/dev/null".format(self.openssl_cmd,
                                                                file_name)
             pub = shellutil.run_get_output(cmd)[1]
@@ -62,6 +84,13 @@ class CryptUtil(object):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
         else:
+            label, der = self._read_der(file_name)
+            if der is not None and label == "CERTIFICATE":
+                try:
+                    return derutil.der_to_pem(derutil.get_subject_public_key_info(der), "PUBLIC KEY")
+                except CryptError as e:
+                    logger.verbose("Cannot extract the public key of {0}, using openssl: {1}", file_name, ustr(e))
+
             cmd = "{0} x509 -in {1} -pubkey -noout".format(self.openssl_cmd,
                                                            file_name)
             pub = shellutil.run_get_output(cmd)[1]
@@ -71,28 +100,118 @@ class CryptUtil(object):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
         else:
+            label, der = self._read_der(file_name)
+            if der is not None and label == "CERTIFICATE":
+                return derutil.get_thumbprint(der)
+
             cmd = "{0} x509 -in {1} -fingerprint -noout".format(self.openssl_cmd,
                                                                 file_name)
             thumbprint = shellutil.run_get_output(cmd)[1]
             thumbprint = thumbprint.rstrip().split('=')[1].replace(':', '').upper()
             return thumbprint
 
+    def get_thumbprints_and_pubkeys_from_crts(self, file_names):
+        """
+        Return, in order, the (thumbprint, public key) of each certificate
+        file. Certificates are decoded in-process; those that cannot be are
+        converted to DER by a single openssl invocation, and only if that
+        fails, processed one by one.
+        """
+        results = [None] * len(file_names)
+        pending = []
+        for i, file_name in enumerate(file_names):
+            if not os.path.exists(file_name):
+                raise IOError(errno.ENOENT, "File not found", file_name)
+            label, der = self._read_der(file_name)
+            if der is not None and label == "CERTIFICATE":
+                try:
+                    results[i] = (derutil.get_thumbprint(der),
+                                  derutil.der_to_pem(derutil.get_subject_public_key_info(der), "PUBLIC KEY"))
+                    continue
+                except CryptError as e:
+                    logger.verbose("Cannot extract the public key of {0}: {1}", file_name, ustr(e))
+            pending.append(i)
+
+        if len(pending) > 0:
+            certificates = self._convert_crts_to_der([file_names[i] for i in pending])
+            for i, der in zip(pending, certificates):
+                try:
+                    results[i] = (derutil.get_thumbprint(der),
+                                  derutil.der_to_pem(derutil.get_subject_public_key_info(der), "PUBLIC KEY"))
+                except CryptError as e:
+                    logger.verbose("Cannot extract the public key of {0}: {1}", file_names[i], ustr(e))
+
+        for i, file_name in enumerate(file_names):
+            if results[i] is None:
+                results[i] = (self.get_thumbprint_from_crt(file_name), self.get_pubkey_from_crt(file_name))
+        return results
+
+    def _convert_crts_to_der(self, file_names):
+        """
+        Return the DER encoding of the certificates in the given files, using
+        a single openssl invocation; returns an empty list if the certificates
+        cannot be matched to the files
+        """
+        args = [self.openssl_cmd, "crl2pkcs7", "-nocrl"]
+        for file_name in file_names:
+            args.extend(["-certfile", file_name])
+        args.extend(["-outform", "DER"])
+        try:
+            output = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+            certificates = derutil.get_certificates_from_pkcs7(output)
+        except (OSError, CryptError) as e:
+            logger.verbose("Failed to convert certificates to DER: {0}", ustr(e))
+            return []
+        # files openssl cannot read are skipped silently; in that case the
+        # output cannot be matched to the input
+        if len(certificates) != len(file_names):
+            return []
+        return certificates
+
+    def get_pubkeys_from_prvs(self, file_names):
+        """
+        Return, in order, the public key of each private key file (openssl
+        has no command processing several keys, so keys that cannot be
+        decoded in-process still require an invocation each)
+        """
+        return [self.get_pubkey_from_prv(f) for f in file_names]
+
     def decrypt_p7m(self, p7m_file, trans_prv_file, trans_cert_file, pem_file):
+        """
+        Decrypt the certificates in p7m_file to pem_file; raises CryptError
+        if the decryption fails
+        """
         if not os.path.exists(p7m_file):
             raise IOError(errno.ENOENT, "File not found", p7m_file)
         elif not os.path.exists(trans_prv_file):
             raise IOError(errno.ENOENT, "File not found", trans_prv_file)
         else:
+            # the certificates of a previous payload must not be mistaken
+            # for the output of this one
+            if os.path.exists(pem_file):
+                os.remove(pem_file)
             cmd = ("{0} cms -decrypt -in {1} -inkey {2} -recip {3} "
                    "| {4} pkcs12 -nodes -password pass: -out {5}"
                    "").format(self.openssl_cmd, p7m_file, trans_prv_file,
                               trans_cert_file, self.openssl_cmd, pem_file)
-            shellutil.run(cmd)
             rc = shellutil.run(cmd)
             if rc != 0:
-                logger.error("Failed to decrypt {0}".format(p7m_file))
+                raise CryptError("Failed to decrypt {0}".format(p7m_file))
 
     def crt_to_ssh(self, input_file, output_file):
+        """
+        Append the public key in input_file (PEM) to output_file, in the
+        OpenSSH format; RSA keys are converted in-process, other keys by
+        ssh-keygen
+        """
+        label, der = self._read_der(input_file)
+        if der is not None and label == "PUBLIC KEY":
+            try:
+                fileutil.append_file(output_file, derutil.get_ssh_public_key(der) + "\n")
+                return
+            except CryptError as e:
+                logger.verbose("Cannot convert {0}, using ssh-keygen: {1}", input_file, ustr(e))
+
         shellutil.run("ssh-keygen -i -m PKCS8 -f {0} >> {1}".format(input_file,
                                                                     output_file))
 
@@ -0,0 +1,245 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Minimal DER (ASN.1) reader, sufficient to compute the thumbprint of X.509
+certificates and to extract their SubjectPublicKeyInfo, or the public key
+of unencrypted RSA private keys, and to convert RSA public keys to the
+OpenSSH format, without invoking openssl or ssh-keygen.
+"""
+
+import base64
+import binascii
+import hashlib
+import re
+import struct
+
+from azurelinuxagent.common.exception import CryptError
+from azurelinuxagent.common.future import ustr
+
+TAG_INTEGER = 0x02
+TAG_BIT_STRING = 0x03
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_CONTEXT_0 = 0xa0
+
+# 1.2.840.113549.1.1.1
+OID_RSA_ENCRYPTION = b"\x2a\x86\x48\x86\xf7\x0d\x01\x01\x01"
+
+_PEM_PATTERN = re.compile(r'-----BEGIN ([A-Z ]+)-----(.*?)-----END \1-----', re.DOTALL)
+
+
+def pem_to_der(pem_text):
+    """
+    Return the label (e.g. 'CERTIFICATE', 'PRIVATE KEY') and the DER
+    encoding of the first PEM object in the text
+    """
+    match = _PEM_PATTERN.search(ustr(pem_text))
+    if match is None:
+        raise CryptError("No PEM object found")
+    try:
+        return match.group(1), base64.b64decode("".join(match.group(2).split()))
+    except (TypeError, binascii.Error) as e:
+        raise CryptError("Invalid PEM encoding: {0}".format(ustr(e)))
+
+
+def der_to_pem(der, label):
+    """
+    Return the PEM encoding of the DER data, formatted as openssl does
+    """
+    encoded = base64.b64encode(der).decode('ascii')
+    lines = [encoded[i:i + 64] for i in range(0, len(encoded), 64)]
+    return "-----BEGIN {0}-----\n{1}\n-----END {0}-----\n".format(label, "\n".join(lines))
+
+
+def read_tlv(data, offset=0):
+    """
+    Read the DER element at the given offset of 'data' (a bytearray)
+
+    :return: (tag, start of the contents, end of the contents)
+    """
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            if count == 0 or count > 4:
+                raise CryptError("Unsupported DER length encoding")
+            length = 0
+            for b in data[offset:offset + count]:
+                length = (length << 8) | b
+            offset += count
+    except IndexError:
+        raise CryptError("Truncated DER element")
+    if offset + length > len(data):
+        raise CryptError("Truncated DER element")
+    return tag, offset, offset + length
+
+
+def read_children(data, start, end):
+    """
+    Return the (tag, start, end) of the elements between start and end
+    (usually the contents of a SEQUENCE)
+    """
+    children = []
+    offset = start
+    while offset < end:
+        tag, child_start, child_end = read_tlv(data, offset)
+        children.append((tag, child_start, child_end))
+        offset = child_end
+    return children
+
+
+def _read_sequence(data, start=0, end=None, expected_tag=TAG_SEQUENCE):
+    tag, start, seq_end = read_tlv(data, start)
+    if tag != expected_tag or (end is not None and seq_end > end):
+        raise CryptError("Unexpected DER element (tag 0x{0:02x})".format(tag))
+    return read_children(data, start, seq_end)
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytearray([length])
+    encoded = bytearray()
+    while length:
+        encoded.insert(0, length & 0xff)
+        length >>= 8
+    return bytearray([0x80 | len(encoded)]) + encoded
+
+
+def _encode(tag, contents):
+    return bytearray([tag]) + _encode_length(len(contents)) + contents
+
+
+def get_thumbprint(cert_der):
+    """
+    Return the SHA-1 thumbprint of a certificate (hex, uppercase)
+    """
+    return hashlib.sha1(bytes(cert_der)).hexdigest().upper()
+
+
+def get_subject_public_key_info(cert_der):
+    """
+    Return the DER encoding of the SubjectPublicKeyInfo of a certificate
+    """
+    data = bytearray(cert_der)
+    certificate = _read_sequence(data)
+    _, tbs_start, tbs_end = certificate[0]
+    tbs_certificate = read_children(data, tbs_start, tbs_end)
+    # The optional [0] version precedes serialNumber, signature, issuer,
+    # validity and subject; subjectPublicKeyInfo follows them
+    index = 6 if tbs_certificate[0][0] == TAG_CONTEXT_0 else 5
+    if len(tbs_certificate) <= index or tbs_certificate[index][0] != TAG_SEQUENCE:
+        raise CryptError("Certificate has no SubjectPublicKeyInfo")
+    _, spki_start, spki_end = tbs_certificate[index]
+    header_length = len(_encode_length(spki_end - spki_start)) + 1
+    return bytes(data[spki_start - header_length:spki_end])
+
+
+def _rsa_public_key_info(data, start, end):
+    """
+    Build the SubjectPublicKeyInfo of the RSAPrivateKey (PKCS#1) at start
+    """
+    private_key = _read_sequence(data, start, end)
+    if len(private_key) < 3:
+        raise CryptError("Invalid RSA private key")
+    modulus = data[private_key[1][1]:private_key[1][2]]
+    exponent = data[private_key[2][1]:private_key[2][2]]
+    public_key = _encode(TAG_SEQUENCE, _encode(TAG_INTEGER, modulus) + _encode(TAG_INTEGER, exponent))
+    algorithm = _encode(TAG_SEQUENCE, _encode(TAG_OID, bytearray(OID_RSA_ENCRYPTION)) + _encode(TAG_NULL, bytearray()))
+    return bytes(_encode(TAG_SEQUENCE, algorithm + _encode(TAG_BIT_STRING, bytearray([0]) + public_key)))
+
+
+def get_public_key_info_from_private_key(key_der, label):
+    """
+    Return the DER encoding of the SubjectPublicKeyInfo matching an
+    unencrypted RSA private key, either PKCS#8 ('PRIVATE KEY') or PKCS#1
+    ('RSA PRIVATE KEY'). Other kinds of keys raise CryptError.
+    """
+    data = bytearray(key_der)
+    if label == "RSA PRIVATE KEY":
+        return _rsa_public_key_info(data, 0, len(data))
+
+    if label != "PRIVATE KEY":
+        raise CryptError("Unsupported private key type: {0}".format(label))
+
+    private_key_info = _read_sequence(data)
+    if len(private_key_info) < 3:
+        raise CryptError("Invalid private key")
+    algorithm = read_children(data, private_key_info[1][1], private_key_info[1][2])
+    if algorithm[0][0] != TAG_OID or bytes(data[algorithm[0][1]:algorithm[0][2]]) != OID_RSA_ENCRYPTION:
+        raise CryptError("Unsupported private key algorithm")
+    tag, start, end = private_key_info[2]
+    if tag != TAG_OCTET_STRING:
+        raise CryptError("Invalid private key")
+    return _rsa_public_key_info(data, start, end)
+
+
+def get_ssh_public_key(public_key_info_der):
+    """
+    Return the OpenSSH encoding ('ssh-rsa <base64>') of an RSA
+    SubjectPublicKeyInfo, as 'ssh-keygen -i -m PKCS8' does. Other kinds of
+    keys raise CryptError.
+    """
+    data = bytearray(public_key_info_der)
+    public_key_info = _read_sequence(data)
+    if len(public_key_info) < 2 or public_key_info[1][0] != TAG_BIT_STRING:
+        raise CryptError("Invalid public key")
+    algorithm = read_children(data, public_key_info[0][1], public_key_info[0][2])
+    if len(algorithm) == 0 or algorithm[0][0] != TAG_OID or \
+            bytes(data[algorithm[0][1]:algorithm[0][2]]) != OID_RSA_ENCRYPTION:
+        raise CryptError("Unsupported public key algorithm")
+    # the BIT STRING holds the number of unused bits (0), then the RSAPublicKey
+    _, start, end = public_key_info[1]
+    public_key = _read_sequence(data, start + 1, end)
+    if len(public_key) != 2 or public_key[0][0] != TAG_INTEGER or public_key[1][0] != TAG_INTEGER:
+        raise CryptError("Invalid RSA public key")
+
+    # DER integers and SSH mpints are both minimal big-endian two's complement
+    key = bytearray()
+    for field in [bytearray(b"ssh-rsa"), data[public_key[1][1]:public_key[1][2]],
+                  data[public_key[0][1]:public_key[0][2]]]:
+        key += bytearray(struct.pack(">I", len(field))) + field
+    return "ssh-rsa {0}".format(base64.b64encode(bytes(key)).decode('ascii'))
+
+
+def get_certificates_from_pkcs7(der):
+    """
+    Return the DER encoding of the certificates of a PKCS#7 SignedData
+    structure (e.g. the output of 'openssl crl2pkcs7'), in order
+    """
+    data = bytearray(der)
+    content_info = _read_sequence(data)
+    if len(content_info) < 2 or content_info[1][0] != TAG_CONTEXT_0:
+        raise CryptError("Invalid PKCS#7 structure")
+    signed_data = _read_sequence(data, content_info[1][1], content_info[1][2])
+    certificates = [c for c in signed_data if c[0] == TAG_CONTEXT_0]
+    if len(certificates) == 0:
+        return []
+
+    _, offset, end = certificates[0]
+    result = []
+    while offset < end:
+        _, _, element_end = read_tlv(data, offset)
+        result.append(bytes(data[offset:element_end]))
+        offset = element_end
+    return result
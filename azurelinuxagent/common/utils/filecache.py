@@ -0,0 +1,180 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import os
+import threading
+
+import azurelinuxagent.common.utils.fileutil as fileutil
+
+
+def _get_file_key(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class _CacheEntry(object):
+    def __init__(self, key, text):
+        self.key = key
+        self.text = text
+        self.parsed = {}
+
+
+def _list_files(directory):
+    return tuple(sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))))
+
+
+class FileCache(object):
+    """
+    Read-through cache of the contents of small files, and of the objects
+    parsed from them.
+
+    Entries are keyed by path and validated on each access against the
+    (mtime, size, inode) of the file, so a file replaced or rewritten on disk
+    is read and parsed again. Files written through the cache owner should be
+    invalidated explicitly, since a rewrite within the mtime granularity may
+    not change the key.
+
+    Entries of watched directories (see FileWatcher), and of the files
+    directly in them, are not validated on access; the watcher invalidates
+    them when the files change.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._watched = set()
+        self.reads = 0
+        self.reads_avoided = 0
+        self.parses = 0
+        self.parses_avoided = 0
+
+    def read(self, path, parse=None):
+        """
+        Return the contents of the file, or, if 'parse' is given, the result
+        of invoking it on the contents. Parsed objects are cached per 'parse'
+        callable, so it should be a class or a module level function rather
+        than a lambda created on each call. Raises IOError/OSError if the
+        file cannot be read.
+        """
+        return self._get(path, fileutil.read_file, parse)
+
+    def list_files(self, directory, parse=None):
+        """
+        Return the sorted names (a tuple) of the regular files in the
+        directory, or, if 'parse' is given, the result of invoking it on the
+        names. The listing is validated against the (mtime, size, inode) of the
+        directory, which changes whenever an entry is added, removed or
+        renamed.
+        """
+        return self._get(directory, _list_files, parse)
+
+    def _get(self, path, load, parse):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and self._is_watched(path):
+                self.reads_avoided += 1
+            else:
+                key = _get_file_key(path)
+                if entry is not None and entry.key == key:
+                    self.reads_avoided += 1
+                else:
+                    self.reads += 1
+                    entry = _CacheEntry(key, load(path))
+                    self._entries[path] = entry
+
+            if parse is None:
+                return entry.text
+
+            if parse in entry.parsed:
+                self.parses_avoided += 1
+            else:
+                self.parses += 1
+                entry.parsed[parse] = parse(entry.text)
+            return entry.parsed[parse]
+
+    def get_mtime(self, path):
+        """
+        Return the mtime of the file; for watched files that are cached, the
+        mtime recorded when the file was read
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and self._is_watched(path):
+                return entry.key[0]
+        return os.stat(path).st_mtime
+
+    def _is_watched(self, path):
+        return path in self._watched or os.path.dirname(path) in self._watched
+
+    def add_watched_directory(self, directory):
+        with self._lock:
+            self._watched.add(directory)
+
+    def remove_watched_directory(self, directory):
+        with self._lock:
+            self._watched.discard(directory)
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def invalidate_tree(self, directory):
+        """
+        Remove the entries for the directory and everything below it
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            for path in list(self._entries.keys()):
+                if path == directory or path.startswith(prefix):
+                    del self._entries[path]
+
+    def evict(self, keep=None):
+        """
+        Remove all the entries, except those for the paths in 'keep'
+        """
+        keep = [] if keep is None else keep
+        with self._lock:
+            for path in list(self._entries.keys()):
+                if path not in keep:
+                    del self._entries[path]
+
+    def evict_directory(self, directory, keep=None):
+        """
+        Remove the entries for the files directly in the directory, except
+        those for the paths in 'keep'
+        """
+        keep = [] if keep is None else keep
+        with self._lock:
+            for path in list(self._entries.keys()):
+                if os.path.dirname(path) == directory and path not in keep:
+                    del self._entries[path]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_and_reset_counts(self):
+        """
+        Return the (reads avoided, parses avoided) since the last call
+        """
+        with self._lock:
+            counts = (self.reads_avoided, self.parses_avoided)
+            self.reads = 0
+            self.reads_avoided = 0
+            self.parses = 0
+            self.parses_avoided = 0
+            return counts
@@ -23,10 +23,12 @@ File operation util functions
 
 import errno as errno
 import glob
+import hashlib
 import os
 import pwd
 import re
 import shutil
+import threading
 
 import azurelinuxagent.common.logger as logger
 import azurelinuxagent.common.utils.textutil as textutil
@@ -77,6 +79,128 @@ def write_file(filepath, contents, asbin=False, encoding='utf-8', append=False):
         out_file.write(data)
 
 
+class DirectorySync(object):
+    """
+    Groups the fsync of the directories of files written with
+    write_file_if_changed, so that each directory is synced once, when the
+    group is closed:
+
+        with DirectorySync() as dir_sync:
+            write_file_if_changed(path1, contents1, dir_sync=dir_sync)
+            write_file_if_changed(path2, contents2, dir_sync=dir_sync)
+    """
+    def __init__(self):
+        self.directories = []
+
+    def add(self, directory):
+        if directory not in self.directories:
+            self.directories.append(directory)
+
+    def sync(self):
+        for directory in self.directories:
+            fsync_dir(directory)
+        self.directories = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.sync()
+
+
+def fsync_dir(dirpath):
+    """
+    Flush the directory entries of 'dirpath' (e.g. a rename) to disk;
+    errors are ignored, since not all file systems support it
+    """
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.verbose("Failed to sync directory {0}: {1}", dirpath, ustr(e))
+
+
+_write_counts_lock = threading.Lock()
+_write_counts = {"written": 0, "avoided": 0}
+
+
+def _count_write(written):
+    with _write_counts_lock:
+        _write_counts["written" if written else "avoided"] += 1
+
+
+def get_and_reset_write_counts():
+    """
+    Return the (writes, writes avoided) by write_file_if_changed since the
+    last call
+    """
+    with _write_counts_lock:
+        counts = (_write_counts["written"], _write_counts["avoided"])
+        _write_counts["written"] = 0
+        _write_counts["avoided"] = 0
+        return counts
+
+
+def _has_contents(filepath, data):
+    try:
+        if os.path.getsize(filepath) != len(data):
+            return False
+        return hashlib.sha256(read_file(filepath, asbin=True)).digest() == hashlib.sha256(data).digest()
+    except (IOError, OSError):
+        return False
+
+
+def write_file_if_changed(filepath, contents, asbin=False, encoding='utf-8', fsync_directory=False, dir_sync=None):
+    """
+    Write 'contents' to 'filepath', unless the file already has those
+    contents. The file is replaced atomically: the contents are written to
+    a temporary file, which is synced and renamed to 'filepath'. The
+    directory is synced as well if 'fsync_directory' is set, or added to
+    'dir_sync' (a DirectorySync) if given.
+
+    Return True if the file was written, False if the write was avoided.
+    """
+    data = contents
+    if not asbin:
+        data = contents.encode(encoding)
+
+    if _has_contents(filepath, data):
+        _count_write(False)
+        return False
+
+    tmp_path = "{0}.{1}.{2}.tmp".format(filepath, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp_path, "wb") as out_file:
+            out_file.write(data)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        if os.path.exists(filepath):
+            os.chmod(tmp_path, os.stat(filepath).st_mode & 0o7777)
+        os.rename(tmp_path, filepath)
+    except (IOError, OSError) as e:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        # open() raises IOError on Python 2, keep the same type for the other failures
+        if isinstance(e, IOError):
+            raise
+        raise IOError(e.errno, e.strerror, filepath)
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    if dir_sync is not None:
+        dir_sync.add(directory)
+    elif fsync_directory:
+        fsync_dir(directory)
+
+    _count_write(True)
+    return True
+
+
 def append_file(filepath, contents, asbin=False, encoding='utf-8'):
     """
     Append 'contents' to 'filepath'.
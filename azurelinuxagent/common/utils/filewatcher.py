@@ -0,0 +1,245 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+
+import azurelinuxagent.common.logger as logger
+
+from azurelinuxagent.common.future import ustr
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# Events that add or remove entries of the directory
+DIRECTORY_CHANGE_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class Inotify(object):
+    """
+    Minimal, non-blocking binding of the inotify API (through ctypes)
+    """
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_error("inotify_init1")
+
+    def _raise_error(self, function):
+        error = ctypes.get_errno()
+        raise OSError(error, "{0}: {1}".format(function, os.strerror(error)))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, path.encode("utf-8"), ctypes.c_uint32(mask))
+        if wd < 0:
+            self._raise_error("inotify_add_watch")
+        return wd
+
+    def rm_watch(self, wd):
+        if self._libc.inotify_rm_watch(self.fd, wd) < 0:
+            self._raise_error("inotify_rm_watch")
+
+    def read_events(self):
+        """
+        Return the pending events, as (watch descriptor, mask, name) tuples
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            if not data:
+                return events
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher(object):
+    """
+    Watches directories for changes and invalidates the corresponding
+    entries of a FileCache, which then trusts its entries for the watched
+    directories (and the files directly in them) without checking the file
+    attributes on each access.
+
+    Where inotify is not available, or a watch cannot be added (e.g. the
+    max_user_watches limit is reached), the directory is left unwatched and
+    the cache keeps validating its entries against the (mtime, size, inode)
+    of the files, i.e. it falls back to polling.
+
+    Events are processed by process_events(), which the owner calls before
+    each pass over the cached files.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.RLock()
+        self._inotify = None
+        self._inotify_failed = False
+        self._watches = {}
+        self._directories = {}
+        self._limit_reached = False
+
+    def _get_inotify(self):
+        if self._inotify is None and not self._inotify_failed:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                self._inotify_failed = True
+                logger.info("Cannot use inotify, falling back to polling: {0}", ustr(e))
+        return self._inotify
+
+    def is_watched(self, directory):
+        return directory in self._directories
+
+    def watch(self, directory):
+        """
+        Start watching the directory; return False if it is polled instead
+        """
+        with self._lock:
+            if directory in self._directories:
+                return True
+
+            inotify = self._get_inotify()
+            if inotify is None or self._limit_reached:
+                return False
+
+            try:
+                wd = inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self._limit_reached = True
+                    logger.warn("The inotify watch limit was reached, polling {0}", directory)
+                else:
+                    logger.verbose("Cannot watch {0}, polling it: {1}", directory, ustr(e))
+                return False
+
+            self._watches[wd] = directory
+            self._directories[directory] = wd
+            # anything cached before the watch was added may be out of date
+            self.cache.invalidate_tree(directory)
+            self.cache.add_watched_directory(directory)
+            return True
+
+    def unwatch(self, directory):
+        with self._lock:
+            wd = self._directories.pop(directory, None)
+            if wd is None:
+                return
+            del self._watches[wd]
+            self.cache.remove_watched_directory(directory)
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError as e:
+                # the kernel removes the watch when the directory is deleted
+                logger.verbose("Cannot remove the watch for {0}: {1}", directory, ustr(e))
+            self._limit_reached = False
+
+    def unwatch_tree(self, directory):
+        """
+        Stop watching the directory and the directories below it
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            for path in list(self._directories.keys()):
+                if path == directory or path.startswith(prefix):
+                    self.unwatch(path)
+
+    def process_events(self):
+        """
+        Invalidate the cache entries of the files changed since the last
+        call; return the number of events processed
+        """
+        with self._lock:
+            if self._inotify is None:
+                return 0
+            try:
+                events = self._inotify.read_events()
+            except OSError as e:
+                logger.warn("Failed to read inotify events, polling: {0}", ustr(e))
+                for directory in list(self._directories.keys()):
+                    self.unwatch(directory)
+                return 0
+
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost; drop everything cached for the watched directories
+                    for directory in self._directories:
+                        self.cache.invalidate_tree(directory)
+                    continue
+
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.cache.invalidate_tree(directory)
+                    self._directories.pop(directory, None)
+                    self._watches.pop(wd, None)
+                    self.cache.remove_watched_directory(directory)
+                    continue
+
+                if name:
+                    self.cache.invalidate_tree(os.path.join(directory, name))
+                if mask & DIRECTORY_CHANGE_MASK or not name:
+                    self.cache.invalidate(directory)
+            return len(events)
+
+    def close(self):
+        with self._lock:
+            for directory in list(self._directories.keys()):
+                self.cache.remove_watched_directory(directory)
+            self._directories = {}
+            self._watches = {}
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
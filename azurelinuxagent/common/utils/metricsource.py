@@ -0,0 +1,178 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Readers for the files the agent samples periodically (/proc/stat, the
+cgroup stat files). The files are kept open and read from offset 0 on each
+sample, which saves the open()/close() of every read. This is only correct
+for files of pseudo file systems (procfs, cgroupfs), whose contents are
+generated on each read from the start of the file; a regular file replaced
+on disk would keep being read through the descriptor of the old file.
+"""
+
+import errno
+import os
+import threading
+
+_INITIAL_READ_SIZE = 4096
+
+# Errors for which the descriptor is reopened once before giving up: the file (e.g. the cgroup) was removed, and
+# possibly created again
+_REOPEN_ERRORS = (errno.ENOENT, errno.ENODEV, errno.ESTALE, errno.EBADF)
+
+
+def _pread(fd, size):
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, 0)
+    # Python < 3.3; callers serialize the reads of each source
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class MetricSource(object):
+    """
+    A file kept open and read in full from offset 0 on each read()
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._read_size = _INITIAL_READ_SIZE
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        self.opens += 1
+
+    def _read(self):
+        if self._fd is None:
+            self._open()
+        while True:
+            data = _pread(self._fd, self._read_size)
+            if len(data) < self._read_size:
+                return data
+            # the file may be larger than the buffer; read again with a larger one
+            self._read_size *= 2
+
+    def read(self):
+        """
+        Return the contents of the file (bytes); raises IOError/OSError if it cannot be read
+        """
+        with self._lock:
+            try:
+                return self._read()
+            except (IOError, OSError) as e:
+                self._close()
+                if e.errno not in _REOPEN_ERRORS:
+                    raise
+            return self._read()
+
+    def _close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class MetricSources(object):
+    """
+    The open MetricSources, by path. Sources are opened on the first read()
+    and stay open until closed explicitly, e.g. when the cgroup they belong
+    to is no longer tracked.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    def __len__(self):
+        return len(self._sources)
+
+    def get(self, path):
+        with self._lock:
+            source = self._sources.get(path)
+            if source is None:
+                source = MetricSource(path)
+                self._sources[path] = source
+            return source
+
+    def read(self, path):
+        return self.get(path).read()
+
+    def read_text(self, path):
+        return self.read(path).decode("utf-8")
+
+    def close(self, path):
+        with self._lock:
+            source = self._sources.pop(path, None)
+        if source is not None:
+            source.close()
+
+    def close_tree(self, directory):
+        """
+        Close the sources of the files in the directory and below it
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            paths = [path for path in self._sources if path.startswith(prefix)]
+        for path in paths:
+            self.close(path)
+
+    def close_all(self):
+        with self._lock:
+            sources = list(self._sources.values())
+            self._sources = {}
+        for source in sources:
+            source.close()
+
+
+def parse_proc_stat_cpu_times(proc_stat):
+    """
+    Return the USER_HZ units spent by all the cores since boot in each state
+    (user, nice, system, idle, iowait, irq, softirq, steal, ...), from the
+    "cpu " line of /proc/stat (bytes or text). Only that line, the first of
+    the file, is parsed. Returns an empty list if it cannot be found.
+    """
+    prefix = b"cpu " if isinstance(proc_stat, bytes) else u"cpu "
+    start = proc_stat.find(prefix)
+    if start < 0:
+        return []
+    end = proc_stat.find(b"\n" if isinstance(proc_stat, bytes) else u"\n", start)
+    fields = proc_stat[start:end if end >= 0 else len(proc_stat)].split()
+    return [int(field) for field in fields[1:]]
+
+
+def parse_proc_stat_cpu_ticks(proc_stat):
+    """
+    Return the USER_HZ units spent by all the cores since boot in the user,
+    nice, system, idle, iowait and irq states, or 0 if the "cpu " line of
+    /proc/stat cannot be found.
+    """
+    return sum(parse_proc_stat_cpu_times(proc_stat)[:6])
+
+
+PROC_STAT = "/proc/stat"
+
+# Shared by the cgroups telemetry and osutil
+metric_sources = MetricSources()
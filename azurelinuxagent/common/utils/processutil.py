@@ -20,9 +20,10 @@ import multiprocessing
 import subprocess
 import sys
 import os
+import threading
 import time
 import signal
-from errno import ESRCH
+from errno import ECHILD, ESRCH
 from multiprocessing import Process
 
 import azurelinuxagent.common.logger as logger
@@ -78,6 +79,87 @@ def format_stdout_stderr(stdout, stderr, max_len=TELEMETRY_MESSAGE_MAX_LEN):
         return to_s(stdout, -1*max_len_each, stderr, -1*max_len_each)
 
 
+class CommandUsage(object):
+    """
+    Resource usage of a command, and of the descendants it waited for, as reported by wait4(); or the sum of the
+    usage of 'count' commands (max_rss is then the largest one).
+    """
+    def __init__(self, rusage=None):
+        self.count = 0 if rusage is None else 1
+        self.user_time = 0.0 if rusage is None else rusage.ru_utime
+        self.system_time = 0.0 if rusage is None else rusage.ru_stime
+        # kilobytes on Linux
+        self.max_rss = 0 if rusage is None else rusage.ru_maxrss
+        # in 512-byte blocks
+        self.blocks_read = 0 if rusage is None else rusage.ru_inblock
+        self.blocks_written = 0 if rusage is None else rusage.ru_oublock
+        self.voluntary_switches = 0 if rusage is None else rusage.ru_nvcsw
+        self.involuntary_switches = 0 if rusage is None else rusage.ru_nivcsw
+
+    def add(self, other):
+        self.count += other.count
+        self.user_time += other.user_time
+        self.system_time += other.system_time
+        self.max_rss = max(self.max_rss, other.max_rss)
+        self.blocks_read += other.blocks_read
+        self.blocks_written += other.blocks_written
+        self.voluntary_switches += other.voluntary_switches
+        self.involuntary_switches += other.involuntary_switches
+
+    def __str__(self):
+        return "user={0:.3f}s system={1:.3f}s maxrss={2}KB inblock={3} oublock={4} nvcsw={5} nivcsw={6}".format(
+            self.user_time, self.system_time, self.max_rss, self.blocks_read, self.blocks_written,
+            self.voluntary_switches, self.involuntary_switches)
+
+
+def poll_with_usage(process, block=False):
+    """
+    Equivalent of Popen.poll() (or Popen.wait() if 'block'), which reaps the process with wait4() and sets
+    process.usage to its CommandUsage. Returns the exit code, or None if the process is still running.
+    """
+    if process.returncode is not None:
+        return process.returncode
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    except OSError as e:
+        if e.errno != ECHILD:
+            raise
+        # already reaped; let Popen handle it
+        return process.wait() if block else process.poll()
+    if pid == 0:
+        return None
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    process.usage = CommandUsage(rusage)
+    return process.returncode
+
+
+_command_usage = {}
+_command_usage_lock = threading.Lock()
+
+
+def record_command_usage(key, usage):
+    """
+    Add the CommandUsage of a command to the summary for 'key' (e.g. the extension and the operation)
+    """
+    with _command_usage_lock:
+        summary = _command_usage.get(key)
+        if summary is None:
+            summary = CommandUsage()
+            _command_usage[key] = summary
+        summary.add(usage)
+
+
+def get_and_reset_command_usage():
+    """
+    Return the summaries (CommandUsage) recorded since the previous call, by key
+    """
+    global _command_usage
+    with _command_usage_lock:
+        summaries = _command_usage
+        _command_usage = {}
+    return summaries
+
+
 def _destroy_process(process, signal_to_send=signal.SIGKILL):
     """
     Completely destroy the target process. Close the stdout/stderr pipes, kill the process, reap the zombie.
@@ -107,7 +189,7 @@ def capture_from_process_poll(process, cmd, timeout, code):
     and completes quickly.
     """
     retry = timeout
-    while retry > 0 and process.poll() is None:
+    while retry > 0 and poll_with_usage(process) is None:
         time.sleep(1)
         retry -= 1
 
@@ -119,7 +201,7 @@ def capture_from_process_poll(process, cmd, timeout, code):
         raise ExtensionError("Timeout({0}): {1}\n{2}".format(timeout, cmd, msg), code=code)
 
     # process completed or forked
-    return_code = process.wait()
+    return_code = poll_with_usage(process, block=True)
     if return_code != 0:
         raise ExtensionError("Non-zero exit code: {0}, {1}".format(return_code, cmd), code=code)
 
@@ -28,6 +28,7 @@ import azurelinuxagent.common.logger as logger
 import azurelinuxagent.common.utils.textutil as textutil
 
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError
+from azurelinuxagent.common.metrics import registry
 from azurelinuxagent.common.future import httpclient, urlparse, ustr
 from azurelinuxagent.common.version import PY_VERSION_MAJOR, AGENT_NAME, GOAL_STATE_AGENT_VERSION
 
@@ -90,41 +91,88 @@ INVALID_CONTAINER_CONFIGURATION = "InvalidContainerConfiguration"
 
 DEFAULT_PROTOCOL_ENDPOINT = '168.63.129.16'
 HOST_PLUGIN_PORT = 32526
+IMDS_ENDPOINT = '169.254.169.254'
+
+# Per endpoint class (see _get_endpoint_class); the latencies are in milliseconds, the retry delays in seconds.
+# The retries are counted by endpoint class and reason (the status code or the exception), and the responses by
+# endpoint class and status code.
+_requests = registry.counter("http", "Requests")
+_attempts = registry.counter("http", "Attempts")
+_retries = registry.counter("http", "Retries")
+_retry_delay = registry.counter("http", "Retry Delay")
+_status_codes = registry.counter("http", "Status Codes")
+_bytes_sent = registry.counter("http", "Bytes Sent")
+_bytes_received = registry.counter("http", "Bytes Received")
+_connect_time = registry.histogram("http", "Connect Time")
+_first_byte_time = registry.histogram("http", "Time To First Byte")
+_total_time = registry.histogram("http", "Total Time")
 
 
 class IOErrorCounter(object):
+    """
+    The IOErrors of the requests, by endpoint class, counted by the "IO Errors" counter of the metrics registry.
+    get_and_reset() returns the errors since its previous call, for the HttpErrors event.
+    """
     _lock = threading.RLock()
     _protocol_endpoint = DEFAULT_PROTOCOL_ENDPOINT
-    _counts = {"hostplugin":0, "protocol":0, "other":0}
+    _counter = registry.counter("http", "IO Errors")
+    _reported = {}
+
+    @staticmethod
+    def _get_endpoint_class(host, port):
+        if host == IOErrorCounter._protocol_endpoint:
+            return "hostplugin" if port == HOST_PLUGIN_PORT else "protocol"
+        return "other"
 
     @staticmethod
     def increment(host=None, port=None):
-        with IOErrorCounter._lock:
-            if host == IOErrorCounter._protocol_endpoint:
-                if port == HOST_PLUGIN_PORT:
-                    IOErrorCounter._counts["hostplugin"] += 1
-                else:
-                    IOErrorCounter._counts["protocol"] += 1
-            else:
-                IOErrorCounter._counts["other"] += 1
+        IOErrorCounter._counter.inc(IOErrorCounter._get_endpoint_class(host, port))
 
     @staticmethod
     def get_and_reset():
         with IOErrorCounter._lock:
-            counts = IOErrorCounter._counts.copy()
-            IOErrorCounter.reset()
+            values = IOErrorCounter._counter.values()
+            counts = dict((name, values.get(name, 0) - IOErrorCounter._reported.get(name, 0))
+                          for name in ("hostplugin", "protocol", "other"))
+            IOErrorCounter._reported = values
             return counts
 
     @staticmethod
     def reset():
         with IOErrorCounter._lock:
-            IOErrorCounter._counts = {"hostplugin":0, "protocol":0, "other":0}
+            IOErrorCounter._reported = IOErrorCounter._counter.values()
 
     @staticmethod
     def set_protocol_endpoint(endpoint=DEFAULT_PROTOCOL_ENDPOINT):
         IOErrorCounter._protocol_endpoint = endpoint
 
 
+def _get_endpoint_class(host, port):
+    """
+    Return the class of the endpoint used to aggregate the HTTP metrics: wireserver, hostplugin, imds, or storage
+    for any other host (the extension packages and the status blob)
+    """
+    if host == IOErrorCounter._protocol_endpoint:
+        return "hostplugin" if port == HOST_PLUGIN_PORT else "wireserver"
+    if host == IMDS_ENDPOINT:
+        return "imds"
+    return "storage"
+
+
+def _elapsed_milliseconds(start, end):
+    return int(round((end - start) * 1000))
+
+
+def _get_content_length(resp):
+    """
+    Return the Content-Length of the response, or 0 if it has none (e.g. a chunked response)
+    """
+    try:
+        return int(resp.getheader("Content-Length", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
 def _compute_delay(retry_attempt=1, delay=DELAY_IN_SECONDS):
     fib = (1, 1)
     for n in range(retry_attempt):
@@ -230,8 +278,15 @@ def _http_request(method, host, rel_uri, port=None, data=None, secure=False,
                    data,
                    headers)
 
+    endpoint_class = _get_endpoint_class(host, port)
+    start = time.time()
+    conn.connect()
+    connected = time.time()
     conn.request(method=method, url=url, body=data, headers=headers)
-    return conn.getresponse()
+    resp = conn.getresponse()
+    _connect_time.observe(_elapsed_milliseconds(start, connected), endpoint_class)
+    _first_byte_time.observe(_elapsed_milliseconds(connected, time.time()), endpoint_class)
+    return resp
 
 
 def http_request(method,
@@ -279,82 +334,100 @@ def http_request(method,
             logger.warn("Python does not support HTTPS tunnelling")
             SECURE_WARNING_EMITTED = True
 
-    msg = ''
-    attempt = 0
-    delay = 0
-    was_throttled = False
-
-    while attempt < max_retry:
-        if attempt > 0:
-            # Compute the request delay
-            # -- Use a fixed delay if the server ever rate-throttles the request
-            #    (with a safe, minimum number of retry attempts)
-            # -- Otherwise, compute a delay that is the product of the next
-            #    item in the Fibonacci series and the initial delay value
-            delay = THROTTLE_DELAY_IN_SECONDS \
-                        if was_throttled \
-                        else _compute_delay(retry_attempt=attempt,
-                                            delay=retry_delay)
-
-            logger.verbose("[HTTP Retry] "
-                        "Attempt {0} of {1} will delay {2} seconds: {3}",
-                        attempt+1,
-                        max_retry,
-                        delay,
-                        msg)
-
-            time.sleep(delay)
-
-        attempt += 1
-
-        try:
-            resp = _http_request(method,
-                                 host,
-                                 rel_uri,
-                                 port=port,
-                                 data=data,
-                                 secure=secure,
-                                 headers=headers,
-                                 proxy_host=proxy_host,
-                                 proxy_port=proxy_port)
-            logger.verbose("[HTTP Response] Status Code {0}", resp.status)
-
-            if request_failed(resp):
-                if _is_retry_status(resp.status, retry_codes=retry_codes):
-                    msg = '[HTTP Retry] {0} {1} -- Status Code {2}'.format(method, url, resp.status)
-                    # Note if throttled and ensure a safe, minimum number of
-                    # retry attempts
-                    if _is_throttle_status(resp.status):
-                        was_throttled = True
-                        max_retry = max(max_retry, THROTTLE_RETRIES)
+    endpoint_class = _get_endpoint_class(host, port)
+    if data is not None:
+        _bytes_sent.inc(endpoint_class, len(data))
+    _requests.inc(endpoint_class)
+    start = time.time()
+    try:
+        msg = ''
+        retry_reason = None
+        attempt = 0
+        delay = 0
+        was_throttled = False
+
+        while attempt < max_retry:
+            if attempt > 0:
+                # Compute the request delay
+                # -- Use a fixed delay if the server ever rate-throttles the request
+                #    (with a safe, minimum number of retry attempts)
+                # -- Otherwise, compute a delay that is the product of the next
+                #    item in the Fibonacci series and the initial delay value
+                delay = THROTTLE_DELAY_IN_SECONDS \
+                            if was_throttled \
+                            else _compute_delay(retry_attempt=attempt,
+                                                delay=retry_delay)
+
+                logger.verbose("[HTTP Retry] "
+                            "Attempt {0} of {1} will delay {2} seconds: {3}",
+                            attempt+1,
+                            max_retry,
+                            delay,
+                            msg)
+
+                _retries.inc("{0} {1}".format(endpoint_class, retry_reason))
+                _retry_delay.inc(endpoint_class, delay)
+                time.sleep(delay)
+
+            attempt += 1
+            _attempts.inc(endpoint_class)
+
+            try:
+                resp = _http_request(method,
+                                     host,
+                                     rel_uri,
+                                     port=port,
+                                     data=data,
+                                     secure=secure,
+                                     headers=headers,
+                                     proxy_host=proxy_host,
+                                     proxy_port=proxy_port)
+                logger.verbose("[HTTP Response] Status Code {0}", resp.status)
+                if isinstance(resp.status, int):
+                    _status_codes.inc("{0} {1}".format(endpoint_class, resp.status))
+
+                if request_failed(resp):
+                    if _is_retry_status(resp.status, retry_codes=retry_codes):
+                        msg = '[HTTP Retry] {0} {1} -- Status Code {2}'.format(method, url, resp.status)
+                        retry_reason = resp.status
+                        # Note if throttled and ensure a safe, minimum number of
+                        # retry attempts
+                        if _is_throttle_status(resp.status):
+                            was_throttled = True
+                            max_retry = max(max_retry, THROTTLE_RETRIES)
+                        continue
+
+                if resp.status in RESOURCE_GONE_CODES:
+                    raise ResourceGoneError()
+
+                # Map invalid container configuration errors to resource gone in
+                # order to force a goal state refresh, which in turn updates the
+                # container-id header passed to HostGAPlugin.
+                # See #1294.
+                if _is_invalid_container_configuration(resp):
+                    raise ResourceGoneError()
+
+                _bytes_received.inc(endpoint_class, _get_content_length(resp))
+                return resp
+
+            except httpclient.HTTPException as e:
+                clean_url = redact_sas_tokens_in_urls(url)
+                msg = '[HTTP Failed] {0} {1} -- HttpException {2}'.format(method, clean_url, e)
+                retry_reason = type(e).__name__
+                if _is_retry_exception(e):
                     continue
+                break
 
-            if resp.status in RESOURCE_GONE_CODES:
-                raise ResourceGoneError()
-
-            # Map invalid container configuration errors to resource gone in
-            # order to force a goal state refresh, which in turn updates the
-            # container-id header passed to HostGAPlugin.
-            # See #1294.
-            if _is_invalid_container_configuration(resp):
-                raise ResourceGoneError()
-
-            return resp
-
-        except httpclient.HTTPException as e:
-            clean_url = redact_sas_tokens_in_urls(url)
-            msg = '[HTTP Failed] {0} {1} -- HttpException {2}'.format(method, clean_url, e)
-            if _is_retry_exception(e):
+            except IOError as e:
+                IOErrorCounter.increment(host=host, port=port)
+                clean_url = redact_sas_tokens_in_urls(url)
+                msg = '[HTTP Failed] {0} {1} -- IOError {2}'.format(method, clean_url, e)
+                retry_reason = "IOError"
                 continue
-            break
-
-        except IOError as e:
-            IOErrorCounter.increment(host=host, port=port)
-            clean_url = redact_sas_tokens_in_urls(url)
-            msg = '[HTTP Failed] {0} {1} -- IOError {2}'.format(method, clean_url, e)
-            continue
 
-    raise HttpError("{0} -- {1} attempts made".format(msg, attempt))
+        raise HttpError("{0} -- {1} attempts made".format(msg, attempt))
+    finally:
+        _total_time.observe(_elapsed_milliseconds(start, time.time()), endpoint_class)
 
 
 def http_get(url,
@@ -36,6 +36,7 @@ from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol import get_protocol_util
 from azurelinuxagent.common.protocol.wire import INCARNATION_FILE_NAME
 from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.resourcebudget import get_resource_budget, TaskPriority
 from azurelinuxagent.common.utils.archive import StateArchiver
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
@@ -181,8 +182,12 @@ class EnvHandler(object):
                 self.last_archive + ARCHIVE_INTERVAL:
             return
 
+        if not get_resource_budget().should_run("history archiving", TaskPriority.LOW):
+            return
+
         self.archiver.purge()
         self.archiver.archive()
+        self.last_archive = datetime.datetime.utcnow()
 
     def stop(self):
         """
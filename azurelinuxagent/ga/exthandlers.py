@@ -41,14 +41,17 @@ from azurelinuxagent.common.errorstate import ErrorState, ERROR_STATE_DELTA_DEFA
 from azurelinuxagent.common.event import add_event, WALAEventOperation, elapsed_milliseconds, report_event
 from azurelinuxagent.common.exception import ExtensionError, ProtocolError, ProtocolNotFoundError
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.metrics import registry, DURATION_BUCKETS
 from azurelinuxagent.common.protocol.restapi import ExtHandlerStatus, \
                                                     ExtensionStatus, \
                                                     ExtensionSubStatus, \
                                                     VMStatus, ExtHandler, \
                                                     get_properties, \
                                                     set_properties
+from azurelinuxagent.common.utils.filecache import FileCache
+from azurelinuxagent.common.utils.filewatcher import FileWatcher
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
-from azurelinuxagent.common.utils.processutil import capture_from_process
+from azurelinuxagent.common.utils.processutil import capture_from_process, record_command_usage
 from azurelinuxagent.common.protocol import get_protocol_util
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
@@ -66,6 +69,17 @@ HANDLER_NAME_PATTERN = re.compile(HANDLER_PATTERN+"$", re.IGNORECASE)
 HANDLER_PKG_EXT = ".zip"
 HANDLER_PKG_PATTERN = re.compile(HANDLER_PATTERN + r"\.zip$", re.IGNORECASE)
 
+# The state, status, manifest and heartbeat files of the handlers, and the
+# listings of their config directories, are read on each status report pass
+# by new ExtHandlerInstances; they are cached here, across instances. The
+# handler directories are watched (inotify) so that the cache does not need to
+# check the files on each access.
+HANDLER_FILE_CACHE = FileCache()
+HANDLER_FILE_WATCHER = FileWatcher(HANDLER_FILE_CACHE)
+
+# The duration of the extension commands, by extension and operation (Install, Enable, etc.)
+_operation_duration = registry.histogram("extension operations", "Duration", DURATION_BUCKETS)
+
 
 def validate_has_key(obj, key, fullname):
     if key not in obj:
@@ -99,6 +113,24 @@ def parse_ext_substatus(substatus):
     return status
 
 
+def parse_largest_seq_no(settings_files):
+    """
+    Return the largest sequence number of the <seq_no>.settings files, or -1
+    """
+    seq_no = -1
+    for item in settings_files:
+        try:
+            separator = item.rfind(".")
+            if separator > 0 and item[separator + 1:] == 'settings':
+                curr_seq_no = int(item.split('.')[0])
+                if curr_seq_no > seq_no:
+                    seq_no = curr_seq_no
+        except (ValueError, IndexError, TypeError):
+            logger.verbose("Failed to parse file name: {0}", item)
+            continue
+    return seq_no
+
+
 def parse_ext_status(ext_status, data):
     if data is None or len(data) is None:
         return
@@ -193,8 +225,12 @@ class ExtHandlersHandler(object):
         self.report_status_error_state = ErrorState()
         self.get_artifact_error_state = ErrorState(min_timedelta=ERROR_STATE_DELTA_INSTALL)
 
+        # (reads, parses) avoided by HANDLER_FILE_CACHE on the last status report pass
+        self.last_report_io_avoided = (0, 0)
+
     def run(self):
         self.ext_handlers, etag = None, None
+        HANDLER_FILE_WATCHER.process_events()
         try:
             self.protocol = self.protocol_util.get_protocol()
             self.ext_handlers, etag = self.protocol.get_ext_handlers()
@@ -421,6 +457,8 @@ class ExtHandlersHandler(object):
         Go through handler_state dir, collect and report status
         """
         vm_status = VMStatus(status="Ready", message="Guest Agent is running")
+        HANDLER_FILE_WATCHER.process_events()
+        HANDLER_FILE_CACHE.get_and_reset_counts()
         if self.ext_handlers is not None:
             for ext_handler in self.ext_handlers.extHandlers:
                 try:
@@ -433,6 +471,9 @@ class ExtHandlersHandler(object):
                         is_success=False,
                         message=ustr(e))
 
+        self.last_report_io_avoided = HANDLER_FILE_CACHE.get_and_reset_counts()
+        logger.verbose("Handler status files: {0} reads and {1} parses avoided", *self.last_report_io_avoided)
+
         logger.verbose("Report vm agent status")
         try:
             self.protocol.report_vm_status(vm_status)
@@ -466,7 +507,8 @@ class ExtHandlersHandler(object):
 
     def report_ext_handler_status(self, vm_status, ext_handler):
         ext_handler_i = ExtHandlerInstance(ext_handler, self.protocol)
-        
+        ext_handler_i.watch_files()
+
         handler_status = ext_handler_i.get_handler_status() 
         if handler_status is None:
             return
@@ -600,7 +642,7 @@ class ExtHandlerInstance(object):
             state_path = os.path.join(path, 'config', 'HandlerState')
 
             if not os.path.exists(state_path) or \
-                fileutil.read_file(state_path) == \
+                HANDLER_FILE_CACHE.read(state_path) == \
                     ExtHandlerState.NotInstalled:
                 logger.verbose("Ignoring version of uninstalled extension: "
                     "{0}".format(path))
@@ -689,6 +731,7 @@ class ExtHandlerInstance(object):
         try:
             man = fileutil.read_file(man_file, remove_bom=True)
             fileutil.write_file(self.get_manifest_file(), man)
+            HANDLER_FILE_CACHE.invalidate(self.get_manifest_file())
         except IOError as e:
             fileutil.clean_ioerror(e, paths=[self.get_base_dir(), self.pkg_file])
             raise ExtensionError(u"Failed to save HandlerManifest.json", e)
@@ -712,6 +755,7 @@ class ExtHandlerInstance(object):
                     }
                 }
                 fileutil.write_file(status_path, json.dumps(status))
+                HANDLER_FILE_CACHE.invalidate(status_path)
 
             conf_dir = self.get_conf_dir()
             fileutil.mkdir(conf_dir, mode=0o700)
@@ -767,6 +811,8 @@ class ExtHandlerInstance(object):
                 self.logger.info("Remove extension handler directory: {0}",
                                  base_dir)
                 shutil.rmtree(base_dir)
+            HANDLER_FILE_WATCHER.unwatch_tree(base_dir)
+            HANDLER_FILE_CACHE.invalidate_tree(base_dir)
         except IOError as e:
             message = "Failed to remove extension handler directory: {0}".format(e)
             self.report_event(message=message, is_success=False)
@@ -799,22 +845,17 @@ class ExtHandlerInstance(object):
                              "Skip install during upgrade.")
         self.set_handler_state(ExtHandlerState.Installed)
 
+    def watch_files(self):
+        """
+        Watch the directories of the files read on each status report pass
+        (manifest and heartbeat, handler state and settings, extension status)
+        """
+        for directory in (self.get_base_dir(), self.get_conf_dir(), self.get_status_dir()):
+            if not HANDLER_FILE_WATCHER.is_watched(directory) and os.path.isdir(directory):
+                HANDLER_FILE_WATCHER.watch(directory)
+
     def get_largest_seq_no(self):
-        seq_no = -1
-        conf_dir = self.get_conf_dir()
-        for item in os.listdir(conf_dir):
-            item_path = os.path.join(conf_dir, item)
-            if os.path.isfile(item_path):
-                try:
-                    separator = item.rfind(".")
-                    if separator > 0 and item[separator + 1:] == 'settings':
-                        curr_seq_no = int(item.split('.')[0])
-                        if curr_seq_no > seq_no:
-                            seq_no = curr_seq_no
-                except (ValueError, IndexError, TypeError):
-                    self.logger.verbose("Failed to parse file name: {0}", item)
-                    continue
-        return seq_no
+        return HANDLER_FILE_CACHE.list_files(self.get_conf_dir(), parse_largest_seq_no)
 
     def get_status_file_path(self, extension=None):
         path = None
@@ -851,12 +892,14 @@ class ExtHandlerInstance(object):
         if seq_no == -1:
             return None
 
+        # the status files of the previous sequence numbers are not read again
+        HANDLER_FILE_CACHE.evict_directory(self.get_status_dir(), keep=[ext_status_file])
+
         ext_status = ExtensionStatus(seq_no=seq_no)
         try:
-            data_str = fileutil.read_file(ext_status_file)
-            data = json.loads(data_str)
+            data = HANDLER_FILE_CACHE.read(ext_status_file, json.loads)
             parse_ext_status(ext_status, data)
-        except IOError as e:
+        except (IOError, OSError) as e:
             ext_status.message = u"Failed to get status file {0}".format(e)
             ext_status.code = -1
             ext_status.status = "error"
@@ -893,18 +936,19 @@ class ExtHandlerInstance(object):
         heartbeat_file = os.path.join(conf.get_lib_dir(),
                                       self.get_heartbeat_file())
 
-        if not os.path.isfile(heartbeat_file):
+        try:
+            is_responsive = self.is_responsive(heartbeat_file)
+        except (IOError, OSError):
             raise ExtensionError("Failed to get heart beat file")
-        if not self.is_responsive(heartbeat_file):
+        if not is_responsive:
             return {
                     "status": "Unresponsive",
                     "code": -1,
                     "message": "Extension heartbeat is not responsive"
             }
         try:
-            heartbeat_json = fileutil.read_file(heartbeat_file)
-            heartbeat = json.loads(heartbeat_json)[0]['heartbeat']
-        except IOError as e:
+            heartbeat = HANDLER_FILE_CACHE.read(heartbeat_file, json.loads)[0]['heartbeat']
+        except (IOError, OSError) as e:
             raise ExtensionError("Failed to get heartbeat file:{0}".format(e))
         except (ValueError, KeyError) as e:
             raise ExtensionError("Malformed heartbeat file: {0}".format(e))
@@ -918,7 +962,7 @@ class ExtHandlerInstance(object):
         :param heartbeat_file: str
         :return: bool
         """
-        last_update = int(time.time() - os.stat(heartbeat_file).st_mtime)
+        last_update = int(time.time() - HANDLER_FILE_CACHE.get_mtime(heartbeat_file))
         return last_update <= 600
 
     def launch_command(self, cmd, timeout=300, extension_error_code=1000, env=None):
@@ -960,6 +1004,8 @@ class ExtHandlerInstance(object):
         cg = CGroups.for_extension(self.ext_handler.name)
         CGroupsTelemetry.track_extension(self.ext_handler.name, cg)
         msg = capture_from_process(process, cmd, timeout, extension_error_code)
+        _operation_duration.observe(elapsed_milliseconds(begin_utc),
+                                    "{0} {1}".format(self.ext_handler.name, self.operation))
 
         ret = process.poll()
         if ret is None:
@@ -971,13 +1017,18 @@ class ExtHandlerInstance(object):
 
         duration = elapsed_milliseconds(begin_utc)
         log_msg = "{0}\n{1}".format(cmd, "\n".join([line for line in msg.split('\n') if line != ""]))
+        # CPU time, memory, block I/O and context switches of the command, captured when it was reaped
+        usage = getattr(process, "usage", None)
+        if usage is not None:
+            log_msg = "{0}\n[usage] {1}".format(log_msg, usage)
+            record_command_usage((self.ext_handler.name, self.operation), usage)
         self.logger.verbose(log_msg)
         self.report_event(message=log_msg, duration=duration, log_event=False)
 
     def load_manifest(self):
         man_file = self.get_manifest_file()
         try:
-            data = json.loads(fileutil.read_file(man_file))
+            data = HANDLER_FILE_CACHE.read(man_file, json.loads)
         except (IOError, OSError) as e:
             raise ExtensionError('Failed to load manifest file ({0}): {1}'.format(man_file, e.strerror), code=1002)
         except ValueError:
@@ -988,7 +1039,8 @@ class ExtHandlerInstance(object):
     def update_settings_file(self, settings_file, settings):
         settings_file = os.path.join(self.get_conf_dir(), settings_file)
         try:
-            fileutil.write_file(settings_file, settings)
+            fileutil.write_file_if_changed(settings_file, settings)
+            HANDLER_FILE_CACHE.invalidate(self.get_conf_dir())
         except IOError as e:
             fileutil.clean_ioerror(e,
                 paths=[settings_file])
@@ -1030,7 +1082,7 @@ class ExtHandlerInstance(object):
             }
         }]
         try:
-            fileutil.write_file(self.get_env_file(), json.dumps(env))
+            fileutil.write_file_if_changed(self.get_env_file(), json.dumps(env))
         except IOError as e:
             fileutil.clean_ioerror(e,
                 paths=[self.get_base_dir(), self.pkg_file])
@@ -1042,7 +1094,8 @@ class ExtHandlerInstance(object):
         try:
             if not os.path.exists(state_dir):
                 fileutil.mkdir(state_dir, mode=0o700)
-            fileutil.write_file(state_file, handler_state)
+            fileutil.write_file_if_changed(state_file, handler_state)
+            HANDLER_FILE_CACHE.invalidate(state_file)
         except IOError as e:
             fileutil.clean_ioerror(e, paths=[state_file])
             self.logger.error("Failed to set state: {0}", e)
@@ -1054,8 +1107,8 @@ class ExtHandlerInstance(object):
             return ExtHandlerState.NotInstalled
 
         try:
-            return fileutil.read_file(state_file)
-        except IOError as e:
+            return HANDLER_FILE_CACHE.read(state_file)
+        except (IOError, OSError) as e:
             self.logger.error("Failed to get state: {0}", e)
             return ExtHandlerState.NotInstalled
     
@@ -1073,7 +1126,8 @@ class ExtHandlerInstance(object):
         try:
             handler_status_json = json.dumps(get_properties(handler_status))
             if handler_status_json is not None:
-                fileutil.write_file(status_file, handler_status_json)
+                fileutil.write_file_if_changed(status_file, handler_status_json)
+                HANDLER_FILE_CACHE.invalidate(status_file)
             else:
                 self.logger.error("Failed to create JSON document of handler status for {0} version {1}".format(
                     self.ext_handler.name,
@@ -1089,11 +1143,12 @@ class ExtHandlerInstance(object):
             return None
         
         try:
-            data = json.loads(fileutil.read_file(status_file))
+            # the caller modifies the ExtHandlerStatus; only the JSON is cached
+            data = HANDLER_FILE_CACHE.read(status_file, json.loads)
             handler_status = ExtHandlerStatus() 
             set_properties("ExtHandlerStatus", handler_status, data)
             return handler_status
-        except (IOError, ValueError) as e:
+        except (IOError, OSError, ValueError) as e:
             self.logger.error("Failed to get handler status: {0}", e)
 
     def get_full_name(self):
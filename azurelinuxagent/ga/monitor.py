@@ -16,6 +16,7 @@
 #
 
 import datetime
+import errno
 import json
 import os
 import platform
@@ -28,10 +29,15 @@ import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.errorstate import ErrorState
 
-from azurelinuxagent.common.cgroups import CGroups, CGroupsTelemetry
-from azurelinuxagent.common.event import add_event, report_metric, WALAEventOperation
+from azurelinuxagent.common.cgroups import CGroups, CGroupsGovernor, CGroupsTelemetry
+from azurelinuxagent.common.cgroupsampler import CGroupsSampler
+from azurelinuxagent.common.event import add_event, get_and_reset_evicted_events, report_metric, \
+    WALAEventOperation
+from azurelinuxagent.common.eventaggregator import EventAggregator
+from azurelinuxagent.common.eventquota import EventScheduler
 from azurelinuxagent.common.exception import EventError, ProtocolError, OSUtilError, HttpError
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.metrics import registry
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol import get_protocol_util
 from azurelinuxagent.common.protocol.healthservice import HealthService
@@ -40,7 +46,12 @@ from azurelinuxagent.common.protocol.restapi import TelemetryEventParam, \
                                                     TelemetryEventList, \
                                                     TelemetryEvent, \
                                                     set_properties
+from azurelinuxagent.common.protocol.wire import WireProtocol
+from azurelinuxagent.common.resourcebudget import get_resource_budget, get_process_cpu_time, get_process_io, \
+    TaskPriority
+import azurelinuxagent.common.utils.fileutil as fileutil
 import azurelinuxagent.common.utils.networkutil as networkutil
+from azurelinuxagent.common.utils.processutil import get_and_reset_command_usage
 from azurelinuxagent.common.utils.restutil import IOErrorCounter
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, getattrib, hash_strings
 from azurelinuxagent.common.version import DISTRO_NAME, DISTRO_VERSION, \
@@ -48,6 +59,10 @@ from azurelinuxagent.common.version import DISTRO_NAME, DISTRO_VERSION, \
             AGENT_NAME, CURRENT_AGENT, CURRENT_VERSION
 
 
+# The events waiting in the scheduler for the next collection pass
+_event_queue_depth = registry.gauge("telemetry", "Event Queue Depth")
+
+
 def parse_event(data_str):
     try:
         return parse_json_event(data_str)
@@ -90,6 +105,17 @@ def parse_json_event(data_str):
     return event
 
 
+def get_event_timestamp(evt_file_name):
+    """
+    Event files are named after the time (in microseconds) they were created
+    """
+    try:
+        name = os.path.basename(evt_file_name).split('.')[0]
+        return datetime.datetime.utcfromtimestamp(int(name) / 1000000.0)
+    except ValueError:
+        return datetime.datetime.utcnow()
+
+
 def get_monitor_handler():
     return MonitorHandler()
 
@@ -99,6 +125,7 @@ class MonitorHandler(object):
     EVENT_COLLECTION_PERIOD = datetime.timedelta(minutes=1)
     TELEMETRY_HEARTBEAT_PERIOD = datetime.timedelta(minutes=30)
     CGROUP_TELEMETRY_PERIOD = datetime.timedelta(minutes=5)
+    CGROUP_GOVERNOR_PERIOD = datetime.timedelta(minutes=1)
     # host plugin
     HOST_PLUGIN_HEARTBEAT_PERIOD = datetime.timedelta(minutes=1)
     HOST_PLUGIN_HEALTH_PERIOD = datetime.timedelta(minutes=5)
@@ -115,6 +142,10 @@ class MonitorHandler(object):
         self.last_event_collection = None
         self.last_telemetry_heartbeat = None
         self.last_cgroup_telemetry = None
+        self.cgroup_sampler = None
+        self.cgroup_governor = None
+        self.last_cgroup_governor = None
+        self.last_agent_resource_usage = None
         self.last_host_plugin_heartbeat = None
         self.last_imds_heartbeat = None
         self.protocol = None
@@ -122,10 +153,12 @@ class MonitorHandler(object):
         self.last_route_table_hash = b''
         self.last_nic_state = {}
 
-        self.counter = 0
+        self.heartbeats = registry.counter("monitor", "Heartbeats")
         self.sysinfo = []
         self.should_run = True
         self.heartbeat_id = str(uuid.uuid4()).upper()
+        self.event_aggregator = EventAggregator()
+        self.event_scheduler = EventScheduler()
         self.host_plugin_errorstate = ErrorState(min_timedelta=MonitorHandler.HOST_PLUGIN_HEALTH_PERIOD)
         self.imds_errorstate = ErrorState(min_timedelta=MonitorHandler.IMDS_HEALTH_PERIOD)
 
@@ -139,6 +172,25 @@ class MonitorHandler(object):
         self.should_run = False
         if self.is_alive():
             self.event_thread.join()
+        if self.cgroup_sampler is not None:
+            self.cgroup_sampler.stop()
+        self.send_aggregated_events()
+
+    def send_aggregated_events(self):
+        """
+        Send the events still held by the aggregator
+        """
+        if self.protocol is None or self.event_aggregator.pending + self.event_scheduler.pending == 0:
+            return
+        try:
+            for aggregated_event in self.event_aggregator.flush(force=True):
+                self.event_scheduler.add(aggregated_event)
+            self.remove_event_files(self.event_aggregator.pop_released_sources())
+            event_list = TelemetryEventList()
+            event_list.events.extend(self.event_scheduler.next_batch())
+            self.protocol.report_event(event_list)
+        except Exception as e:
+            logger.warn("Failed to send aggregated events: {0}", e)
 
     def init_protocols(self):
         self.protocol = self.protocol_util.get_protocol()
@@ -201,23 +253,39 @@ class MonitorHandler(object):
             logger.warn("failed to get IMDS info: {0}", e)
 
     def collect_event(self, evt_file_name):
+        """
+        Read the event file; it is removed by remove_event_files() once its
+        event is sent, or once the aggregate holding it is
+        """
         try:
             logger.verbose("Found event file: {0}", evt_file_name)
             with open(evt_file_name, "rb") as evt_file:
-                # if fail to open or delete the file, throw exception
+                # if fail to open the file, throw exception
                 data_str = evt_file.read().decode("utf-8", 'ignore')
             logger.verbose("Processed event file: {0}", evt_file_name)
-            os.remove(evt_file_name)
             return data_str
         except IOError as e:
             msg = "Failed to process {0}, {1}".format(evt_file_name, e)
             raise EventError(msg)
 
+    @staticmethod
+    def remove_event_files(evt_file_names):
+        for evt_file_name in evt_file_names:
+            try:
+                os.remove(evt_file_name)
+            except (IOError, OSError) as e:
+                # the file may have been evicted by the event logger meanwhile
+                if e.errno != errno.ENOENT:
+                    logger.error("Failed to remove {0}, {1}", evt_file_name, e)
+
     def collect_and_send_events(self):
         if self.last_event_collection is None:
             self.last_event_collection = datetime.datetime.utcnow() - MonitorHandler.EVENT_COLLECTION_PERIOD
 
         if datetime.datetime.utcnow() >= (self.last_event_collection + MonitorHandler.EVENT_COLLECTION_PERIOD):
+            if not get_resource_budget().should_run("telemetry collection", TaskPriority.NORMAL):
+                return
+
             try:
                 event_list = TelemetryEventList()
                 event_dir = os.path.join(conf.get_lib_dir(), "events")
@@ -226,20 +294,33 @@ class MonitorHandler(object):
                     if not event_file.endswith(".tld"):
                         continue
                     event_file_path = os.path.join(event_dir, event_file)
+                    # collected by a previous pass, and held by the aggregator: the file is kept until the
+                    # aggregate is flushed, so the event is collected again if the agent restarts meanwhile
+                    if self.event_aggregator.is_held(event_file_path):
+                        continue
                     try:
                         data_str = self.collect_event(event_file_path)
                     except EventError as e:
                         logger.error("{0}", e)
                         continue
 
+                    held = False
                     try:
                         event = parse_event(data_str)
                         self.add_sysinfo(event)
-                        event_list.events.append(event)
+                        held = self.event_aggregator.add(event, get_event_timestamp(event_file_path),
+                                                         source=event_file_path)
                     except (ValueError, ProtocolError) as e:
                         logger.warn("Failed to decode event file: {0}", e)
-                        continue
+                    if not held:
+                        self.remove_event_files([event_file_path])
+
+                for aggregated_event in self.event_aggregator.flush():
+                    self.event_scheduler.add(aggregated_event)
+                self.remove_event_files(self.event_aggregator.pop_released_sources())
 
+                event_list.events.extend(self.event_scheduler.next_batch())
+                _event_queue_depth.set(self.event_scheduler.pending)
                 if len(event_list.events) == 0:
                     return
 
@@ -255,12 +336,14 @@ class MonitorHandler(object):
     def daemon(self):
         min_delta = min(MonitorHandler.TELEMETRY_HEARTBEAT_PERIOD,
                         MonitorHandler.CGROUP_TELEMETRY_PERIOD,
+                        MonitorHandler.CGROUP_GOVERNOR_PERIOD,
                         MonitorHandler.EVENT_COLLECTION_PERIOD,
                         MonitorHandler.HOST_PLUGIN_HEARTBEAT_PERIOD,
                         MonitorHandler.IMDS_HEARTBEAT_PERIOD).seconds
         while self.should_run:
             self.send_telemetry_heartbeat()
             self.send_cgroup_telemetry()
+            self.adjust_cgroup_limits()
             self.collect_and_send_events()
             self.send_host_plugin_heartbeat()
             self.send_imds_heartbeat()
@@ -366,7 +449,8 @@ class MonitorHandler(object):
             try:
                 incarnation = self.protocol.get_incarnation()
                 dropped_packets = self.osutil.get_firewall_dropped_packets(self.protocol.endpoint)
-                msg = "{0};{1};{2};{3}".format(incarnation, self.counter, self.heartbeat_id, dropped_packets)
+                msg = "{0};{1};{2};{3}".format(incarnation, self.heartbeats.value(), self.heartbeat_id,
+                                                dropped_packets)
 
                 add_event(
                     name=AGENT_NAME,
@@ -376,7 +460,7 @@ class MonitorHandler(object):
                     message=msg,
                     log_event=False)
 
-                self.counter += 1
+                self.heartbeats.inc()
 
                 io_errors = IOErrorCounter.get_and_reset()
                 hostplugin_errors = io_errors.get("hostplugin")
@@ -394,13 +478,103 @@ class MonitorHandler(object):
                         is_success=True,
                         message=msg,
                         log_event=False)
+
+                self.send_agent_resource_telemetry()
+                # the counters accumulate while the flush is deferred
+                if get_resource_budget().should_run("metric flush", TaskPriority.LOW):
+                    self.send_event_quota_telemetry()
+                    self.send_goal_state_cache_telemetry()
+                    self.send_file_write_telemetry()
+                    self.send_extension_command_telemetry()
+                    registry.flush(report_metric)
             except Exception as e:
                 logger.warn("Failed to send heartbeat: {0}", e)
 
             self.last_telemetry_heartbeat = datetime.datetime.utcnow()
 
+    def send_agent_resource_telemetry(self):
+        """
+        Report the CPU time and the I/O of this process since the previous report, and the deferrals of its
+        background work
+        """
+        now = time.time()
+        cpu_time = get_process_cpu_time()
+        bytes_read, bytes_written = get_process_io()
+        if self.last_agent_resource_usage is not None:
+            last_time, last_cpu_time, last_read, last_written = self.last_agent_resource_usage
+            elapsed = max(1.0, now - last_time)
+            cpu_percent = round(100.0 * (cpu_time - last_cpu_time) / elapsed, 3)
+            report_metric("agent resources", "% Processor Time", "", cpu_percent)
+            report_metric("agent resources", "Bytes Read", "", max(0, bytes_read - last_read))
+            report_metric("agent resources", "Bytes Written", "", max(0, bytes_written - last_written))
+        self.last_agent_resource_usage = (now, cpu_time, bytes_read, bytes_written)
+
+        for task, count in get_resource_budget().get_and_reset_deferrals().items():
+            report_metric("agent resources", "Deferrals", task, count)
+
+    @staticmethod
+    def send_extension_command_telemetry():
+        """
+        Report, per extension and operation (Install, Enable, etc.), the resources used by the extension commands
+        since the previous report
+        """
+        for (name, operation), usage in sorted(get_and_reset_command_usage().items()):
+            instance = "{0} {1}".format(name, operation)
+            report_metric("extension commands", "Count", instance, usage.count)
+            report_metric("extension commands", "User CPU Time", instance, round(usage.user_time, 3))
+            report_metric("extension commands", "System CPU Time", instance, round(usage.system_time, 3))
+            report_metric("extension commands", "Max RSS", instance, usage.max_rss)
+            report_metric("extension commands", "Blocks Read", instance, usage.blocks_read)
+            report_metric("extension commands", "Blocks Written", instance, usage.blocks_written)
+            report_metric("extension commands", "Context Switches", instance,
+                          usage.voluntary_switches + usage.involuntary_switches)
+
+    def send_event_quota_telemetry(self):
+        """
+        Report, per event source, the number of events throttled by the
+        scheduler and the number dropped by the scheduler or evicted from
+        the events directory
+        """
+        for source, count in get_and_reset_evicted_events().items():
+            self.event_scheduler.record_dropped(source, count)
+
+        for source, (throttled, dropped) in self.event_scheduler.get_and_reset_counts().items():
+            if throttled > 0:
+                report_metric("telemetry", "Throttled Events", source, throttled)
+            if dropped > 0:
+                report_metric("telemetry", "Dropped Events", source, dropped)
+
+    def send_goal_state_cache_telemetry(self):
+        """
+        Report the hit rate of the goal state cache shared by the handlers
+        using the WireClient, and the disk reads and parses of goal state
+        files avoided by its file cache
+        """
+        if not isinstance(self.protocol, WireProtocol):
+            return
+        hits, misses = self.protocol.client.goal_state_cache.get_and_reset_counts()
+        if hits + misses > 0:
+            report_metric("goal state cache", "Hit Rate", "", round(100.0 * hits / (hits + misses), 2))
+
+        reads_avoided, parses_avoided = self.protocol.client.file_cache.get_and_reset_counts()
+        if reads_avoided > 0:
+            report_metric("goal state cache", "Disk Reads Avoided", "", reads_avoided)
+        if parses_avoided > 0:
+            report_metric("goal state cache", "Parses Avoided", "", parses_avoided)
+
     @staticmethod
-    def init_cgroups():
+    def send_file_write_telemetry():
+        """
+        Report the file writes made and avoided (the file already had the
+        contents) by fileutil.write_file_if_changed
+        """
+        writes, writes_avoided = fileutil.get_and_reset_write_counts()
+        if writes > 0:
+            report_metric("file writes", "Writes", "", writes)
+        if writes_avoided > 0:
+            report_metric("file writes", "Writes Avoided", "", writes_avoided)
+
+    def init_cgroups(self):
         # Track metrics for the roll-up cgroup and for the agent cgroup
         try:
             CGroupsTelemetry.track_cgroup(CGroups.for_extension(""))
@@ -411,17 +585,32 @@ class MonitorHandler(object):
             # is not unexpected
             logger.warn("Monitor: cgroups not initialized: {0}", ustr(e))
             logger.verbose(traceback.format_exc())
+            return
+
+        # Sample the tracked cgroups between reports, so that the report includes the peaks and percentiles
+        sampling_period = conf.get_cgroups_sampling_period()
+        if sampling_period > 0 and CGroups.enabled():
+            self.cgroup_sampler = CGroupsSampler(sampling_period)
+            self.cgroup_sampler.start()
+
+        if conf.get_cgroups_governor_enabled() and CGroups.enabled():
+            self.cgroup_governor = CGroupsGovernor(
+                (conf.get_cgroups_extension_cpu_min(), conf.get_cgroups_extension_cpu_max()),
+                (conf.get_cgroups_extension_memory_min(), conf.get_cgroups_extension_memory_max()))
 
     def send_cgroup_telemetry(self):
         if self.last_cgroup_telemetry is None:
             self.last_cgroup_telemetry = datetime.datetime.utcnow()
 
-        if datetime.datetime.utcnow() >= (self.last_telemetry_heartbeat + MonitorHandler.CGROUP_TELEMETRY_PERIOD):
+        if datetime.datetime.utcnow() >= (self.last_cgroup_telemetry + MonitorHandler.CGROUP_TELEMETRY_PERIOD):
             try:
-                for cgroup_name, metrics in CGroupsTelemetry.collect_all_tracked().items():
-                    for metric_group, metric_name, value in metrics:
-                        if value > 0:
-                            report_metric(metric_group, metric_name, cgroup_name, value)
+                if self.cgroup_sampler is not None:
+                    self.cgroup_sampler.report(report_metric)
+                else:
+                    for cgroup_name, metrics in CGroupsTelemetry.collect_all_tracked().items():
+                        for metric_group, metric_name, value in metrics:
+                            if value > 0:
+                                report_metric(metric_group, metric_name, cgroup_name, value)
             except Exception as e:
                 logger.warn("Monitor: failed to collect cgroups performance metrics: {0}", ustr(e))
                 logger.verbose(traceback.format_exc())
@@ -435,6 +624,22 @@ class MonitorHandler(object):
 
             self.last_cgroup_telemetry = datetime.datetime.utcnow()
 
+    def adjust_cgroup_limits(self):
+        if self.cgroup_governor is None:
+            return
+
+        if self.last_cgroup_governor is None or \
+                datetime.datetime.utcnow() >= (self.last_cgroup_governor + MonitorHandler.CGROUP_GOVERNOR_PERIOD):
+            try:
+                for name, limit_name, value in self.cgroup_governor.adjust(CGroupsTelemetry.tracked_extensions()):
+                    logger.info("Monitor: set the {0} of {1} to {2}", limit_name, name, value)
+                    report_metric("CGroups Governor", limit_name, name, value)
+            except Exception as e:
+                logger.warn("Monitor: failed to adjust the cgroup limits: {0}", ustr(e))
+                logger.verbose(traceback.format_exc())
+
+            self.last_cgroup_governor = datetime.datetime.utcnow()
+
     def log_altered_network_configuration(self):
         """
         Check various pieces of network configuration and, if altered since the last check, log the new state.
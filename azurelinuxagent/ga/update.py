@@ -47,6 +47,7 @@ from azurelinuxagent.common.exception import ProtocolError, \
                                             ResourceGoneError, \
                                             UpdateError
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.metrics import registry
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol import get_protocol_util
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
@@ -74,6 +75,12 @@ MAX_FAILURE = 3 # Max failure allowed for agent before blacklisted
 GOAL_STATE_INTERVAL = 3
 GOAL_STATE_INTERVAL_DISABLED = 5 * 60
 
+# The time of the iterations of the main loop (excluding the sleep between them) and of those that processed a new
+# goal state, in milliseconds, and the incarnation of the last goal state processed
+_loop_time = registry.histogram("exthandler", "Loop Time")
+_goal_state_processing_time = registry.histogram("exthandler", "Goal State Processing Time")
+_incarnation = registry.gauge("exthandler", "Incarnation")
+
 ORPHAN_WAIT_INTERVAL = 15 * 60
 
 AGENT_SENTINEL_FILE = "current_version"
@@ -316,6 +323,9 @@ class UpdateHandler(object):
                 if last_etag != exthandlers_handler.last_etag:
                     self._ensure_readonly_files()
                     duration = elapsed_milliseconds(utc_start)
+                    _goal_state_processing_time.observe(duration)
+                    if ustr(exthandlers_handler.last_etag).isdigit():
+                        _incarnation.set(int(exthandlers_handler.last_etag))
                     logger.info('ProcessGoalState completed [incarnation {0}; {1} ms]',
                                 exthandlers_handler.last_etag,
                                 duration)
@@ -325,6 +335,7 @@ class UpdateHandler(object):
                         duration=duration,
                         message="Incarnation {0}".format(exthandlers_handler.last_etag))
 
+                _loop_time.observe(elapsed_milliseconds(utc_start))
                 time.sleep(goal_state_interval)
 
         except Exception as e:
@@ -17,7 +17,11 @@
 
 from __future__ import print_function
 
-from azurelinuxagent.common.cgroups import CGroupsTelemetry, CGroups, CGroupsException, BASE_CGROUPS, Cpu, Memory
+from azurelinuxagent.common.cgroups import CGroupsTelemetry, CGroups, CGroupsException, BASE_CGROUPS, Cpu, Memory, \
+    CGroupsGovernor, SystemLoad, LOAD_HIGH, LOAD_LOW, CGROUP_V1, CGROUP_V2, USER_HZ, get_cgroup_version, parse_flat_keyed, parse_nested_keyed
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.metricsource import metric_sources
+from azurelinuxagent.common.version import AGENT_NAME
 from tests.tools import *
 
 import os
@@ -215,3 +219,348 @@ class TestCGroups(AgentTestCase):
         self.assertEqual(2048*1024, CGroups._format_memory_value('megabytes', 2))
         self.assertEqual((1024 + 512) * 1024 * 1024, CGroups._format_memory_value('gigabytes', 1.5))
         self.assertRaises(CGroupsException, CGroups._format_memory_value, 'KiloBytes', 1)
+
+
+MOUNTINFO_V1 = """32 24 0:28 / /sys/fs/cgroup rw,relatime - tmpfs tmpfs rw,mode=755
+33 32 0:29 / /sys/fs/cgroup/cpu,cpuacct rw,relatime shared:12 - cgroup cgroup rw,cpu,cpuacct
+36 32 0:32 / /sys/fs/cgroup/memory rw,relatime shared:15 - cgroup cgroup rw,memory
+42 32 0:38 / /sys/fs/cgroup/unified rw,relatime shared:5 - cgroup2 cgroup2 rw
+"""
+
+MOUNTINFO_V2 = """24 30 0:22 / /sys rw,nosuid,nodev,noexec,relatime shared:7 - sysfs sysfs rw
+32 24 0:27 / /sys/fs/cgroup rw,nosuid,nodev,noexec,relatime shared:8 - cgroup2 cgroup2 rw,nsdelegate
+"""
+
+
+class TestCGroupsV2(AgentTestCase):
+    """
+    Tests for the cgroup v2 backend, against a fake unified hierarchy in the temporary directory
+    """
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.root = os.path.join(self.tmp_dir, "cgroup")
+        os.makedirs(self.root)
+        self._write(self.root, "cgroup.controllers", "cpuset cpu io memory pids\n")
+        self._write(self.root, "cgroup.subtree_control", "")
+
+        self.patches = [
+            patch.object(CGroups, "_version", CGROUP_V2),
+            patch.object(CGroups, "_v2_root", self.root),
+            patch.object(CGroups, "_use_systemd", False),
+            patch("azurelinuxagent.common.cgroups.CGroups.enabled", return_value=True),
+            patch("azurelinuxagent.common.cgroups.CGroups.get_num_cores", return_value=2),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        metric_sources.close_all()
+        CGroupsTelemetry._tracked.clear()
+        AgentTestCase.tearDown(self)
+
+    @staticmethod
+    def _write(directory, name, contents):
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(contents)
+
+    def _write_stats(self, path, usage_usec, stall_usec, rbytes):
+        self._write(path, "cpu.stat", "usage_usec {0}\nuser_usec {0}\nsystem_usec 0\n".format(usage_usec))
+        self._write(path, "memory.current", "4194304\n")
+        self._write(path, "memory.stat", "anon 1048576\nfile 2097152\nkernel_stack 16384\n")
+        self._write(path, "io.stat", "8:0 rbytes={0} wbytes=4096 rios=2 wios=1 dbytes=0 dios=0\n"
+                                     "8:16 rbytes={0} wbytes=0 rios=2 wios=0 dbytes=0 dios=0\n".format(rbytes))
+        for resource in ["cpu", "memory", "io"]:
+            self._write(path, "{0}.pressure".format(resource),
+                        "some avg10=0.00 avg60=0.00 avg300=0.00 total={0}\n"
+                        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n".format(stall_usec))
+
+    def test_get_cgroup_version(self):
+        self.assertEqual((CGROUP_V1, None), get_cgroup_version(MOUNTINFO_V1))
+        self.assertEqual((CGROUP_V2, "/sys/fs/cgroup"), get_cgroup_version(MOUNTINFO_V2))
+        self.assertEqual((CGROUP_V1, None), get_cgroup_version(""))
+
+    def test_parse_keyed_files(self):
+        self.assertEqual({"usage_usec": 10, "user_usec": 7}, parse_flat_keyed("usage_usec 10\nuser_usec 7\nbad\n"))
+        self.assertEqual({"some": {"avg10": 1.5, "total": 100.0}},
+                         parse_nested_keyed("some avg10=1.50 total=100\n"))
+
+    def test_for_extension_uses_the_unified_hierarchy(self):
+        cg = CGroups.for_extension("Microsoft.Test.Ext")
+        path = os.path.join(self.root, AGENT_NAME, "Microsoft.Test.Ext")
+        self.assertEqual({"cpu": path, "memory": path, "io": path}, cg.cgroups)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_missing_controller_disables_cgroups(self):
+        self._write(self.root, "cgroup.controllers", "cpuset cpu pids\n")
+        with patch("azurelinuxagent.common.cgroups.CGroups.disable") as mock_disable:
+            self.assertRaises(CGroupsException, CGroups.for_extension, "Microsoft.Test.Ext")
+            self.assertEqual(1, mock_disable.call_count)
+
+    def test_setup_wrapper_groups_enables_controllers(self):
+        CGroups._setup_wrapper_groups()
+        wrapper = os.path.join(self.root, AGENT_NAME)
+        self.assertTrue(os.path.isdir(wrapper))
+        subtree_control = fileutil.read_file(os.path.join(self.root, "cgroup.subtree_control"))
+        for controller in ["+cpu", "+memory", "+io"]:
+            self.assertIn(controller, subtree_control)
+
+    @patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot")
+    def test_collect(self, mock_ticks):
+        mock_ticks.side_effect = [1000, 1000 + USER_HZ]
+        cg = CGroups.for_extension("Microsoft.Test.Ext")
+        path = cg.cgroups["cpu"]
+        self._write_stats(path, usage_usec=1000000, stall_usec=0, rbytes=1024)
+
+        ct = CGroupsTelemetry("Microsoft.Test.Ext", cg)
+        ct.data["pressure"].current_time -= 10
+        # half a second of CPU and one second of stalls since
+        self._write_stats(path, usage_usec=1500000, stall_usec=1000000, rbytes=3072)
+        metrics = dict(((family, name), value) for family, name, value in ct.collect())
+
+        # half a second over one second of two cores
+        self.assertEqual(100.0, metrics[("Process", "% Processor Time")])
+        self.assertEqual(4194304, metrics[("Memory", "Total Memory Usage")])
+        self.assertEqual(1048576, metrics[("Memory", "Anonymous Memory")])
+        self.assertEqual(2097152, metrics[("Memory", "Page Cache")])
+        self.assertEqual(6144, metrics[("IO", "Bytes Read")])
+        self.assertEqual(4096, metrics[("IO", "Bytes Written")])
+        self.assertAlmostEqual(10.0, metrics[("Pressure", "CPU Some")], delta=0.5)
+        self.assertAlmostEqual(10.0, metrics[("Pressure", "Memory Some")], delta=0.5)
+        self.assertEqual(0.0, metrics[("Pressure", "IO Full")])
+
+        # io is reported as the delta since the previous collection
+        metrics = dict(((family, name), value) for family, name, value in ct.data["io"].collect())
+        self.assertEqual(0, metrics[("IO", "Bytes Read")])
+
+    @patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot", return_value=1000)
+    def test_collect_all_tracked_reads_proc_stat_once(self, mock_ticks):
+        for name in ["Microsoft.Test.Ext1", "Microsoft.Test.Ext2"]:
+            cg = CGroups.for_extension(name)
+            self._write_stats(cg.cgroups["cpu"], usage_usec=1000000, stall_usec=0, rbytes=1024)
+            CGroupsTelemetry.track_cgroup(cg)
+        mock_ticks.reset_mock()
+
+        self.assertEqual(2, len(CGroupsTelemetry.collect_all_tracked()))
+        self.assertEqual(1, mock_ticks.call_count)
+
+    @patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot", return_value=1000)
+    def test_stop_tracking_closes_the_cgroup_files(self, _):
+        cg = CGroups.for_extension("Microsoft.Test.Ext")
+        self._write_stats(cg.cgroups["cpu"], usage_usec=1000000, stall_usec=0, rbytes=1024)
+        CGroupsTelemetry.track_cgroup(cg)
+        CGroupsTelemetry.collect_all_tracked()
+        self.assertTrue(len(metric_sources) > 0)
+
+        CGroupsTelemetry.stop_tracking("Microsoft.Test.Ext")
+        self.assertEqual(0, len(metric_sources))
+
+    def test_set_limits(self):
+        cg = CGroups.for_extension("Microsoft.Test.Ext")
+        path = cg.cgroups["cpu"]
+        self._write(path, "cpu.max", "max 100000\n")
+
+        cg.set_cpu_limit(50)
+        self.assertEqual("50000 100000\n", fileutil.read_file(os.path.join(path, "cpu.max")))
+        cg.set_memory_limit(2)
+        self.assertEqual("2097152\n", fileutil.read_file(os.path.join(path, "memory.max")))
+        cg.set_memory_limit()
+        self.assertEqual("max\n", fileutil.read_file(os.path.join(path, "memory.max")))
+
+
+class TestCGroupsGovernor(AgentTestCase):
+    """
+    Tests for the adaptive limits of the extension cgroups, against fake cgroup v1 and v2 trees in the temporary
+    directory
+    """
+    EXTENSION = "Microsoft.Test.Ext"
+
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.root = os.path.join(self.tmp_dir, "cgroup")
+        os.makedirs(self.root)
+        self.ticks = 1000
+        self.system_load = Mock()
+        self.system_load.sample.return_value = (None, None)
+
+        self.patches = [
+            patch.object(CGroups, "_use_systemd", False),
+            patch("azurelinuxagent.common.cgroups.CGroups.enabled", return_value=True),
+            patch("azurelinuxagent.common.cgroups.CGroups.get_num_cores", return_value=2),
+            patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_total_cpu_ticks_since_boot",
+                  side_effect=lambda: self.ticks),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        metric_sources.close_all()
+        AgentTestCase.tearDown(self)
+
+    @staticmethod
+    def _write(directory, name, contents):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(contents)
+
+    def _setup_v1(self):
+        self.patches.extend([patch.object(CGroups, "_version", CGROUP_V1),
+                             patch("azurelinuxagent.common.cgroups.BASE_CGROUPS", self.root)])
+        for p in self.patches[-2:]:
+            p.start()
+        self.cpu_path = os.path.join(self.root, "cpu", AGENT_NAME, self.EXTENSION)
+        self.memory_path = os.path.join(self.root, "memory", AGENT_NAME, self.EXTENSION)
+        self._write(self.cpu_path, "cpu.cfs_period_us", "100000\n")
+        self._write(self.cpu_path, "cpu.cfs_quota_us", "-1\n")
+        self._write(self.memory_path, "memory.usage_in_bytes", "1073741824\n")
+        self.cpu_usage = 0
+        self._use_cpu(0)
+
+    def _setup_v2(self):
+        self.patches.extend([patch.object(CGroups, "_version", CGROUP_V2),
+                             patch.object(CGroups, "_v2_root", self.root)])
+        for p in self.patches[-2:]:
+            p.start()
+        self._write(self.root, "cgroup.controllers", "cpu memory\n")
+        self.cpu_path = self.memory_path = os.path.join(self.root, AGENT_NAME, self.EXTENSION)
+        self._write(self.cpu_path, "cpu.max", "max 100000\n")
+        self._write(self.cpu_path, "memory.current", "1073741824\n")
+        self.cpu_usage = 0
+        self._use_cpu(0)
+
+    def _use_cpu(self, ticks):
+        """
+        Advance the system CPU time by 1000 ticks (500 per core), of which the extension used 'ticks'
+        """
+        self.ticks += 1000
+        self.cpu_usage += ticks
+        if CGroups.is_cgroup_v2():
+            self._write(self.cpu_path, "cpu.stat", "usage_usec {0}\n".format(self.cpu_usage * 1000000 // USER_HZ))
+        else:
+            self._write(self.cpu_path, "cpuacct.stat", "user {0}\nsystem 0\n".format(self.cpu_usage))
+
+    def _adjust(self, governor, cpu_load=None, memory_load=None, cpu_ticks=0):
+        self._use_cpu(cpu_ticks)
+        self.system_load.sample.return_value = (cpu_load, memory_load)
+        return governor.adjust([self.EXTENSION])
+
+    def _read(self, path, name):
+        return fileutil.read_file(os.path.join(path, name)).strip()
+
+    def test_cpu_limit_is_halved_under_pressure_and_doubled_when_idle(self):
+        self._setup_v2()
+        governor = CGroupsGovernor((10, 100), (256, 2048), system_load=self.system_load)
+        # the first adjustment has no usage to go by
+        self.assertEqual([], self._adjust(governor, cpu_load=LOAD_HIGH, cpu_ticks=500))
+
+        # a full core out of two
+        self.assertEqual([(self.EXTENSION, "CPU Limit", 50)], self._adjust(governor, LOAD_HIGH, cpu_ticks=500))
+        self.assertEqual("50000 100000", self._read(self.cpu_path, "cpu.max"))
+        self._adjust(governor, LOAD_HIGH, cpu_ticks=500)
+        self._adjust(governor, LOAD_HIGH, cpu_ticks=500)
+        self.assertEqual([(self.EXTENSION, "CPU Limit", 10)], self._adjust(governor, LOAD_HIGH, cpu_ticks=500))
+        self.assertEqual("10000 100000", self._read(self.cpu_path, "cpu.max"))
+        self.assertEqual([], self._adjust(governor, LOAD_HIGH, cpu_ticks=500))
+
+        # neither under pressure nor idle
+        self.assertEqual([], self._adjust(governor))
+        self.assertEqual([(self.EXTENSION, "CPU Limit", 20)], self._adjust(governor, LOAD_LOW))
+        self.assertEqual("20000 100000", self._read(self.cpu_path, "cpu.max"))
+
+    def test_extensions_using_little_cpu_are_not_throttled(self):
+        self._setup_v2()
+        governor = CGroupsGovernor((10, 100), (256, 2048), system_load=self.system_load)
+        self._adjust(governor)
+        # 10% of a core
+        self.assertEqual([], self._adjust(governor, LOAD_HIGH, cpu_ticks=50))
+        self.assertEqual("max 100000", self._read(self.cpu_path, "cpu.max"))
+
+    def test_memory_high_is_adjusted(self):
+        self._setup_v2()
+        governor = CGroupsGovernor((10, 100), (256, 2048), system_load=self.system_load)
+        # the extension uses 1 GB
+        self.assertEqual([(self.EXTENSION, "Memory High", 1024)], self._adjust(governor, memory_load=LOAD_HIGH))
+        self.assertEqual(str(1024 * 1024 * 1024), self._read(self.memory_path, "memory.high"))
+        self._adjust(governor, memory_load=LOAD_HIGH)
+        self._adjust(governor, memory_load=LOAD_HIGH)
+        self.assertEqual((100, 256), governor.get_limits(self.EXTENSION))
+
+        self.assertEqual([(self.EXTENSION, "Memory High", 512)], self._adjust(governor, memory_load=LOAD_LOW))
+        self.assertEqual(str(512 * 1024 * 1024), self._read(self.memory_path, "memory.high"))
+
+    def test_cgroup_v1(self):
+        self._setup_v1()
+        governor = CGroupsGovernor((10, 100), (256, 2048), system_load=self.system_load)
+        self._adjust(governor)
+
+        self.assertEqual([(self.EXTENSION, "CPU Limit", 50), (self.EXTENSION, "Memory High", 1024)],
+                         self._adjust(governor, LOAD_HIGH, LOAD_HIGH, cpu_ticks=500))
+        self.assertEqual("50000", self._read(self.cpu_path, "cpu.cfs_quota_us"))
+        self.assertEqual(str(1024 * 1024 * 1024), self._read(self.memory_path, "memory.soft_limit_in_bytes"))
+
+    def test_state_of_extensions_no_longer_governed_is_dropped(self):
+        self._setup_v2()
+        governor = CGroupsGovernor((10, 100), (256, 2048), system_load=self.system_load)
+        self._adjust(governor, memory_load=LOAD_HIGH)
+        self.assertEqual((100, 1024), governor.get_limits(self.EXTENSION))
+
+        self.assertEqual([], governor.adjust([]))
+        self.assertEqual((100, 2048), governor.get_limits(self.EXTENSION))
+
+    def test_cpu_bound_is_limited_to_the_cores(self):
+        self._setup_v2()
+        governor = CGroupsGovernor((10, 400), (256, 2048), system_load=self.system_load)
+        self.assertEqual(200, governor.cpu_max)
+
+
+class TestSystemLoad(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.proc = os.path.join(self.tmp_dir, "proc")
+        os.makedirs(os.path.join(self.proc, "pressure"))
+        self.patches = [
+            patch("azurelinuxagent.common.cgroups.PROC_PRESSURE", os.path.join(self.proc, "pressure")),
+            patch("azurelinuxagent.common.cgroups.PROC_MEMINFO", os.path.join(self.proc, "meminfo")),
+            patch("azurelinuxagent.common.cgroups.PROC_STAT", os.path.join(self.proc, "stat")),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        metric_sources.close_all()
+        AgentTestCase.tearDown(self)
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.proc, name), "w") as f:
+            f.write(contents)
+
+    def test_sample_uses_pressure_stall_information(self):
+        self._write("pressure/cpu", "some avg10=25.00 avg60=10.00 avg300=1.00 total=1000\n")
+        self._write("pressure/memory", "some avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+                                       "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n")
+        self.assertEqual((LOAD_HIGH, LOAD_LOW), SystemLoad().sample())
+
+        self._write("pressure/cpu", "some avg10=5.00 avg60=10.00 avg300=1.00 total=1000\n")
+        self.assertEqual((None, LOAD_LOW), SystemLoad().sample())
+
+    def test_sample_without_pressure_stall_information(self):
+        system_load = SystemLoad()
+        self._write("stat", "cpu  1000 0 0 1000 0 0 0 0 0 0\ncpu0 1000 0 0 1000 0 0 0 0 0 0\n")
+        self._write("meminfo", "MemTotal:       1000 kB\nMemFree:          50 kB\nMemAvailable:     50 kB\n")
+        # the CPU utilization is computed since the previous sample
+        self.assertEqual((None, LOAD_HIGH), system_load.sample())
+
+        # 95% busy
+        self._write("stat", "cpu  1950 0 0 1050 0 0 0 0 0 0\ncpu0 1950 0 0 1050 0 0 0 0 0 0\n")
+        self._write("meminfo", "MemTotal:       1000 kB\nMemFree:         500 kB\nMemAvailable:    500 kB\n")
+        self.assertEqual((LOAD_HIGH, LOAD_LOW), system_load.sample())
+
+        # 10% busy
+        self._write("stat", "cpu  2050 0 0 1950 0 0 0 0 0 0\ncpu0 2050 0 0 1950 0 0 0 0 0 0\n")
+        self.assertEqual((LOAD_LOW, LOAD_LOW), system_load.sample())
@@ -0,0 +1,133 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+from azurelinuxagent.common.cgroupsampler import CGroupsSampler, RingBuffer, SUMMARY_STATISTICS, summarize
+from tests.tools import *
+
+
+class TestRingBuffer(AgentTestCase):
+    def test_append_wraps_around(self):
+        buffer = RingBuffer(3)
+        for value in range(1, 6):
+            buffer.append(value)
+
+        self.assertEqual(3, len(buffer))
+        self.assertEqual([3, 4, 5], buffer.values())
+        # the count includes the samples that were overwritten
+        self.assertEqual(5, buffer.count)
+
+    def test_clear(self):
+        buffer = RingBuffer(3)
+        buffer.append(1)
+        buffer.append(2)
+        self.assertEqual([1, 2], buffer.values())
+
+        buffer.clear()
+        self.assertEqual(0, len(buffer))
+        self.assertEqual(0, buffer.count)
+        buffer.append(3)
+        self.assertEqual([3], buffer.values())
+
+
+class TestSummarize(AgentTestCase):
+    def test_nearest_rank_percentiles(self):
+        summary = summarize(range(100, 0, -1))
+        self.assertEqual(1, summary["Min"])
+        self.assertEqual(100, summary["Max"])
+        self.assertEqual(50.5, summary["Mean"])
+        self.assertEqual(50, summary["P50"])
+        self.assertEqual(95, summary["P95"])
+        self.assertEqual(99, summary["P99"])
+
+    def test_percentiles_of_few_samples(self):
+        # with 20 samples, the 95th percentile is the 19th value and the 99th the largest one
+        summary = summarize(range(1, 21))
+        self.assertEqual(10, summary["P50"])
+        self.assertEqual(19, summary["P95"])
+        self.assertEqual(20, summary["P99"])
+
+        summary = summarize([7])
+        for statistic in SUMMARY_STATISTICS:
+            self.assertEqual(7, summary[statistic])
+
+
+class TestCGroupsSampler(AgentTestCase):
+    @staticmethod
+    def _sample(sampler, samples):
+        with patch("azurelinuxagent.common.cgroupsampler.CGroupsTelemetry.collect_all_tracked",
+                   side_effect=samples):
+            for _ in samples:
+                sampler.sample()
+
+    def test_get_summaries(self):
+        sampler = CGroupsSampler(1, capacity=10)
+        self._sample(sampler, [{"agent": [("Process", "% Processor Time", value), ("Memory", "Total Memory Usage", 10)]}
+                               for value in [1, 5, 3]])
+
+        summaries = sampler.get_summaries()
+        # sorted by cgroup, then metric group
+        self.assertEqual(["Total Memory Usage", "% Processor Time"], [name for _, _, name, _ in summaries])
+        cgroup_name, metric_group, _, summary = summaries[1]
+        self.assertEqual(("agent", "Process"), (cgroup_name, metric_group))
+        self.assertEqual(1, summary["Min"])
+        self.assertEqual(5, summary["Max"])
+        self.assertEqual(3.0, summary["Mean"])
+        self.assertEqual(3, summary["Count"])
+
+        # the buffers start over after each call
+        self._sample(sampler, [{"agent": [("Process", "% Processor Time", 7)]}])
+        summaries = sampler.get_summaries()
+        self.assertEqual(1, len(summaries))
+        self.assertEqual(7, summaries[0][3]["Max"])
+        self.assertEqual(1, summaries[0][3]["Count"])
+
+    def test_buffers_of_untracked_cgroups_are_dropped(self):
+        sampler = CGroupsSampler(1, capacity=10)
+        self._sample(sampler, [{"agent": [("Process", "% Processor Time", 1)],
+                                "Microsoft.Test.Ext": [("Process", "% Processor Time", 2)]}])
+        self.assertEqual(2, len(sampler.get_summaries()))
+
+        # the extension is no longer tracked
+        self._sample(sampler, [{"agent": [("Process", "% Processor Time", 1)]}])
+        summaries = sampler.get_summaries()
+        self.assertEqual(["agent"], [cgroup_name for cgroup_name, _, _, _ in summaries])
+        self.assertEqual(1, len(sampler._buffers))
+
+        self.assertEqual([], sampler.get_summaries())
+        self.assertEqual(0, len(sampler._buffers))
+
+    def test_report(self):
+        sampler = CGroupsSampler(1, capacity=10)
+        self._sample(sampler, [{"agent": [("Process", "% Processor Time", 0), ("Memory", "Total Memory Usage", 8)]}])
+        report_metric = Mock()
+
+        sampler.report(report_metric)
+        # metrics that were always 0 are not reported
+        self.assertEqual(len(SUMMARY_STATISTICS) + 1, report_metric.call_count)
+        report_metric.assert_any_call("Memory", "Total Memory Usage P95", "agent", 8)
+        report_metric.assert_any_call("Memory", "Total Memory Usage Count", "agent", 1)
+
+    def test_start_and_stop(self):
+        sampler = CGroupsSampler(60)
+        with patch("azurelinuxagent.common.cgroupsampler.CGroupsTelemetry.collect_all_tracked",
+                   return_value={"agent": [("Process", "% Processor Time", 1)]}) as mock_collect:
+            sampler.start()
+            self.assertTrue(sampler.is_alive())
+            sampler.stop()
+            self.assertFalse(sampler.is_alive())
+        # the first sample is taken as soon as the thread starts
+        self.assertEqual(1, mock_collect.call_count)
@@ -236,3 +236,21 @@ class TestEvent(AgentTestCase):
                 break
         else:
             self.fail("Counter '%idle' not found in event parameters: {0}".format(repr(event_dictionary)))
+
+    def test_save_event_evicts_noisiest_source(self):
+        event.get_and_reset_evicted_events()
+        extension_event = '{{"eventId": 1, "providerId": "{0}", "parameters": ' \
+                          '[{{"name": "Name", "value": "Noisy.Extension"}}]}}'
+        for i in range(0, 999):
+            evt = os.path.join(self.tmp_dir, '{0}.tld'.format(ustr(1491004920536531 + i)))
+            with open(evt, 'w') as fh:
+                fh.write(extension_event.format("69B669B9-4AF8-4C50-BDC4-6006FA76E975"))
+
+        add_event('WALinuxAgent', message='first agent event')
+        add_event('WALinuxAgent', message='second agent event')
+
+        events = [fileutil.read_file(os.path.join(self.tmp_dir, e)) for e in os.listdir(self.tmp_dir)]
+        self.assertEqual(1000, len(events))
+        self.assertEqual(1, len([e for e in events if 'first agent event' in e]))
+        self.assertEqual(1, len([e for e in events if 'second agent event' in e]))
+        self.assertEqual({"Noisy.Extension": 1}, event.get_and_reset_evicted_events())
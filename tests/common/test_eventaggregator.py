@@ -0,0 +1,151 @@
+# Copyright 2016 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+from datetime import datetime, timedelta
+
+from azurelinuxagent.common.eventaggregator import EventAggregator, normalize_message
+from azurelinuxagent.common.protocol.restapi import TelemetryEvent, TelemetryEventParam
+
+from tests.tools import *
+
+_START = datetime(2018, 1, 1, 0, 0, 0)
+
+
+def _create_event(op="HeartBeat", is_success=True, message="", duration=0, provider="P1"):
+    event = TelemetryEvent(6, provider)
+    event.parameters.append(TelemetryEventParam('Name', 'WALinuxAgent'))
+    event.parameters.append(TelemetryEventParam('Version', '2.2.31'))
+    event.parameters.append(TelemetryEventParam('Operation', op))
+    event.parameters.append(TelemetryEventParam('OperationSuccess', is_success))
+    event.parameters.append(TelemetryEventParam('Message', message))
+    event.parameters.append(TelemetryEventParam('Duration', duration))
+    return event
+
+
+def _create_metric(value, instance="0"):
+    event = TelemetryEvent(4, "P1")
+    event.parameters.append(TelemetryEventParam('Category', 'cpu'))
+    event.parameters.append(TelemetryEventParam('Counter', '% Processor Time'))
+    event.parameters.append(TelemetryEventParam('Instance', instance))
+    event.parameters.append(TelemetryEventParam('Value', value))
+    event.parameters.append(TelemetryEventParam('VMName', 'vm'))
+    return event
+
+
+def _get_param(event, name):
+    for param in event.parameters:
+        if param.name == name:
+            return param.value
+    return None
+
+
+class TestEventAggregator(AgentTestCase):
+    def test_normalize_message(self):
+        self.assertEqual(normalize_message("12;3;C0B5E8C3-1F5C-4E4A-9E17-4D6A8E2E8D11;0"),
+                         normalize_message("13;4;A1B5E8C3-1F5C-4E4A-9E17-4D6A8E2E8D22;7"))
+        self.assertNotEqual(normalize_message("hostplugin:1"),
+                            normalize_message("protocol:1"))
+
+    def test_aggregates_similar_events(self):
+        aggregator = EventAggregator(window=timedelta(minutes=5))
+        for i in range(10):
+            aggregator.add(_create_event(message="counter {0}".format(i), duration=i * 10),
+                           _START + timedelta(seconds=i))
+
+        self.assertEqual([], aggregator.flush(now=_START + timedelta(minutes=1)))
+
+        events = aggregator.flush(now=_START + timedelta(minutes=5))
+        self.assertEqual(1, len(events))
+        message = _get_param(events[0], 'Message')
+        self.assertIn("Aggregated 10 events", message)
+        self.assertIn(_START.isoformat(), message)
+        self.assertIn((_START + timedelta(seconds=9)).isoformat(), message)
+        self.assertIn("0/45/90", message)
+        self.assertEqual(45, _get_param(events[0], 'Duration'))
+        self.assertEqual(10, aggregator.received)
+        self.assertEqual(1, aggregator.emitted)
+        self.assertEqual(0, aggregator.pending)
+
+    def test_single_event_is_not_modified(self):
+        aggregator = EventAggregator()
+        aggregator.add(_create_event(message="only one", duration=5), _START)
+
+        events = aggregator.flush(force=True)
+        self.assertEqual(1, len(events))
+        self.assertEqual("only one", _get_param(events[0], 'Message'))
+        self.assertEqual(5, _get_param(events[0], 'Duration'))
+
+    def test_failures_keep_full_fidelity(self):
+        aggregator = EventAggregator()
+        for i in range(3):
+            aggregator.add(_create_event(is_success=False, message="failure {0}".format(i)), _START)
+
+        events = aggregator.flush(now=_START)
+        self.assertEqual(["failure 0", "failure 1", "failure 2"],
+                         [_get_param(e, 'Message') for e in events])
+
+    def test_groups_by_provider_and_operation(self):
+        aggregator = EventAggregator()
+        aggregator.add(_create_event(op="HeartBeat"), _START)
+        aggregator.add(_create_event(op="HttpErrors"), _START)
+        aggregator.add(_create_event(op="HeartBeat", provider="P2"), _START)
+        aggregator.add(_create_event(op="HeartBeat"), _START)
+
+        self.assertEqual(3, len(aggregator.flush(force=True)))
+
+    def test_other_schemas_pass_through(self):
+        aggregator = EventAggregator()
+        log = TelemetryEvent(7, "P1")
+        log.parameters.append(TelemetryEventParam('EventName', 'Log'))
+        log.parameters.append(TelemetryEventParam('Context1', 'message'))
+        self.assertFalse(aggregator.add(log, _START))
+        self.assertFalse(aggregator.add(log, _START))
+
+        self.assertEqual(2, len(aggregator.flush(now=_START)))
+
+    def test_aggregates_metrics(self):
+        aggregator = EventAggregator(window=timedelta(minutes=5))
+        for value in (10, 20, 60):
+            self.assertTrue(aggregator.add(_create_metric(value), _START))
+        aggregator.add(_create_metric(5, instance="other"), _START)
+
+        events = aggregator.flush(now=_START + timedelta(minutes=5))
+        self.assertEqual([("cpu", "% Processor Time", "0", 30.0),
+                          ("cpu", "% Processor Time Min", "0", 10),
+                          ("cpu", "% Processor Time Max", "0", 60),
+                          ("cpu", "% Processor Time Count", "0", 3),
+                          ("cpu", "% Processor Time", "other", 5)],
+                         [tuple(_get_param(e, name) for name in ("Category", "Counter", "Instance", "Value"))
+                          for e in events])
+        self.assertTrue(all(_get_param(e, "VMName") == "vm" for e in events))
+
+    def test_sources_are_released_when_their_group_is_flushed(self):
+        aggregator = EventAggregator(window=timedelta(minutes=5))
+        aggregator.add(_create_event(), _START, source="1.tld")
+        aggregator.add(_create_metric(1), _START + timedelta(minutes=1), source="2.tld")
+        aggregator.add(_create_event(is_success=False), _START, source="3.tld")
+        self.assertTrue(aggregator.is_held("1.tld"))
+        self.assertFalse(aggregator.is_held("3.tld"))
+
+        aggregator.flush(now=_START + timedelta(minutes=5))
+        self.assertEqual(["1.tld"], aggregator.pop_released_sources())
+        self.assertEqual([], aggregator.pop_released_sources())
+        self.assertFalse(aggregator.is_held("1.tld"))
+        self.assertTrue(aggregator.is_held("2.tld"))
+
+        aggregator.flush(force=True)
+        self.assertEqual(["2.tld"], aggregator.pop_released_sources())
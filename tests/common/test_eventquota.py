@@ -0,0 +1,95 @@
+# Copyright 2016 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import json
+
+from azurelinuxagent.common.eventquota import AGENT_PROVIDER_ID, AGENT_SOURCE, EventScheduler, TokenBucket, \
+    get_event_source, get_event_source_from_data, select_events_to_evict
+from azurelinuxagent.common.protocol.restapi import TelemetryEvent, TelemetryEventParam, get_properties
+
+from tests.tools import *
+
+
+def _create_event(name, event_id=6, provider_id=AGENT_PROVIDER_ID):
+    event = TelemetryEvent(event_id, provider_id)
+    event.parameters.append(TelemetryEventParam('Name', name))
+    event.parameters.append(TelemetryEventParam('Operation', 'Op'))
+    return event
+
+
+class TestEventQuota(AgentTestCase):
+    def test_get_event_source(self):
+        self.assertEqual(AGENT_SOURCE, get_event_source(_create_event("Foo.Bar")))
+        self.assertEqual("Foo.Bar", get_event_source(_create_event("Foo.Bar", event_id=1)))
+        self.assertEqual("ABC", get_event_source(TelemetryEvent(1, "abc")))
+
+    def test_get_event_source_from_data(self):
+        data = json.dumps(get_properties(_create_event("Foo.Bar", event_id=1)))
+        self.assertEqual("Foo.Bar", get_event_source_from_data(data))
+        self.assertEqual("CustomScript", get_event_source_from_data(load_data("ext/event.xml")))
+        self.assertEqual(AGENT_SOURCE, get_event_source_from_data(json.dumps(get_properties(_create_event("x")))))
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertTrue(bucket.consume(now=0))
+        self.assertTrue(bucket.consume(now=0))
+        self.assertFalse(bucket.consume(now=0))
+        self.assertTrue(bucket.consume(now=1))
+        self.assertFalse(bucket.consume(now=1))
+
+    def test_scheduler_throttles_noisy_source(self):
+        scheduler = EventScheduler(rate=0, burst=10)
+        for _ in range(100):
+            scheduler.add(_create_event("Noisy.Extension", event_id=1), now=0)
+        for _ in range(5):
+            scheduler.add(_create_event("WALinuxAgent"), now=0)
+
+        self.assertEqual(15, scheduler.pending)
+        counts = scheduler.get_and_reset_counts()
+        self.assertEqual((90, 0), counts["Noisy.Extension"])
+        self.assertFalse(AGENT_SOURCE in counts)
+        self.assertEqual({}, scheduler.get_and_reset_counts())
+
+    def test_scheduler_drops_when_queue_is_full(self):
+        scheduler = EventScheduler(burst=100, max_queued=3)
+        for _ in range(5):
+            scheduler.add(_create_event("Foo", event_id=1), now=0)
+        self.assertEqual((0, 2), scheduler.get_and_reset_counts()["Foo"])
+
+    def test_scheduler_shares_batches_by_weight(self):
+        scheduler = EventScheduler(burst=100, batch_size=10)
+        for _ in range(20):
+            scheduler.add(_create_event("A", event_id=1), now=0)
+            scheduler.add(_create_event("B", event_id=1), now=0)
+            scheduler.add(_create_event("WALinuxAgent"), now=0)
+
+        batch = scheduler.next_batch()
+        self.assertEqual(10, len(batch))
+        sources = [get_event_source(e) for e in batch]
+        self.assertEqual(6, sources.count(AGENT_SOURCE))
+        self.assertEqual(2, sources.count("A"))
+        self.assertEqual(2, sources.count("B"))
+        self.assertEqual(50, scheduler.pending)
+
+    def test_select_events_to_evict(self):
+        events = {
+            AGENT_SOURCE: ["1", "4"],
+            "Noisy": ["2", "3", "5", "6", "7"],
+            "Quiet": ["8"]
+        }
+        evicted = select_events_to_evict(events, 4)
+        self.assertEqual([("Noisy", "2"), ("Noisy", "3"), ("Noisy", "5"), ("Noisy", "6")], evicted)
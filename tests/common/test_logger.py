@@ -102,3 +102,236 @@ class TestLogger(AgentTestCase):
 
             elif x['name'] == 'Context3':
                 self.assertEqual(x['value'], '')
+
+    @patch('azurelinuxagent.common.logger.datetime')
+    def test_log_skips_formatting_below_appender_level(self, mock_datetime):
+        log = logger.Logger()
+        appender = MagicMock()
+        appender.level = logger.LogLevel.INFO
+        log.appenders.append(appender)
+
+        log.verbose(_MSG, *_DATA)
+        self.assertEqual(0, mock_datetime.now.call_count)
+        self.assertEqual(0, appender.write.call_count)
+
+        log.info(_MSG, *_DATA)
+        self.assertEqual(1, mock_datetime.now.call_count)
+        self.assertEqual(1, appender.write.call_count)
+
+    def test_log_uses_parent_appender_levels(self):
+        parent = logger.Logger()
+        appender = MagicMock()
+        appender.level = logger.LogLevel.VERBOSE
+        parent.appenders.append(appender)
+
+        child = logger.Logger(parent, "[child]")
+        child.verbose(_MSG, *_DATA)
+        self.assertEqual(1, appender.write.call_count)
+
+    def test_async_file_appender_writes_batches(self):
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file)
+        try:
+            for i in range(100):
+                appender.write(logger.LogLevel.INFO, "line {0}\n".format(i))
+            appender.write(logger.LogLevel.VERBOSE, "filtered\n")
+            appender.flush()
+
+            lines = fileutil.read_file(log_file).splitlines()
+            self.assertEqual(["line {0}".format(i) for i in range(100)], lines)
+        finally:
+            appender.close()
+
+    def test_async_file_appender_reopens_rotated_file(self):
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file)
+        try:
+            appender.write(logger.LogLevel.INFO, "before\n")
+            appender.flush()
+            os.rename(log_file, log_file + ".1")
+
+            appender.write(logger.LogLevel.INFO, "after\n")
+            appender.flush()
+
+            self.assertEqual("before\n", fileutil.read_file(log_file + ".1"))
+            self.assertEqual("after\n", fileutil.read_file(log_file))
+        finally:
+            appender.close()
+
+    def test_async_file_appender_drops_on_overflow(self):
+        import threading
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        writing = threading.Event()
+        release = threading.Event()
+
+        def stalled_write(data):
+            writing.set()
+            release.wait()
+
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file, max_queue_size=1)
+        appender._write_batch = stalled_write
+        try:
+            appender.write(logger.LogLevel.INFO, "in flight\n")
+            self.assertTrue(writing.wait(5))
+            appender.write(logger.LogLevel.INFO, "queued\n")
+            appender.write(logger.LogLevel.INFO, "dropped\n")
+            self.assertEqual(1, appender.dropped)
+        finally:
+            release.set()
+            appender.close()
+
+    def test_async_file_appender_close_flushes(self):
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file)
+        for i in range(10):
+            appender.write(logger.LogLevel.INFO, "line {0}\n".format(i))
+        appender.close()
+
+        self.assertEqual(10, len(fileutil.read_file(log_file).splitlines()))
+        appender.write(logger.LogLevel.INFO, "ignored\n")
+        self.assertEqual(10, len(fileutil.read_file(log_file).splitlines()))
+
+
+    def test_async_file_appender_survives_write_errors(self):
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file)
+        write_batch = appender._write_batch
+        appender._write_batch = Mock(side_effect=RuntimeError("write failed"))
+        try:
+            appender.write(logger.LogLevel.INFO, "lost\n")
+            self.assertTrue(appender.flush())
+            appender._write_batch = write_batch
+            appender.write(logger.LogLevel.INFO, "written\n")
+            self.assertTrue(appender.flush())
+
+            self.assertEqual(1, appender.errors)
+            self.assertEqual("written\n", fileutil.read_file(log_file))
+        finally:
+            appender.close()
+
+    def test_async_file_appender_does_not_wait_for_a_stalled_writer(self):
+        import threading
+        log_file = os.path.join(self.tmp_dir, "async.log")
+        writing = threading.Event()
+        release = threading.Event()
+
+        def stalled_write(data):
+            writing.set()
+            release.wait()
+
+        appender = logger.AsyncFileAppender(logger.LogLevel.INFO, log_file, max_queue_size=1,
+                                            overflow_policy=logger.OverflowPolicy.BLOCK)
+        appender._write_batch = stalled_write
+        try:
+            appender.write(logger.LogLevel.INFO, "in flight\n")
+            self.assertTrue(writing.wait(5))
+            appender.write(logger.LogLevel.INFO, "queued\n")
+
+            self.assertFalse(appender.flush(timeout=0.1))
+            with patch("azurelinuxagent.common.logger.WRITER_TIMEOUT", 0.1):
+                appender.write(logger.LogLevel.INFO, "dropped\n")
+            self.assertEqual(1, appender.dropped)
+
+            start = time.time()
+            appender.close(timeout=0.1)
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            release.set()
+
+
+class TestLogRotator(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.log_file = os.path.join(self.tmp_dir, "waagent.log")
+        self.ext_dir = os.path.join(self.tmp_dir, "azure", "Foo.Bar")
+        fileutil.mkdir(self.ext_dir)
+        self.ext_log = os.path.join(self.ext_dir, "extension.log")
+
+    def _segments(self, path):
+        return logger.LogRotator._get_segments(path)
+
+    def test_rotate_by_size_compresses_segment(self):
+        fileutil.write_file(self.log_file, "x" * 100)
+        rotator = logger.LogRotator(50, 3600, 1024 * 1024)
+        rotator.add_file(self.log_file)
+        rotator.rotate()
+
+        self.assertFalse(os.path.exists(self.log_file))
+        segments = self._segments(self.log_file)
+        self.assertEqual(1, len(segments))
+        self.assertTrue(segments[0].endswith(".gz"))
+
+        import gzip
+        with gzip.open(segments[0], "rb") as f:
+            self.assertEqual(b"x" * 100, f.read())
+
+    def test_rotate_skips_small_files(self):
+        fileutil.write_file(self.log_file, "x" * 10)
+        rotator = logger.LogRotator(50, 3600, 1024 * 1024)
+        rotator.add_file(self.log_file)
+        rotator.rotate()
+
+        self.assertTrue(os.path.exists(self.log_file))
+        self.assertEqual(0, len(self._segments(self.log_file)))
+
+    def test_rotate_by_age(self):
+        fileutil.write_file(self.log_file, "x" * 10)
+        rotator = logger.LogRotator(50, 3600, 1024 * 1024)
+        rotator.add_file(self.log_file)
+        rotator.rotate()
+        self.assertEqual(0, len(self._segments(self.log_file)))
+
+        rotator._last_rotation[self.log_file] -= 3601
+        rotator.rotate()
+        self.assertEqual(1, len(self._segments(self.log_file)))
+
+    def test_rotate_directory_uses_copy_truncate(self):
+        fileutil.write_file(self.ext_log, "y" * 100)
+        rotator = logger.LogRotator(50, 3600, 1024 * 1024)
+        rotator.add_directory(os.path.join(self.tmp_dir, "azure"))
+
+        with open(self.ext_log, "a") as held_open:
+            rotator.rotate()
+            held_open.write("after")
+
+        self.assertEqual(1, len(self._segments(self.ext_log)))
+        self.assertTrue(fileutil.read_file(self.ext_log).endswith("after"))
+
+    def test_rotate_enforces_total_size(self):
+        rotator = logger.LogRotator(50, 3600, 1)
+        rotator.add_file(self.log_file)
+        for i in range(3):
+            fileutil.write_file(self.log_file, "z" * 100)
+            rotator.rotate()
+
+        self.assertEqual(0, len(self._segments(self.log_file)))
+
+    def test_compression_is_deferred(self):
+        fileutil.write_file(self.log_file, "x" * 100)
+        can_compress = Mock(return_value=False)
+        rotator = logger.LogRotator(50, 3600, 1024 * 1024, can_compress=can_compress)
+        rotator.add_file(self.log_file)
+        rotator.rotate()
+
+        segments = self._segments(self.log_file)
+        self.assertEqual(1, len(segments))
+        self.assertFalse(segments[0].endswith(".gz"))
+
+        can_compress.return_value = True
+        fileutil.write_file(self.log_file, "x")
+        rotator.rotate()
+        self.assertTrue(self._segments(self.log_file)[0].endswith(".gz"))
+
+    def test_segments_of_logrotate_are_ignored(self):
+        for name in ("waagent.log.1", "waagent.log.1.gz", "waagent.log.20180101000000.tmp", "waagent.log.bak"):
+            fileutil.write_file(os.path.join(self.tmp_dir, name), "x")
+        fileutil.write_file(os.path.join(self.tmp_dir, "waagent.log.20180101000000-1.gz"), "x")
+
+        self.assertEqual([os.path.join(self.tmp_dir, "waagent.log.20180101000000-1.gz")],
+                         self._segments(self.log_file))
+
+    @patch("azurelinuxagent.common.logger.os")
+    def test_priority_is_lowered_with_nice_if_setpriority_is_missing(self, mock_os):
+        del mock_os.setpriority
+        logger._lower_thread_priority()
+        mock_os.nice.assert_called_once_with(19)
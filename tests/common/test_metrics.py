@@ -0,0 +1,159 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import threading
+
+import azurelinuxagent.common.metrics as metrics
+from azurelinuxagent.common.metrics import MetricsRegistry, HistogramValue, OVERFLOW_INSTANCE, format_text
+from tests.tools import *
+
+
+class TestMetricsRegistry(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.registry = MetricsRegistry()
+        self.reported = []
+
+    def report(self, category, counter, instance, value):
+        self.reported.append((category, counter, instance, value))
+
+    def test_metrics_are_registered_once(self):
+        counter = self.registry.counter("http", "Requests")
+        self.assertTrue(counter is self.registry.counter("http", "Requests"))
+        self.assertRaises(ValueError, self.registry.gauge, "http", "Requests")
+
+    def test_counter_is_thread_safe(self):
+        counter = self.registry.counter("http", "Requests")
+
+        def increment():
+            for _ in range(1000):
+                counter.inc("wireserver")
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(4000, counter.value("wireserver"))
+
+    def test_instances_are_bounded(self):
+        counter = self.registry.counter("http", "Requests")
+        with patch("azurelinuxagent.common.metrics.MAX_INSTANCES", 2):
+            for instance in ("a", "b", "c", "d"):
+                counter.inc(instance)
+
+        self.assertEqual({"a": 1, "b": 1, OVERFLOW_INSTANCE: 2}, counter.values())
+
+    def test_flush_reports_the_changes_since_the_previous_flush(self):
+        counter = self.registry.counter("http", "Requests")
+        gauge = self.registry.gauge("events", "Queue Depth")
+        counter.inc("wireserver", 3)
+        gauge.set(5)
+
+        self.registry.flush(self.report)
+        self.assertEqual([("events", "Queue Depth", "", 5), ("http", "Requests", "wireserver", 3)], self.reported)
+
+        # unchanged values are not reported
+        self.reported = []
+        counter.inc("wireserver", 2)
+        self.registry.flush(self.report)
+        self.assertEqual([("http", "Requests", "wireserver", 2)], self.reported)
+
+        # the values stay cumulative
+        self.assertEqual(5, counter.value("wireserver"))
+
+    def test_flush_summarizes_the_histograms(self):
+        histogram = self.registry.histogram("http", "Total Time", bounds=(10, 100, 1000))
+        for value in (5, 5, 50, 500, 5000):
+            histogram.observe(value)
+
+        self.registry.flush(self.report)
+        self.assertEqual([("http", "Total Time Count", "", 5),
+                          ("http", "Total Time Mean", "", 1112.0),
+                          ("http", "Total Time P50", "", 100),
+                          ("http", "Total Time P90", "", 5000),
+                          ("http", "Total Time P99", "", 5000),
+                          ("http", "Total Time Max", "", 5000)], self.reported)
+
+        # the summary covers the observations since the previous flush
+        self.reported = []
+        histogram.observe(20)
+        self.registry.flush(self.report)
+        self.assertEqual([("http", "Total Time Count", "", 1),
+                          ("http", "Total Time Mean", "", 20.0),
+                          ("http", "Total Time P50", "", 100),
+                          ("http", "Total Time P90", "", 100),
+                          ("http", "Total Time P99", "", 100),
+                          ("http", "Total Time Max", "", 20)], self.reported)
+
+        self.reported = []
+        self.registry.flush(self.report)
+        self.assertEqual([], self.reported)
+
+    def test_reset_keeps_the_metrics_registered(self):
+        counter = self.registry.counter("http", "Requests")
+        counter.inc()
+        self.registry.reset()
+
+        self.assertEqual(0, counter.value())
+        counter.inc()
+        self.registry.flush(self.report)
+        self.assertEqual([("http", "Requests", "", 1)], self.reported)
+
+    def test_registry_is_shared(self):
+        self.assertTrue(isinstance(metrics.registry, MetricsRegistry))
+
+    def test_format_text(self):
+        self.registry.counter("http", "Requests").inc('wire"server', 2)
+        self.registry.gauge("events", "Queue Depth").set(3)
+        self.registry.histogram("http", "Total Time", bounds=(10, 100)).observe(10, "imds")
+
+        self.assertEqual('# TYPE waagent_events_queue_depth gauge\n'
+                         'waagent_events_queue_depth{instance=""} 3\n'
+                         '# TYPE waagent_http_requests counter\n'
+                         'waagent_http_requests{instance="wire\\"server"} 2\n'
+                         '# TYPE waagent_http_total_time histogram\n'
+                         'waagent_http_total_time_bucket{instance="imds",le="10"} 1\n'
+                         'waagent_http_total_time_bucket{instance="imds",le="100"} 1\n'
+                         'waagent_http_total_time_bucket{instance="imds",le="+Inf"} 1\n'
+                         'waagent_http_total_time_sum{instance="imds"} 10\n'
+                         'waagent_http_total_time_count{instance="imds"} 1\n',
+                         format_text(self.registry.snapshot()))
+
+    def test_dump_writes_the_registry(self):
+        metrics.registry.counter("test", "Dumps").inc()
+        path = os.path.join(self.tmp_dir, metrics.METRICS_DUMP_FILE_NAME)
+
+        metrics.dump(path)
+
+        with open(path) as dump_file:
+            self.assertTrue('waagent_test_dumps{instance=""}' in dump_file.read())
+
+
+class TestHistogramValue(AgentTestCase):
+    def test_observations_are_bucketed_by_upper_bound(self):
+        value = HistogramValue((10, 100))
+        for observation in (1, 10, 11, 100, 101):
+            value.observe(observation)
+
+        self.assertEqual([2, 2, 1], value.buckets)
+        self.assertEqual(223, value.sum)
+        self.assertEqual(101, value.max)
+
+    def test_percentile_of_empty_histogram(self):
+        self.assertEqual(0, HistogramValue((10, 100)).percentile(50))
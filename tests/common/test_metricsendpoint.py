@@ -0,0 +1,81 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import socket
+import stat
+
+from azurelinuxagent.common.metrics import MetricsRegistry
+from azurelinuxagent.common.metricsendpoint import MetricsEndpoint, query_metrics, get_metrics_socket_path
+from tests.tools import *
+
+
+class TestMetricsEndpoint(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.path = os.path.join(self.tmp_dir, "metrics.sock")
+        self.registry = MetricsRegistry()
+        self.registry.counter("http", "Requests").inc("wireserver", 3)
+        self.endpoint = MetricsEndpoint(self.path, metrics_registry=self.registry)
+
+    def tearDown(self):
+        self.endpoint.stop()
+        AgentTestCase.tearDown(self)
+
+    def test_endpoint_serves_the_snapshot(self):
+        self.endpoint.start()
+
+        text = query_metrics(self.path)
+        self.assertTrue('waagent_http_requests{instance="wireserver"} 3\n' in text)
+
+        # each client gets the current snapshot
+        self.registry.counter("http", "Requests").inc("wireserver")
+        self.assertTrue('waagent_http_requests{instance="wireserver"} 4\n' in query_metrics(self.path))
+
+    def test_socket_is_readable_only_by_its_owner(self):
+        self.endpoint.start()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_endpoint_replaces_a_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+
+        self.endpoint.start()
+        self.assertTrue(self.endpoint.is_alive())
+        self.assertTrue("waagent_http_requests" in query_metrics(self.path))
+
+    def test_endpoint_does_not_wait_for_the_requests_of_the_clients(self):
+        self.endpoint.start()
+
+        # a client that sends nothing, and does not read its snapshot, does not hold the endpoint
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(self.path)
+        try:
+            self.assertTrue("waagent_http_requests" in query_metrics(self.path))
+        finally:
+            idle.close()
+
+    def test_stop_removes_the_socket(self):
+        self.endpoint.start()
+        self.endpoint.stop()
+
+        self.assertFalse(self.endpoint.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(socket.error, query_metrics, self.path)
+
+    def test_socket_is_in_the_lib_dir(self):
+        self.assertEqual(os.path.join(conf.get_lib_dir(), "metrics.sock"), get_metrics_socket_path())
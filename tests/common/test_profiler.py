@@ -0,0 +1,147 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import glob
+import signal
+import sys
+import threading
+
+from azurelinuxagent.common.profiler import SamplingProfiler, collapse_stack, install_profiler, \
+    get_profiled_pids, TRUNCATED_STACK
+from tests.tools import *
+
+
+def _wait_in_profiled_function(event):
+    event.wait(10)
+
+
+class TestSamplingProfiler(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=_wait_in_profiled_function, args=(self.event,), name="Profiled")
+        self.thread.start()
+
+    def tearDown(self):
+        self.event.set()
+        self.thread.join()
+        AgentTestCase.tearDown(self)
+
+    def _read_profile(self, path):
+        with open(path) as profile:
+            return dict((line.rsplit(" ", 1)[0], int(line.rsplit(" ", 1)[1])) for line in profile.read().splitlines())
+
+    def test_collapse_stack_starts_with_the_thread(self):
+        stack = collapse_stack("Main Thread", sys._getframe())
+        self.assertTrue(stack.startswith("Main_Thread;"))
+        self.assertTrue(stack.endswith(";test_profiler.test_collapse_stack_starts_with_the_thread"))
+
+    def test_collapse_stack_is_bounded(self):
+        self.assertEqual(3, len(collapse_stack("thread", sys._getframe(), max_depth=2).split(";")))
+
+    def test_profile_counts_the_samples_of_each_stack(self):
+        profiler = SamplingProfiler("test", self.tmp_dir)
+        for _ in range(3):
+            profiler.sample()
+        profiler._thread = Mock(is_alive=Mock(return_value=True))
+
+        path = profiler.stop()
+
+        self.assertEqual(os.path.join(self.tmp_dir, "profile.test.{0}.".format(os.getpid())),
+                         path[:-len("YYYYmmddHHMMSS.collapsed")])
+        stacks = self._read_profile(path)
+        profiled = [stack for stack in stacks if stack.startswith("Profiled;")]
+        self.assertEqual(1, len(profiled))
+        self.assertTrue(";test_profiler._wait_in_profiled_function;threading.wait" in profiled[0])
+        self.assertEqual(3, stacks[profiled[0]])
+
+    def test_number_of_stacks_is_bounded(self):
+        other = threading.Thread(target=lambda: self.event.wait(10), name="Other")
+        other.start()
+        try:
+            profiler = SamplingProfiler("test", self.tmp_dir, max_stacks=1)
+            profiler.sample()
+            profiler.sample()
+        finally:
+            self.event.set()
+            other.join()
+
+        self.assertEqual(2, len(profiler._stacks))
+        self.assertTrue(TRUNCATED_STACK in profiler._stacks)
+
+    def test_toggle_starts_and_stops_the_profiler(self):
+        profiler = SamplingProfiler("test", self.tmp_dir, interval=0.001)
+
+        self.assertEqual(None, profiler.toggle())
+        self.assertTrue(profiler.is_running())
+        while profiler.samples < 5:
+            time.sleep(0.01)
+        path = profiler.toggle()
+
+        self.assertFalse(profiler.is_running())
+        self.assertTrue(os.path.exists(path))
+
+    def test_profiler_stops_after_the_max_duration(self):
+        profiler = SamplingProfiler("test", self.tmp_dir, interval=0.001, max_duration=0.05)
+        profiler.start()
+        profiler._thread.join(5)
+
+        self.assertFalse(profiler.is_running())
+        self.assertEqual(1, len(glob.glob(os.path.join(self.tmp_dir, "profile.test.*.collapsed"))))
+
+    def test_old_profiles_are_removed(self):
+        for i in range(3):
+            fileutil.write_file(os.path.join(self.tmp_dir, "profile.test.1.{0}.collapsed".format(i)), "a 1\n")
+            os.utime(os.path.join(self.tmp_dir, "profile.test.1.{0}.collapsed".format(i)), (i, i))
+        profiler = SamplingProfiler("test", self.tmp_dir, max_profiles=2)
+        profiler.sample()
+
+        path = profiler._write()
+
+        profiles = glob.glob(os.path.join(self.tmp_dir, "profile.*.collapsed"))
+        self.assertEqual(sorted([path, os.path.join(self.tmp_dir, "profile.test.1.2.collapsed")]), sorted(profiles))
+
+    @patch("azurelinuxagent.common.profiler.signal.siginterrupt")
+    @patch("azurelinuxagent.common.profiler.signal.signal")
+    @patch("azurelinuxagent.common.conf.get_lib_dir")
+    def test_install_profiler_toggles_the_profiler_on_sigusr2(self, mock_lib_dir, mock_signal, mock_siginterrupt):
+        mock_lib_dir.return_value = self.tmp_dir
+        profiler = install_profiler("test")
+
+        signum, handler = mock_signal.call_args[0]
+        self.assertEqual(signal.SIGUSR2, signum)
+        mock_siginterrupt.assert_called_once_with(signal.SIGUSR2, False)
+        with patch.object(profiler, "toggle") as mock_toggle:
+            handler(signum, None)
+            for _ in range(100):
+                if mock_toggle.call_count > 0:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(1, mock_toggle.call_count)
+
+    @patch("azurelinuxagent.common.profiler.signal.siginterrupt")
+    @patch("azurelinuxagent.common.profiler.signal.signal")
+    @patch("azurelinuxagent.common.conf.get_lib_dir")
+    def test_get_profiled_pids_checks_the_command_line_of_the_processes(self, mock_lib_dir, *_):
+        mock_lib_dir.return_value = self.tmp_dir
+        install_profiler("run-exthandlers")
+        install_profiler("daemon")
+
+        cmdline = "python\0/usr/sbin/waagent\0-run-exthandlers\0"
+        with patch("azurelinuxagent.common.profiler.fileutil.read_file",
+                   side_effect=lambda path: cmdline if path.startswith("/proc/") else str(os.getpid())):
+            self.assertEqual([("run-exthandlers", os.getpid())], get_profiled_pids())
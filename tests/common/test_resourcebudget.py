@@ -0,0 +1,115 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+from azurelinuxagent.common.cgroups import LOAD_HIGH
+from azurelinuxagent.common.resourcebudget import ResourceBudget, TaskPriority, get_process_io
+from tests.tools import *
+
+
+class TestResourceBudget(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.now = 1000.0
+        self.cpu_time = 10.0
+        self.io = (0, 0)
+        self.system_load = Mock()
+        self.system_load.sample.return_value = (None, None)
+        self.patches = [
+            patch("azurelinuxagent.common.resourcebudget.time.time", side_effect=lambda: self.now),
+            patch("azurelinuxagent.common.resourcebudget.get_process_cpu_time", side_effect=lambda: self.cpu_time),
+            patch("azurelinuxagent.common.resourcebudget.get_process_io", side_effect=lambda: self.io),
+        ]
+        for p in self.patches:
+            p.start()
+        # 10% of a core, 1 MB/s
+        self.budget = ResourceBudget(10, 1024 * 1024, sample_interval=10, max_deferral=60,
+                                     system_load=self.system_load)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        AgentTestCase.tearDown(self)
+
+    def _use(self, cpu_time=0.0, io=0, elapsed=10):
+        self.now += elapsed
+        self.cpu_time += cpu_time
+        self.io = (self.io[0] + io, self.io[1])
+
+    def test_critical_work_is_never_deferred(self):
+        self._use(cpu_time=10)
+        self.system_load.sample.return_value = (LOAD_HIGH, LOAD_HIGH)
+        self.assertTrue(self.budget.should_run("goal state", TaskPriority.CRITICAL))
+
+    def test_low_priority_work_is_deferred_over_budget(self):
+        self.assertTrue(self.budget.should_run("archive", TaskPriority.LOW))
+
+        # 20% of a core
+        self._use(cpu_time=2)
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+        self.assertEqual(20.0, self.budget.cpu_percent)
+        # normal work is deferred only if the system is also under pressure
+        self.assertTrue(self.budget.should_run("telemetry", TaskPriority.NORMAL))
+
+        # the usage is updated once per sample interval
+        self._use(cpu_time=0, elapsed=5)
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+        self._use(cpu_time=0, elapsed=5)
+        self.assertTrue(self.budget.should_run("archive", TaskPriority.LOW))
+
+        self.assertEqual({"archive": 2}, self.budget.get_and_reset_deferrals())
+        self.assertEqual({}, self.budget.get_and_reset_deferrals())
+
+    def test_io_budget(self):
+        self._use(io=20 * 1024 * 1024)
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+        self.assertTrue(self.budget.over_budget)
+
+    def test_work_is_deferred_under_pressure(self):
+        self.system_load.sample.return_value = (None, LOAD_HIGH)
+        self._use()
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+        self.assertTrue(self.budget.should_run("telemetry", TaskPriority.NORMAL))
+
+        self._use(cpu_time=2)
+        self.assertFalse(self.budget.should_run("telemetry", TaskPriority.NORMAL))
+
+    def test_deferral_is_bounded(self):
+        self._use(cpu_time=2)
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+        for _ in range(5):
+            self._use(cpu_time=2)
+            self.budget.should_run("archive", TaskPriority.LOW)
+
+        # deferred for 60 seconds
+        self._use(cpu_time=2)
+        self.assertTrue(self.budget.should_run("archive", TaskPriority.LOW))
+        # and deferred again afterwards
+        self._use(cpu_time=2)
+        self.assertFalse(self.budget.should_run("archive", TaskPriority.LOW))
+
+
+class TestProcessUsage(AgentTestCase):
+    def test_get_process_io(self):
+        path = os.path.join(self.tmp_dir, "io")
+        with open(path, "w") as f:
+            f.write("rchar: 100\nwchar: 200\nsyscr: 1\nsyscw: 2\nread_bytes: 4096\nwrite_bytes: 8192\n"
+                    "cancelled_write_bytes: 0\n")
+        with patch("azurelinuxagent.common.resourcebudget.PROC_SELF_IO", path):
+            self.assertEqual((4096, 8192), get_process_io())
+
+        with patch("azurelinuxagent.common.resourcebudget.PROC_SELF_IO", os.path.join(self.tmp_dir, "missing")):
+            self.assertEqual((0, 0), get_process_io())
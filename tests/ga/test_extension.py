@@ -19,6 +19,7 @@ import os.path
 
 from tests.protocol.mockwiredata import *
 from azurelinuxagent.ga.exthandlers import *
+from azurelinuxagent.common.protocol.restapi import Extension
 from azurelinuxagent.common.protocol.wire import WireProtocol
 
 
@@ -218,6 +219,21 @@ class TestHandlerStateMigration(AgentTestCase):
         self.assertEquals(handler_status.message, message)
         return
 
+    def test_collect_ext_status_evicts_the_previous_status_files(self):
+        self._prepare_handler_config()
+        status_dir = self.ext_handler_i.get_status_dir()
+        os.makedirs(status_dir)
+        status = '[{"status": {"status": "success", "formattedMessage": {"lang": "en-US", "message": "ok"}}}]'
+        ext = Extension(name=self.ext_handler.name)
+        for seq_no in range(3):
+            fileutil.write_file(os.path.join(status_dir, "{0}.status".format(seq_no)), status)
+            ext.sequenceNumber = seq_no
+            self.assertEqual("success", self.ext_handler_i.collect_ext_status(ext).status)
+
+        for seq_no in range(2):
+            self.assertFalse(os.path.join(status_dir, "{0}.status".format(seq_no)) in HANDLER_FILE_CACHE._entries)
+        self.assertTrue(os.path.join(status_dir, "2.status") in HANDLER_FILE_CACHE._entries)
+
     def test_set_handler_status_ignores_none_content(self):
         """
         Validate that set_handler_status ignore cases where json.dumps
@@ -2,8 +2,11 @@
 # Licensed under the Apache License.
 import json
 
+import azurelinuxagent.common.utils.fileutil as fileutil
+
 from azurelinuxagent.common.protocol.restapi import ExtensionStatus, Extension, ExtHandler, ExtHandlerProperties
-from azurelinuxagent.ga.exthandlers import parse_ext_status, ExtHandlerInstance
+from azurelinuxagent.ga.exthandlers import parse_ext_status, ExtHandlerInstance, ExtHandlerState, \
+    HANDLER_FILE_CACHE, HANDLER_FILE_WATCHER
 from tests.tools import *
 
 
@@ -132,3 +135,69 @@ class TestExtHandlers(AgentTestCase):
         self.assert_extension_sequence_number(goal_state_sequence_number="-1",
                                               disk_sequence_number=3,
                                               expected_sequence_number=-1)
+
+    def _create_ext_handler_instance(self):
+        ext_handler_props = ExtHandlerProperties()
+        ext_handler_props.version = "1.2.3"
+        ext_handler = ExtHandler(name='foo')
+        ext_handler.properties = ext_handler_props
+
+        instance = ExtHandlerInstance(ext_handler=ext_handler, protocol=None)
+        instance.set_logger()
+        os.makedirs(instance.get_conf_dir())
+        return instance
+
+    def test_handler_files_are_read_once(self):
+        instance = self._create_ext_handler_instance()
+        instance.set_handler_state(ExtHandlerState.Enabled)
+        instance.set_handler_status(status="Ready")
+        instance.update_settings_file("3.settings", "{}")
+
+        HANDLER_FILE_CACHE.get_and_reset_counts()
+        with patch("azurelinuxagent.common.utils.fileutil.read_file", wraps=fileutil.read_file) as mock_read:
+            with patch("os.listdir", wraps=os.listdir) as mock_listdir:
+                for _ in range(3):
+                    instance = ExtHandlerInstance(instance.ext_handler, None)
+                    self.assertEqual(ExtHandlerState.Enabled, instance.get_handler_state())
+                    self.assertEqual("Ready", instance.get_handler_status().status)
+                    self.assertEqual(3, instance.get_largest_seq_no())
+                self.assertEqual(2, mock_read.call_count)
+                self.assertEqual(1, mock_listdir.call_count)
+        self.assertEqual((6, 4), HANDLER_FILE_CACHE.get_and_reset_counts())
+
+    @patch("azurelinuxagent.common.utils.filecache._get_file_key", return_value=(0, 0, 0))
+    def test_writes_invalidate_handler_files(self, *args):
+        # the key of the files does not change; rewrites within the mtime granularity may not change it either
+        instance = self._create_ext_handler_instance()
+        instance.set_handler_state(ExtHandlerState.Installed)
+        instance.set_handler_status(status="NotReady")
+        instance.update_settings_file("0.settings", "{}")
+        self.assertEqual(ExtHandlerState.Installed, instance.get_handler_state())
+        self.assertEqual("NotReady", instance.get_handler_status().status)
+        self.assertEqual(0, instance.get_largest_seq_no())
+
+        instance.set_handler_state(ExtHandlerState.Enabled)
+        instance.set_handler_status(status="Ready")
+        instance.update_settings_file("1.settings", "{}")
+        self.assertEqual(ExtHandlerState.Enabled, instance.get_handler_state())
+        self.assertEqual("Ready", instance.get_handler_status().status)
+        self.assertEqual(1, instance.get_largest_seq_no())
+
+    def test_handler_status_is_not_shared(self):
+        instance = self._create_ext_handler_instance()
+        instance.set_handler_status(status="Ready")
+
+        instance.get_handler_status().extensions.append("foo")
+        self.assertEqual(0, len(instance.get_handler_status().extensions))
+
+    @patch("azurelinuxagent.common.utils.filecache._get_file_key", return_value=(0, 0, 0))
+    def test_watched_handler_files_are_invalidated_by_the_watcher(self, *args):
+        instance = self._create_ext_handler_instance()
+        instance.set_handler_state(ExtHandlerState.Installed)
+        instance.watch_files()
+        self.assertEqual(ExtHandlerState.Installed, instance.get_handler_state())
+
+        # written by something other than the agent
+        fileutil.write_file(os.path.join(instance.get_conf_dir(), "HandlerState"), ExtHandlerState.Enabled)
+        HANDLER_FILE_WATCHER.process_events()
+        self.assertEqual(ExtHandlerState.Enabled, instance.get_handler_state())
@@ -17,6 +17,8 @@
 from datetime import timedelta
 
 from tests.tools import *
+from azurelinuxagent.common.event import EventLogger
+from azurelinuxagent.common.protocol.wire import GoalStateCache
 from azurelinuxagent.ga.monitor import *
 
 
@@ -120,6 +122,43 @@ class TestMonitor(AgentTestCase):
 
         monitor_handler.stop()
 
+    def test_collect_and_send_events(self, *args):
+        event_logger = EventLogger()
+        event_logger.event_dir = os.path.join(self.tmp_dir, "events")
+        for i in range(2):
+            event_logger._add_event(0, "", False, False, "message {0}".format(i), "Test", "Op", "1.0", 6)
+        monitor_handler = get_monitor_handler()
+        monitor_handler.protocol = Mock()
+
+        monitor_handler.collect_and_send_events()
+
+        self.assertEqual(1, monitor_handler.protocol.report_event.call_count)
+        event_list = monitor_handler.protocol.report_event.call_args[0][0]
+        messages = [p.value for e in event_list.events for p in e.parameters if p.name == "Message"]
+        self.assertEqual(["message 0", "message 1"], sorted(messages))
+        self.assertEqual([], os.listdir(event_logger.event_dir))
+
+    def test_aggregated_events_keep_their_files_until_flushed(self, *args):
+        event_logger = EventLogger()
+        event_logger.event_dir = os.path.join(self.tmp_dir, "events")
+        for _ in range(2):
+            event_logger._add_event(0, "", False, True, "message", "Test", "Op", "1.0", 6)
+        monitor_handler = get_monitor_handler()
+        monitor_handler.protocol = Mock()
+
+        monitor_handler.collect_and_send_events()
+        self.assertEqual(0, monitor_handler.protocol.report_event.call_count)
+        self.assertEqual(2, len(os.listdir(event_logger.event_dir)))
+
+        # the files held by the aggregator are not collected again
+        monitor_handler.last_event_collection = None
+        monitor_handler.collect_and_send_events()
+        self.assertEqual(2, monitor_handler.event_aggregator.received)
+
+        monitor_handler.send_aggregated_events()
+        self.assertEqual(1, len(monitor_handler.protocol.report_event.call_args[0][0].events))
+        self.assertEqual([], os.listdir(event_logger.event_dir))
+
     @patch("azurelinuxagent.ga.monitor.MonitorHandler.send_cgroup_telemetry")
     def test_heartbeat_timings_updates_after_window(self, *args):
         monitor_handler = get_monitor_handler()
@@ -216,3 +255,132 @@ class TestMonitor(AgentTestCase):
         self.assertEqual('HostPluginHeartbeatExtended', args[5].call_args[1]['op'])
         self.assertEqual(False, args[5].call_args[1]['is_success'])
         monitor_handler.stop()
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    def test_send_goal_state_cache_telemetry(self, patch_report_metric, *args):
+        monitor_handler = get_monitor_handler()
+        monitor_handler.protocol = WireProtocol("168.63.129.16")
+        goal_state_cache = monitor_handler.protocol.client.goal_state_cache
+        for incarnation in ["1", "1", "1", "2"]:
+            goal_state_cache.get(GoalStateCache.EXT_CONF, incarnation, lambda: None)
+
+        monitor_handler.send_goal_state_cache_telemetry()
+        patch_report_metric.assert_called_once_with("goal state cache", "Hit Rate", "", 50.0)
+
+        patch_report_metric.reset_mock()
+        monitor_handler.send_goal_state_cache_telemetry()
+        self.assertEqual(0, patch_report_metric.call_count)
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    def test_send_file_write_telemetry(self, patch_report_metric, *args):
+        fileutil.get_and_reset_write_counts()
+        path = os.path.join(self.tmp_dir, "Incarnation")
+        for incarnation in ["1", "1", "1", "2"]:
+            fileutil.write_file_if_changed(path, incarnation)
+
+        get_monitor_handler().send_file_write_telemetry()
+        patch_report_metric.assert_any_call("file writes", "Writes", "", 2)
+        patch_report_metric.assert_any_call("file writes", "Writes Avoided", "", 2)
+
+    @patch("azurelinuxagent.ga.monitor.CGroups.enabled", return_value=True)
+    @patch("azurelinuxagent.ga.monitor.CGroupsTelemetry.track_agent")
+    @patch("azurelinuxagent.ga.monitor.CGroupsTelemetry.track_cgroup")
+    @patch("azurelinuxagent.ga.monitor.CGroups.for_extension")
+    def test_init_cgroups_starts_the_sampler(self, *args):
+        monitor_handler = get_monitor_handler()
+        with patch("azurelinuxagent.ga.monitor.CGroupsSampler") as mock_sampler:
+            monitor_handler.init_cgroups()
+        mock_sampler.assert_called_once_with(conf.get_cgroups_sampling_period())
+        self.assertEqual(1, mock_sampler.return_value.start.call_count)
+
+        monitor_handler.cgroup_sampler = None
+        with patch("azurelinuxagent.ga.monitor.CGroupsSampler") as mock_sampler:
+            with patch("azurelinuxagent.common.conf.get_cgroups_sampling_period", return_value=0):
+                monitor_handler.init_cgroups()
+        self.assertEqual(0, mock_sampler.call_count)
+        self.assertEqual(None, monitor_handler.cgroup_sampler)
+
+    @patch("azurelinuxagent.ga.monitor.CGroupsTelemetry.update_tracked")
+    @patch("azurelinuxagent.ga.monitor.CGroupsTelemetry.collect_all_tracked")
+    def test_send_cgroup_telemetry_reports_the_sampler_summaries(self, patch_collect, *args):
+        monitor_handler = get_monitor_handler()
+        monitor_handler.protocol = Mock()
+        monitor_handler.cgroup_sampler = Mock()
+        monitor_handler.last_cgroup_telemetry = datetime.datetime.utcnow() - MonitorHandler.CGROUP_TELEMETRY_PERIOD
+
+        monitor_handler.send_cgroup_telemetry()
+        self.assertEqual(1, monitor_handler.cgroup_sampler.report.call_count)
+        self.assertEqual(0, patch_collect.call_count)
+
+        # the next report is due after the telemetry period
+        monitor_handler.send_cgroup_telemetry()
+        self.assertEqual(1, monitor_handler.cgroup_sampler.report.call_count)
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    @patch("azurelinuxagent.ga.monitor.CGroupsTelemetry.tracked_extensions", return_value=["Microsoft.Test.Ext"])
+    def test_adjust_cgroup_limits_reports_the_adjustments(self, _, patch_report_metric, *args):
+        monitor_handler = get_monitor_handler()
+        monitor_handler.cgroup_governor = Mock()
+        monitor_handler.cgroup_governor.adjust.return_value = [("Microsoft.Test.Ext", "CPU Limit", 50)]
+
+        monitor_handler.adjust_cgroup_limits()
+        monitor_handler.cgroup_governor.adjust.assert_called_once_with(["Microsoft.Test.Ext"])
+        patch_report_metric.assert_called_once_with("CGroups Governor", "CPU Limit", "Microsoft.Test.Ext", 50)
+
+        # the limits are adjusted once per period
+        monitor_handler.adjust_cgroup_limits()
+        self.assertEqual(1, monitor_handler.cgroup_governor.adjust.call_count)
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    @patch("azurelinuxagent.ga.monitor.get_process_io", side_effect=[(0, 0), (4096, 8192)])
+    @patch("azurelinuxagent.ga.monitor.get_process_cpu_time", side_effect=[1.0, 2.0])
+    def test_send_agent_resource_telemetry(self, _, __, patch_report_metric, *args):
+        monitor_handler = get_monitor_handler()
+        # the first call only records the usage
+        monitor_handler.send_agent_resource_telemetry()
+        self.assertEqual(0, patch_report_metric.call_count)
+
+        monitor_handler.send_agent_resource_telemetry()
+        patch_report_metric.assert_any_call("agent resources", "Bytes Read", "", 4096)
+        patch_report_metric.assert_any_call("agent resources", "Bytes Written", "", 8192)
+
+    @patch("azurelinuxagent.ga.monitor.MonitorHandler.send_agent_resource_telemetry")
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    @patch("azurelinuxagent.ga.monitor.add_event")
+    def test_send_telemetry_heartbeat_counts_the_heartbeats_and_flushes_the_metrics(self, patch_add_event,
+                                                                                   patch_report_metric, *args):
+        from azurelinuxagent.common.metrics import registry
+        registry.counter("test", "Operations").inc("flushed", 7)
+        monitor_handler = get_monitor_handler()
+        monitor_handler.protocol = Mock()
+        monitor_handler.osutil = Mock()
+        heartbeats = monitor_handler.heartbeats.value()
+
+        monitor_handler.send_telemetry_heartbeat()
+
+        self.assertEqual(heartbeats + 1, monitor_handler.heartbeats.value())
+        self.assertTrue(";{0};".format(heartbeats) in patch_add_event.call_args_list[0][1]["message"])
+        patch_report_metric.assert_any_call("test", "Operations", "flushed", 7)
+
+    @patch("azurelinuxagent.ga.monitor.report_metric")
+    def test_send_extension_command_telemetry(self, patch_report_metric, *args):
+        from azurelinuxagent.common.utils.processutil import CommandUsage, record_command_usage
+        usage = CommandUsage()
+        usage.count, usage.user_time, usage.voluntary_switches, usage.involuntary_switches = 1, 0.25, 10, 2
+        record_command_usage(("Microsoft.Test.Ext", "Enable"), usage)
+        record_command_usage(("Microsoft.Test.Ext", "Enable"), usage)
+
+        MonitorHandler.send_extension_command_telemetry()
+        patch_report_metric.assert_any_call("extension commands", "Count", "Microsoft.Test.Ext Enable", 2)
+        patch_report_metric.assert_any_call("extension commands", "User CPU Time", "Microsoft.Test.Ext Enable", 0.5)
+        patch_report_metric.assert_any_call("extension commands", "Context Switches", "Microsoft.Test.Ext Enable", 24)
+
+        # the usage is reported once
+        patch_report_metric.reset_mock()
+        MonitorHandler.send_extension_command_telemetry()
+        self.assertEqual(0, patch_report_metric.call_count)
+
+    def test_get_event_timestamp(self, *args):
+        self.assertEqual(datetime.datetime(2016, 11, 2, 22, 4, 16, 789000),
+                         get_event_timestamp("/var/lib/waagent/events/1478124256789000.tld"))
+        self.assertTrue(isinstance(get_event_timestamp("not-a-timestamp.tld"), datetime.datetime))
@@ -0,0 +1,134 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Fork count and wall time of matching certificates with their private keys
+(the work done by Certificates.parse after decrypting the p7m) for 1, 10
+and 50 certificates:
+
+    legacy     one openssl process per key, and two per certificate
+    fallback   certificates converted by a single openssl process, one
+               process per key (keys/certificates the DER reader rejects)
+    batch      CryptUtil batch methods (in-process DER reader)
+
+    python -m tests.perf.bench_cryptutil [openssl]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import azurelinuxagent.common.utils.shellutil as shellutil
+from azurelinuxagent.common.utils.cryptutil import CryptUtil
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def legacy_match(openssl_cmd, crt_files, prv_files):
+    thumbprints = {}
+    for crt_file in crt_files:
+        pub = shellutil.run_get_output("{0} x509 -in {1} -pubkey -noout".format(openssl_cmd, crt_file))[1]
+        thumbprint = shellutil.run_get_output("{0} x509 -in {1} -fingerprint -noout".format(openssl_cmd,
+                                                                                            crt_file))[1]
+        thumbprints[pub] = thumbprint.rstrip().split('=')[1].replace(':', '').upper()
+    matches = []
+    for prv_file in prv_files:
+        pub = shellutil.run_get_output("{0} rsa -in {1} -pubout 2>/dev/null".format(openssl_cmd, prv_file))[1]
+        matches.append(thumbprints[pub])
+    return matches
+
+
+def batch_match(cryptutil, crt_files, prv_files):
+    thumbprints = dict((pub, thumbprint) for thumbprint, pub in
+                       cryptutil.get_thumbprints_and_pubkeys_from_crts(crt_files))
+    return [thumbprints[pub] for pub in cryptutil.get_pubkeys_from_prvs(prv_files)]
+
+
+def fallback_match(cryptutil, crt_files, prv_files):
+    with patch.object(CryptUtil, "_read_der", return_value=(None, None)):
+        return batch_match(cryptutil, crt_files, prv_files)
+
+
+def _generate(openssl_cmd, directory, count):
+    crt_files = []
+    prv_files = []
+    for i in range(count):
+        prv_file = os.path.join(directory, "{0}.prv".format(i))
+        crt_file = os.path.join(directory, "{0}.crt".format(i))
+        shellutil.run("{0} req -x509 -nodes -subj /CN=Bench{1} -days 1 -newkey rsa:2048 "
+                      "-keyout {2} -out {3}".format(openssl_cmd, i, prv_file, crt_file), chk_err=False)
+        crt_files.append(crt_file)
+        prv_files.append(prv_file)
+    return crt_files, prv_files
+
+
+class _ForkCounter(object):
+    def __init__(self):
+        self.count = 0
+        self._popen = subprocess.Popen
+
+    def __enter__(self):
+        counter = self
+
+        class CountingPopen(self._popen):
+            def __init__(self, *args, **kwargs):
+                counter.count += 1
+                super(CountingPopen, self).__init__(*args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *args):
+        subprocess.Popen = self._popen
+
+
+def _measure(func, *args):
+    with _ForkCounter() as counter:
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+    return result, counter.count, elapsed
+
+
+def main(openssl_cmd="openssl"):
+    cryptutil = CryptUtil(openssl_cmd)
+    directory = tempfile.mkdtemp()
+    try:
+        crt_files, prv_files = _generate(openssl_cmd, directory, 50)
+
+        print("{0:>6} {1:>10} {2:>8} {3:>10}".format("certs", "", "forks", "time (s)"))
+        for count in [1, 10, 50]:
+            args = (crt_files[:count], prv_files[:count])
+            expected = None
+            for name, func, func_args in [("legacy", legacy_match, (openssl_cmd,) + args),
+                                          ("fallback", fallback_match, (cryptutil,) + args),
+                                          ("batch", batch_match, (cryptutil,) + args)]:
+                result, forks, elapsed = _measure(func, *func_args)
+                expected = result if expected is None else expected
+                assert result == expected, "{0} returned different thumbprints".format(name)
+                print("{0:6} {1:>10} {2:8} {3:10.3f}".format(count, name, forks, elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,62 @@
+# Copyright 2016 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Microbenchmark comparing the synchronous FileAppender with the
+AsyncFileAppender.
+
+    python -m tests.perf.bench_logger [iterations]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import azurelinuxagent.common.logger as logger
+
+
+def _run(appender_type, iterations, tmp_dir):
+    log = logger.Logger()
+    path = os.path.join(tmp_dir, "bench-{0}.log".format(appender_type))
+    log.add_appender(appender_type, logger.LogLevel.INFO, path)
+
+    start = time.time()
+    for i in range(iterations):
+        log.info("Benchmark message {0} of {1}", i, iterations)
+        log.verbose("Filtered message {0}", i)
+    for appender in log.appenders:
+        if hasattr(appender, "close"):
+            appender.close()
+    return iterations / (time.time() - start)
+
+
+def main(iterations=50000):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_logger_")
+    try:
+        sync_rate = _run(logger.AppenderType.FILE, iterations, tmp_dir)
+        async_rate = _run(logger.AppenderType.ASYNC_FILE, iterations, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print("FileAppender:      {0:12.0f} log calls/s".format(sync_rate))
+    print("AsyncFileAppender: {0:12.0f} log calls/s".format(async_rate))
+    print("Speedup:           {0:12.2f}x".format(async_rate / sync_rate))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
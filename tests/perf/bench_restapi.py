@@ -0,0 +1,129 @@
+# Copyright 2016 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Microbenchmark of get_properties/set_properties against the previous
+reflective implementation, for TelemetryEvent, VMStatus and ExtHandlerList.
+
+    python -m tests.perf.bench_restapi [iterations]
+"""
+import sys
+import time
+
+import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.protocol.restapi import DataContract, DataContractList, ExtHandler, \
+    ExtHandlerList, ExtHandlerStatus, Extension, TelemetryEvent, TelemetryEventParam, VMStatus, \
+    get_attributes, get_properties, set_properties, validate_param
+
+
+def legacy_set_properties(name, obj, data):
+    if isinstance(obj, DataContract):
+        validate_param("Property '{0}'".format(name), data, dict)
+        for prob_name, prob_val in data.items():
+            prob_full_name = "{0}.{1}".format(name, prob_name)
+            try:
+                prob = getattr(obj, prob_name)
+            except AttributeError:
+                logger.warn("Unknown property: {0}", prob_full_name)
+                continue
+            prob = legacy_set_properties(prob_full_name, prob, prob_val)
+            setattr(obj, prob_name, prob)
+        return obj
+    elif isinstance(obj, DataContractList):
+        validate_param("List '{0}'".format(name), data, list)
+        for item_data in data:
+            item = obj.item_cls()
+            item = legacy_set_properties(name, item, item_data)
+            obj.append(item)
+        return obj
+    else:
+        return data
+
+
+def legacy_get_properties(obj):
+    if isinstance(obj, DataContract):
+        data = {}
+        props = get_attributes(obj)
+        for prob_name, prob in list(props.items()):
+            data[prob_name] = legacy_get_properties(prob)
+        return data
+    elif isinstance(obj, DataContractList):
+        data = []
+        for item in obj:
+            item_data = legacy_get_properties(item)
+            data.append(item_data)
+        return data
+    else:
+        return obj
+
+
+def _create_telemetry_event():
+    event = TelemetryEvent(6, "69B669B9-4AF8-4C50-BDC4-6006FA76E975")
+    for name, value in [('Name', 'WALinuxAgent'), ('Version', '2.2.31'), ('IsInternal', False),
+                        ('Operation', 'HeartBeat'), ('OperationSuccess', True), ('Message', 'message'),
+                        ('Duration', 0), ('ExtensionType', '')]:
+        event.parameters.append(TelemetryEventParam(name, value))
+    return event
+
+
+def _create_vm_status():
+    vm_status = VMStatus(status="Ready", message="Guest Agent is running")
+    for i in range(10):
+        handler_status = ExtHandlerStatus(name="Handler{0}".format(i), version="1.0", status="Ready")
+        handler_status.extensions.append("Extension{0}".format(i))
+        vm_status.vmAgent.extensionHandlers.append(handler_status)
+    return vm_status
+
+
+def _create_ext_handler_list():
+    ext_handlers = ExtHandlerList()
+    for i in range(10):
+        handler = ExtHandler(name="Handler{0}".format(i))
+        handler.properties.version = "1.0"
+        handler.properties.state = "enabled"
+        handler.properties.extensions.append(Extension(name="Extension{0}".format(i), sequenceNumber=i))
+        ext_handlers.extHandlers.append(handler)
+    return ext_handlers
+
+
+def _time(func, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.time() - start)
+
+
+def main(iterations=20000):
+    cases = [("TelemetryEvent", _create_telemetry_event(), TelemetryEvent),
+             ("VMStatus", _create_vm_status(), lambda: VMStatus(None, None)),
+             ("ExtHandlerList", _create_ext_handler_list(), ExtHandlerList)]
+
+    print("{0:15} {1:>10} {2:>12} {3:>12} {4:>8}".format("", "", "legacy/s", "compiled/s", "speedup"))
+    for name, obj, factory in cases:
+        data = get_properties(obj)
+        for op, legacy, compiled in [
+                ("to dict", lambda: legacy_get_properties(obj), lambda: get_properties(obj)),
+                ("from dict", lambda: legacy_set_properties(name, factory(), data),
+                 lambda: set_properties(name, factory(), data))]:
+            legacy_rate = _time(legacy, iterations)
+            compiled_rate = _time(compiled, iterations)
+            print("{0:15} {1:>10} {2:12.0f} {3:12.0f} {4:7.2f}x".format(
+                name, op, legacy_rate, compiled_rate, compiled_rate / legacy_rate))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,136 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Memory footprint of a large synthetic goal state (extension handlers and
+their status) with the data contracts declaring __slots__, compared with
+the same contracts keeping a per-instance __dict__.
+
+    python -m tests.perf.bench_restapi_memory [handlers] [extensions per handler]
+
+Requires Python 3.4+ (tracemalloc).
+"""
+import sys
+import time
+import tracemalloc
+
+import azurelinuxagent.common.protocol.restapi as restapi
+from azurelinuxagent.common.protocol.restapi import DataContract, get_properties, set_properties
+
+
+def _get_slotted_classes():
+    classes = []
+    for name in dir(restapi):
+        cls = getattr(restapi, name)
+        if isinstance(cls, type) and issubclass(cls, DataContract) and len(cls.__dict__.get('__slots__', ())) > 0:
+            classes.append(cls)
+    return classes
+
+
+class _UnslottedContracts(object):
+    """
+    Temporarily replace the slotted contracts of the restapi module by
+    equivalent classes with a per-instance __dict__
+    """
+    def __init__(self):
+        self.classes = _get_slotted_classes()
+
+    def __enter__(self):
+        for cls in self.classes:
+            clone = type(cls.__name__, (DataContract,), {'__init__': cls.__dict__['__init__']})
+            setattr(restapi, cls.__name__, clone)
+
+    def __exit__(self, *args):
+        for cls in self.classes:
+            setattr(restapi, cls.__name__, cls)
+
+
+def _create_goal_state(handlers, extensions):
+    ext_handlers = restapi.ExtHandlerList()
+    vm_status = restapi.VMStatus(status="Ready", message="Guest Agent is running")
+    for i in range(handlers):
+        handler = restapi.ExtHandler(name="Handler{0}".format(i))
+        handler.properties.version = "1.0"
+        handler.properties.state = "enabled"
+        handler.versionUris.append(restapi.ExtHandlerVersionUri())
+        handler_status = restapi.ExtHandlerStatus(name=handler.name, version="1.0", status="Ready")
+        for j in range(extensions):
+            handler.properties.extensions.append(restapi.Extension(name="Extension{0}".format(j),
+                                                                   sequenceNumber=j))
+            ext_status = restapi.ExtensionStatus(seq_no=j)
+            ext_status.substatusList.append(restapi.ExtensionSubStatus(name="Sub{0}".format(j)))
+            handler_status.extensions.append(ext_status)
+        ext_handlers.extHandlers.append(handler)
+        vm_status.vmAgent.extensionHandlers.append(handler_status)
+    return ext_handlers, vm_status
+
+
+def _get_object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def _get_object_sizes():
+    return [(name, _get_object_size(factory())) for name, factory in [
+        ("ExtHandler", lambda: restapi.ExtHandler()),
+        ("Extension", lambda: restapi.Extension()),
+        ("ExtHandlerStatus", lambda: restapi.ExtHandlerStatus()),
+        ("TelemetryEventParam", lambda: restapi.TelemetryEventParam("Name", "value")),
+        ("VMAgentManifestUri", lambda: restapi.VMAgentManifestUri())]]
+
+
+def _measure(handlers, extensions):
+    tracemalloc.start()
+    start = time.time()
+    goal_state = _create_goal_state(handlers, extensions)
+    data = get_properties(goal_state[0])
+    set_properties("extHandlers", restapi.ExtHandlerList(), data)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum([stat.count for stat in tracemalloc.take_snapshot().statistics('filename')])
+    tracemalloc.stop()
+    del goal_state
+    return current, peak, blocks, elapsed
+
+
+def main(handlers=2000, extensions=5):
+    with _UnslottedContracts():
+        dict_sizes = _get_object_sizes()
+        dict_current, dict_peak, dict_blocks, dict_time = _measure(handlers, extensions)
+    slot_sizes = _get_object_sizes()
+    slot_current, slot_peak, slot_blocks, slot_time = _measure(handlers, extensions)
+
+    print("{0:20} {1:>12} {2:>12}".format("bytes per object", "__dict__", "__slots__"))
+    for (name, dict_size), (_, slot_size) in zip(dict_sizes, slot_sizes):
+        print("{0:20} {1:12} {2:12}".format(name, dict_size, slot_size))
+
+    print("")
+    print("{0} handlers, {1} extensions each".format(handlers, extensions))
+    print("{0:12} {1:>14} {2:>14} {3:>12} {4:>10}".format("", "retained (KB)", "peak (KB)", "live blocks",
+                                                           "time (s)"))
+    for name, current, peak, blocks, elapsed in [
+            ("__dict__", dict_current, dict_peak, dict_blocks, dict_time),
+            ("__slots__", slot_current, slot_peak, slot_blocks, slot_time)]:
+        print("{0:12} {1:14.0f} {2:14.0f} {3:12} {4:10.3f}".format(name, current / 1024.0, peak / 1024.0,
+                                                                 blocks, elapsed))
+    print("retained memory reduced by {0:.1f}%".format(100.0 * (dict_current - slot_current) / dict_current))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,128 @@
+# Copyright 2016 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+"""
+Benchmark serializing and sending telemetry events to a local stand-in
+wireserver, with the previous per-provider string buffers and with the
+TelemetryBatchPacker.
+
+    python -m tests.perf.bench_telemetry [events]
+"""
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from azurelinuxagent.common.protocol.restapi import TelemetryEvent, TelemetryEventList, TelemetryEventParam
+from azurelinuxagent.common.protocol.wire import WireClient, event_param_to_v1
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _WireServerStub(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    requests = 0
+    bytes_received = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        with _WireServerStub.lock:
+            _WireServerStub.requests += 1
+            _WireServerStub.bytes_received += length
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _legacy_event_to_v1(event):
+    params = ""
+    for param in event.parameters:
+        params += event_param_to_v1(param)
+    return '<Event id="{0}"><![CDATA[{1}]]></Event>'.format(event.eventId, params)
+
+
+def _legacy_report_event(client, event_list):
+    buf = {}
+    for event in event_list.events:
+        if event.providerId not in buf:
+            buf[event.providerId] = ""
+        event_str = _legacy_event_to_v1(event)
+        if len(event_str) >= 63 * 1024:
+            continue
+        if len(buf[event.providerId] + event_str) >= 63 * 1024:
+            client.send_event(event.providerId, buf[event.providerId])
+            buf[event.providerId] = ""
+        buf[event.providerId] = buf[event.providerId] + event_str
+    for provider_id in list(buf.keys()):
+        if len(buf[provider_id]) > 0:
+            client.send_event(provider_id, buf[provider_id])
+
+
+def _create_events(count):
+    event_list = TelemetryEventList()
+    for i in range(count):
+        event = TelemetryEvent(6, "PROVIDER-{0}".format(i % 3))
+        event.parameters.append(TelemetryEventParam('Name', 'WALinuxAgent'))
+        event.parameters.append(TelemetryEventParam('Operation', 'HeartBeat'))
+        event.parameters.append(TelemetryEventParam('OperationSuccess', True))
+        event.parameters.append(TelemetryEventParam('Message', "m" * (50 + (i * 37) % 2000)))
+        event.parameters.append(TelemetryEventParam('Duration', i))
+        event_list.events.append(event)
+    return event_list
+
+
+def _run(report, client, event_list):
+    _WireServerStub.requests = 0
+    _WireServerStub.bytes_received = 0
+    start = time.time()
+    report(client, event_list)
+    elapsed = time.time() - start
+    return len(event_list.events) / elapsed, _WireServerStub.requests, _WireServerStub.bytes_received
+
+
+def main(count=20000):
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), _WireServerStub)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    try:
+        client = WireClient("127.0.0.1:{0}".format(server.server_address[1]))
+        event_list = _create_events(count)
+        for name, report in [("string buffers", _legacy_report_event),
+                             ("batch packer", lambda c, e: c.report_event(e))]:
+            rate, requests, received = _run(report, client, event_list)
+            print("{0:15}: {1:10.0f} events/s, {2:5} POSTs, {3:7.1f} KB/POST".format(
+                name, rate, requests, received / 1024.0 / max(requests, 1)))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
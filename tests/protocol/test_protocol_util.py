@@ -15,9 +15,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import threading
+
 from tests.tools import *
 from azurelinuxagent.common.exception import *
 from azurelinuxagent.common.protocol import get_protocol_util, \
+                                            reset_protocol_util, \
                                             TAG_FILE_NAME
 
 @patch("time.sleep")
@@ -75,6 +78,20 @@ class TestProtocolUtil(AgentTestCase):
         protocol_util._detect_metadata_protocol.assert_any_call()
         protocol_util._detect_wire_protocol.assert_not_called()
 
+    def test_get_protocol_util_is_shared(self, _):
+        protocol_util = get_protocol_util()
+        self.assertTrue(protocol_util is get_protocol_util())
+
+        threads = [threading.Thread(target=get_protocol_util) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(protocol_util is get_protocol_util())
+
+        reset_protocol_util()
+        self.assertFalse(protocol_util is get_protocol_util())
+
 
 if __name__ == '__main__':
     unittest.main()
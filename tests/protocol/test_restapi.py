@@ -28,6 +28,13 @@ class SampleDataContract(DataContract):
         self.foo = None
         self.bar = DataContractList(int)
 
+class SampleSlottedDataContract(DataContract):
+    __slots__ = ("foo", "bar", "baz")
+
+    def __init__(self):
+        self.foo = None
+        self.bar = DataContractList(int)
+
 class TestDataContract(unittest.TestCase):
     def test_get_properties(self):
         obj = SampleDataContract()
@@ -46,5 +53,60 @@ class TestDataContract(unittest.TestCase):
         set_properties('sample', obj, data)
         self.assertFalse(hasattr(obj, 'baz'))
 
+    def test_get_properties_handles_added_attributes(self):
+        get_properties(SampleDataContract())
+
+        obj = SampleDataContract()
+        obj.baz = SampleDataContract()
+        data = get_properties(obj)
+        self.assertEqual({'foo': None, 'bar': [], 'baz': {'foo': None, 'bar': []}}, data)
+
+    def test_get_properties_nested(self):
+        vm_status = VMStatus(status="Ready", message="Guest Agent is running")
+        handler_status = ExtHandlerStatus(name="Foo", version="1.0", status="Ready")
+        handler_status.extensions.append("Foo")
+        vm_status.vmAgent.extensionHandlers.append(handler_status)
+
+        data = get_properties(vm_status)
+        self.assertEqual("Ready", data['vmAgent']['status'])
+        self.assertEqual([{'name': 'Foo', 'version': '1.0', 'status': 'Ready', 'code': 0,
+                           'message': None, 'extensions': ['Foo']}],
+                         data['vmAgent']['extensionHandlers'])
+
+    def test_set_properties_round_trip(self):
+        ext_handlers = ExtHandlerList()
+        for i in range(3):
+            handler = ExtHandler(name="Handler{0}".format(i))
+            handler.properties.version = "1.{0}".format(i)
+            handler.properties.extensions.append(Extension(name="Ext{0}".format(i), sequenceNumber=i))
+            ext_handlers.extHandlers.append(handler)
+
+        data = get_properties(ext_handlers)
+        copy = set_properties("extHandlers", ExtHandlerList(), data)
+
+        self.assertEqual(data, get_properties(copy))
+        self.assertEqual("Ext2", copy.extHandlers[2].properties.extensions[0].name)
+        self.assertTrue(isinstance(copy.extHandlers[2].properties, ExtHandlerProperties))
+
+    def test_slotted_data_contracts_have_no_dict(self):
+        for obj in [ExtHandler(), Extension(), ExtHandlerStatus(), ExtensionStatus(),
+                    TelemetryEvent(), TelemetryEventParam(), VMAgentManifestUri()]:
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj).__name__)
+
+    def test_get_properties_slotted(self):
+        obj = SampleSlottedDataContract()
+        obj.foo = "foo"
+        obj.bar.append(1)
+        self.assertEqual({'foo': 'foo', 'bar': [1]}, get_properties(obj))
+
+        obj.baz = SampleSlottedDataContract()
+        self.assertEqual({'foo': 'foo', 'bar': [1], 'baz': {'foo': None, 'bar': []}}, get_properties(obj))
+
+    def test_set_properties_slotted(self):
+        obj = set_properties('sample', SampleSlottedDataContract(), {'foo': 1, 'bar': [2], 'qux': 'a'})
+        self.assertEqual(1, obj.foo)
+        self.assertEqual([2], obj.bar)
+        self.assertFalse(hasattr(obj, 'qux'))
+
 if __name__ == '__main__':
     unittest.main()
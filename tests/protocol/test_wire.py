@@ -231,6 +231,37 @@ class TestWireProtocol(AgentTestCase):
                     # host plugin uploads the status blob
                     patch_host_ga_plugin_upload.assert_called_once_with(ANY, testurl, 'BlockBlob')
 
+    @patch("azurelinuxagent.common.protocol.wire.WireClient.update_goal_state")
+    def test_upload_status_blob_counts_the_uploads_by_route(self, *args):
+        from azurelinuxagent.common.metrics import registry
+        uploads = registry.counter("status", "Uploads")
+        wire_protocol_client = WireProtocol(wireserver_url).client
+        wire_protocol_client.ext_conf = ExtensionsConfig(None)
+        wire_protocol_client.ext_conf.status_upload_blob = testurl
+        wire_protocol_client.ext_conf.status_upload_blob_type = testtype
+        wire_protocol_client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
+        before = uploads.values()
+
+        def get_increase(route):
+            return uploads.value(route) - before.get(route, 0)
+
+        with patch.object(WireClient, "get_host_plugin"):
+            wire_protocol_client.upload_status_blob()
+        self.assertEqual(1, get_increase("hostplugin"))
+
+        with patch.object(WireClient, "get_host_plugin", side_effect=ResourceGoneError()):
+            wire_protocol_client.upload_status_blob()
+        self.assertEqual(1, get_increase("skipped"))
+
+        with patch.object(WireClient, "get_host_plugin", side_effect=HttpError()):
+            with patch.object(StatusBlob, "upload", return_value=True):
+                wire_protocol_client.upload_status_blob()
+            self.assertEqual(1, get_increase("direct"))
+
+            with patch.object(StatusBlob, "upload", return_value=False):
+                self.assertRaises(ProtocolError, wire_protocol_client.upload_status_blob)
+            self.assertEqual(1, get_increase("failed"))
+
     @patch("azurelinuxagent.common.protocol.wire.WireClient.update_goal_state")
     def test_upload_status_blob_host_ga_plugin(self, *args):
         vmstatus = VMStatus(message="Ready", status="Ready")
@@ -443,6 +474,273 @@ class TestWireProtocol(AgentTestCase):
         self.assertEqual(json.dumps(v1_vm_status), actual.to_json())
 
 
+class TestTelemetryBatchPacker(AgentTestCase):
+    @staticmethod
+    def _create_event(provider_id, message):
+        event = TelemetryEvent(1, provider_id)
+        event.parameters.append(TelemetryEventParam('Message', message))
+        return event
+
+    def test_packs_providers_into_one_payload(self):
+        packer = TelemetryBatchPacker()
+        for provider_id in ["P1", "P2", "P1"]:
+            packer.add(provider_id, event_to_v1(self._create_event(provider_id, "msg")))
+
+        payloads = packer.get_payloads()
+        self.assertEqual(1, len(payloads))
+        doc = parse_doc(payloads[0])
+        providers = findall(doc, "Provider")
+        self.assertEqual(["P1", "P2"], [getattrib(p, "id") for p in providers])
+        self.assertEqual(2, len(findall(providers[0], "Event")))
+        self.assertEqual(1, len(findall(providers[1], "Event")))
+
+    def test_payloads_respect_max_size(self):
+        packer = TelemetryBatchPacker(max_size=4 * 1024)
+        for i in range(100):
+            packer.add("P{0}".format(i % 3), event_to_v1(self._create_event("P", "x" * (i * 10))))
+
+        payloads = packer.get_payloads()
+        for payload in payloads:
+            self.assertTrue(len(payload.encode('utf-8')) <= 4 * 1024)
+        self.assertEqual(100, sum([payload.count("<Event ") for payload in payloads]))
+        # first-fit should leave at most one payload less than half full
+        self.assertTrue(len([p for p in payloads if len(p) < 2 * 1024]) <= 1)
+
+    def test_preserves_order_within_provider(self):
+        packer = TelemetryBatchPacker()
+        for i in range(5):
+            packer.add("P1", event_to_v1(self._create_event("P1", "m" * (5 - i) + str(i))))
+
+        payload = packer.get_payloads()[0]
+        positions = [payload.index(str(i) + '"') for i in range(5)]
+        self.assertEqual(sorted(positions), positions)
+
+    def test_preserves_order_within_provider_across_payloads(self):
+        packer = TelemetryBatchPacker(max_size=4 * 1024)
+        # the small events would fit in the first payload, before the large events of their provider
+        added = [("P0", 3000), ("P1", 3000), ("P1", 100), ("P0", 2000), ("P0", 100), ("P1", 1500)]
+        for i, (provider_id, size) in enumerate(added):
+            packer.add(provider_id, event_to_v1(self._create_event(provider_id, "x" * size + "#{0}#".format(i))))
+
+        batches = packer.get_batches()
+        self.assertTrue(len(batches) > 1)
+        events = {"P0": [], "P1": []}
+        for providers, payload in batches:
+            for provider_id, provider_events in re.findall(r'<Provider id="(\w+)">(.*?)</Provider>', payload):
+                self.assertTrue(provider_id in providers)
+                events[provider_id].extend(int(i) for i in re.findall(r"#(\d+)#", provider_events))
+        self.assertEqual([0, 3, 4], events["P0"])
+        self.assertEqual([1, 2, 5], events["P1"])
+
+    def test_report_event_sends_the_payloads_of_a_provider_in_order(self):
+        client = WireClient(wireserver_url)
+        event_list = TelemetryEventList()
+        for i in range(200):
+            event_list.events.append(self._create_event("P1", "x" * 1024 + "#{0}#".format(i)))
+        sent = []
+
+        def send_telemetry_data(data):
+            # the first payload is the slowest one
+            if "#0#" in data:
+                time.sleep(0.1)
+            sent.append([int(i) for i in re.findall(r"#(\d+)#", data)])
+
+        with patch.object(WireClient, "send_telemetry_data", side_effect=send_telemetry_data):
+            client.report_event(event_list)
+
+        self.assertTrue(len(sent) > 1)
+        self.assertEqual(list(range(200)), [i for payload in sent for i in payload])
+
+    def test_rejects_oversized_events(self):
+        packer = TelemetryBatchPacker()
+        self.assertFalse(packer.add("P1", "x" * MAX_EVENT_BUFFER_SIZE))
+        self.assertEqual([], packer.get_payloads())
+
+    def test_report_event_sends_all_payloads(self):
+        client = WireClient(wireserver_url)
+        event_list = TelemetryEventList()
+        for i in range(200):
+            event_list.events.append(self._create_event("P{0}".format(i % 2), "x" * 1024))
+
+        with patch.object(WireClient, "send_telemetry_data") as mock_send:
+            client.report_event(event_list)
+
+        self.assertEqual(4, mock_send.call_count)
+        self.assertEqual(200, sum([c[0][0].count("<Event ") for c in mock_send.call_args_list]))
+
+    def test_report_event_raises_on_failure(self):
+        client = WireClient(wireserver_url)
+        event_list = TelemetryEventList()
+        for i in range(200):
+            event_list.events.append(self._create_event("P1", "x" * 1024))
+
+        with patch.object(WireClient, "send_telemetry_data", side_effect=ProtocolError("failed")):
+            self.assertRaises(ProtocolError, client.report_event, event_list)
+
+
+class TestGoalStateCache(AgentTestCase):
+    def test_get_parses_once_per_incarnation(self):
+        cache = GoalStateCache()
+        parse = Mock(side_effect=lambda: object())
+
+        document = cache.get(GoalStateCache.EXT_CONF, "1", parse)
+        self.assertTrue(document is cache.get(GoalStateCache.EXT_CONF, "1", parse))
+        self.assertEqual(1, parse.call_count)
+
+        self.assertFalse(document is cache.get(GoalStateCache.EXT_CONF, "2", parse))
+        self.assertEqual(2, parse.call_count)
+        self.assertEqual((1, 2), cache.get_and_reset_counts())
+        self.assertEqual((0, 0), cache.get_and_reset_counts())
+
+    def test_set_incarnation_drops_previous_incarnation(self):
+        cache = GoalStateCache()
+        cache.set_incarnation("1")
+        cache.add(GoalStateCache.HOSTING_ENV, "1", "hosting_env")
+        cache.set_incarnation("2")
+        cache.add(GoalStateCache.EXT_CONF, "2", "ext_conf")
+        self.assertEqual("2", cache.incarnation)
+
+        self.assertEqual("hosting_env.2", cache.get(GoalStateCache.HOSTING_ENV, "2", lambda: "hosting_env.2"))
+        self.assertEqual("ext_conf", cache.get(GoalStateCache.EXT_CONF, "2", lambda: None))
+
+    def test_documents_of_other_incarnations_are_not_cached(self):
+        cache = GoalStateCache()
+        cache.set_incarnation("2")
+        cache.add(GoalStateCache.EXT_CONF, "2", "ext_conf.2")
+
+        # a reader of the previous incarnation gets its document, without evicting the current one
+        cache.add(GoalStateCache.EXT_CONF, "1", "ext_conf.1")
+        self.assertEqual("ext_conf.1", cache.get(GoalStateCache.EXT_CONF, "1", lambda: "ext_conf.1"))
+        self.assertEqual("ext_conf.1", cache.get(GoalStateCache.EXT_CONF, "1", lambda: "ext_conf.1"))
+        self.assertEqual("2", cache.incarnation)
+        self.assertEqual("ext_conf.2", cache.get(GoalStateCache.EXT_CONF, "2", lambda: None))
+        self.assertEqual((1, 2), cache.get_and_reset_counts())
+
+    def test_get_current_handlers_parses_once_per_incarnation(self):
+        ext_conf = load_data("wire/ext_conf.xml")
+        for incarnation in ["1", "2"]:
+            fileutil.write_file(os.path.join(self.tmp_dir, EXT_CONF_FILE_NAME.format(incarnation)), ext_conf)
+        incarnation_file = os.path.join(self.tmp_dir, INCARNATION_FILE_NAME)
+        fileutil.write_file(incarnation_file, "1")
+
+        client = WireClient(wireserver_url)
+        with patch("azurelinuxagent.common.protocol.wire.ExtensionsConfig", wraps=ExtensionsConfig) as mock_ext_conf:
+            handlers = client.get_current_handlers()
+            self.assertEqual(1, len(handlers))
+            self.assertTrue(handlers[0] is client.get_current_handlers()[0])
+            self.assertEqual(1, mock_ext_conf.call_count)
+
+            fileutil.write_file(incarnation_file, "2")
+            client.get_current_handlers()
+            self.assertEqual(2, mock_ext_conf.call_count)
+
+    def test_fetch_incarnation_evicts_goal_state_files(self):
+        incarnation_file = os.path.join(self.tmp_dir, INCARNATION_FILE_NAME)
+        fileutil.write_file(incarnation_file, "1")
+        hosting_env_file = os.path.join(self.tmp_dir, HOSTING_ENV_FILE_NAME)
+        fileutil.write_file(hosting_env_file, load_data("wire/hosting_env.xml"))
+
+        client = WireClient(wireserver_url)
+        self.assertEqual("1", client.fetch_incarnation())
+        hosting_env = client.fetch_cache(hosting_env_file, HostingEnv)
+        self.assertTrue(hosting_env is client.fetch_cache(hosting_env_file, HostingEnv))
+        self.assertEqual((1, 1), client.file_cache.get_and_reset_counts())
+
+        client.save_cache(incarnation_file, "2")
+        self.assertEqual("2", client.fetch_incarnation())
+        self.assertFalse(hosting_env is client.fetch_cache(hosting_env_file, HostingEnv))
+
+    def test_update_goal_state_is_serialized(self):
+        client = WireClient(wireserver_url)
+        active = []
+        overlapped = []
+
+        def update_goal_state(*_):
+            active.append(1)
+            if len(active) > 1:
+                overlapped.append(1)
+            time.sleep(0.05)
+            active.pop()
+
+        with patch.object(WireClient, "_update_goal_state", side_effect=update_goal_state):
+            threads = [threading.Thread(target=client.update_goal_state) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual([], overlapped)
+
+
+class TestCertificates(AgentTestCase):
+    def _decrypt_p7m(self, p7m_file, trans_prv_file, trans_cert_file, pem_file):
+        self.decrypt_count += 1
+        fileutil.write_file(pem_file, load_data("wire/trans_prv") + load_data("wire/trans_cert"))
+
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.decrypt_count = 0
+        self.client = WireClient(wireserver_url)
+        self.certs_xml = load_data("wire/certs.xml")
+
+    def _parse(self, certs_xml):
+        with patch.object(CryptUtil, "decrypt_p7m", side_effect=self._decrypt_p7m):
+            return Certificates(self.client, certs_xml)
+
+    def test_parse_saves_certificates(self):
+        certs = self._parse(self.certs_xml)
+        self.assertEqual(["63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D"],
+                         [c.thumbprint for c in certs.cert_list.certificates])
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D.crt")))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D.prv")))
+
+    def test_parse_skips_unchanged_certificates(self):
+        self._parse(self.certs_xml)
+        crt_file = os.path.join(self.tmp_dir, "63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D.crt")
+        mtime = os.path.getmtime(crt_file) - 10
+        os.utime(crt_file, (mtime, mtime))
+
+        certs = self._parse(self.certs_xml)
+        self.assertEqual(1, self.decrypt_count)
+        self.assertEqual(["63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D"],
+                         [c.thumbprint for c in certs.cert_list.certificates])
+
+        # a different payload is decrypted, but unchanged files are not rewritten
+        self._parse(self.certs_xml.replace("<Data>", "<Data>\n"))
+        self.assertEqual(2, self.decrypt_count)
+        self.assertEqual(mtime, os.path.getmtime(crt_file))
+
+        # missing files cause the certificates to be decrypted again
+        os.remove(crt_file)
+        self._parse(self.certs_xml.replace("<Data>", "<Data>\n"))
+        self.assertEqual(3, self.decrypt_count)
+        self.assertTrue(os.path.isfile(crt_file))
+
+    def test_parse_does_not_save_the_state_when_decryption_fails(self):
+        with patch.object(CryptUtil, "decrypt_p7m", side_effect=CryptError("Failed to decrypt")):
+            certs = Certificates(self.client, self.certs_xml)
+        self.assertEqual([], certs.cert_list.certificates)
+        self.assertFalse(os.path.isfile(os.path.join(self.tmp_dir, CERTS_STATE_FILE_NAME)))
+
+        # the same payload is decrypted again
+        certs = self._parse(self.certs_xml)
+        self.assertEqual(1, self.decrypt_count)
+        self.assertEqual(["63D3B4E59828CD41A7F6BBFFA9A2C5D5B6DFD98D"],
+                         [c.thumbprint for c in certs.cert_list.certificates])
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, CERTS_STATE_FILE_NAME)))
+
+    def test_parse_does_not_save_the_state_when_a_private_key_is_unmatched(self):
+        def decrypt_p7m(p7m_file, trans_prv_file, trans_cert_file, pem_file):
+            self.decrypt_count += 1
+            fileutil.write_file(pem_file, load_data("wire/trans_prv"))
+
+        with patch.object(CryptUtil, "decrypt_p7m", side_effect=decrypt_p7m):
+            Certificates(self.client, self.certs_xml)
+            Certificates(self.client, self.certs_xml)
+
+        self.assertEqual(2, self.decrypt_count)
+        self.assertFalse(os.path.isfile(os.path.join(self.tmp_dir, CERTS_STATE_FILE_NAME)))
+
+
 class MockResponse:
     def __init__(self, body, status_code):
         self.body = body
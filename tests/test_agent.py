@@ -23,9 +23,17 @@ from azurelinuxagent.common.conf import *
 from tests.tools import *
 
 EXPECTED_CONFIGURATION = \
-"""AutoUpdate.Enabled = True
+"""Agent.CpuBudgetPercent = 10
+Agent.IOBudgetKBps = 1024
+AutoUpdate.Enabled = True
 AutoUpdate.GAFamily = Prod
 Autoupdate.Frequency = 3600
+CGroups.EnableGovernor = False
+CGroups.ExtensionCpuMaxPercent = 100
+CGroups.ExtensionCpuMinPercent = 10
+CGroups.ExtensionMemoryMaxMB = 2048
+CGroups.ExtensionMemoryMinMB = 256
+CGroups.SamplingPeriod = 15
 DVD.MountPoint = /mnt/cdrom/secure
 DetectScvmmEnv = False
 EnableOverProvisioning = True
@@ -34,7 +42,12 @@ Extensions.Enabled = True
 HttpProxy.Host = None
 HttpProxy.Port = None
 Lib.Dir = /var/lib/waagent
+Logs.EnableRotation = False
+Logs.MaxTotalSizeMB = 200
+Logs.RotationMaxAgeDays = 30
+Logs.RotationMaxSizeMB = 20
 Logs.Verbose = False
+Metrics.EnableEndpoint = False
 OS.AllowHTTP = False
 OS.CheckRdmaDriver = False
 OS.EnableFIPS = True
@@ -159,6 +172,78 @@ class TestAgent(AgentTestCase):
         self.assertFalse(os.path.isdir(ext_log_dir))
         self.assertEqual(1, mock_log.call_count)
 
+    @patch("azurelinuxagent.common.metrics.dump")
+    @patch("azurelinuxagent.agent.signal.siginterrupt")
+    @patch("azurelinuxagent.agent.signal.signal")
+    def test_agent_dumps_the_metrics_on_sigusr1(self, mock_signal, mock_siginterrupt, mock_dump):
+        agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+        agent.start_metrics_dump()
+
+        signum, handler = mock_signal.call_args[0]
+        self.assertEqual(signal.SIGUSR1, signum)
+        mock_siginterrupt.assert_called_once_with(signal.SIGUSR1, False)
+        handler(signum, None)
+        for _ in range(100):
+            if mock_dump.call_count > 0:
+                break
+            time.sleep(0.01)
+        mock_dump.assert_called_once_with(os.path.join(conf.get_lib_dir(), "metrics.txt"))
+
+    def test_agent_parses_the_metrics_command(self):
+        command, _, _, _ = parse_args(["-metrics"])
+        self.assertEqual("metrics", command)
+
+    def test_agent_parses_the_profile_command(self):
+        command, _, _, _ = parse_args(["-profile"])
+        self.assertEqual("profile", command)
+
+    @patch("azurelinuxagent.common.conf.get_lib_dir")
+    def test_agent_shows_the_metrics(self, mock_lib_dir):
+        from azurelinuxagent.common.metrics import MetricsRegistry
+        from azurelinuxagent.common.metricsendpoint import MetricsEndpoint
+        mock_lib_dir.return_value = self.tmp_dir
+        metrics_registry = MetricsRegistry()
+        metrics_registry.gauge("exthandler", "Incarnation").set(42)
+        endpoint = MetricsEndpoint(os.path.join(self.tmp_dir, "metrics.sock"), metrics_registry=metrics_registry)
+        endpoint.start()
+        try:
+            agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+            with patch("sys.stdout") as mock_stdout:
+                agent.show_metrics()
+            output = "".join(args[0] for args, _ in mock_stdout.write.call_args_list)
+            self.assertTrue('waagent_exthandler_incarnation{instance=""} 42' in output)
+        finally:
+            endpoint.stop()
+
+    @patch("sys.exit")
+    @patch("azurelinuxagent.common.conf.get_lib_dir")
+    def test_agent_reports_that_the_metrics_endpoint_is_not_running(self, mock_lib_dir, mock_exit):
+        mock_lib_dir.return_value = self.tmp_dir
+        agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+        with patch("sys.stderr") as mock_stderr:
+            agent.show_metrics()
+        output = "".join(args[0] for args, _ in mock_stderr.write.call_args_list)
+        self.assertTrue("Metrics.EnableEndpoint" in output)
+        mock_exit.assert_called_once_with(1)
+
+    @patch("os.kill")
+    @patch("azurelinuxagent.common.profiler.get_profiled_pids", return_value=[("daemon", 42)])
+    def test_agent_toggles_the_profilers(self, _, mock_kill):
+        agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+        with patch("sys.stdout"):
+            agent.toggle_profilers()
+        mock_kill.assert_called_once_with(42, signal.SIGUSR2)
+
+    @patch("sys.exit")
+    @patch("os.kill")
+    @patch("azurelinuxagent.common.profiler.get_profiled_pids", return_value=[])
+    def test_agent_reports_that_no_process_is_profiled(self, _, mock_kill, mock_exit):
+        agent = Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
+        with patch("sys.stderr"):
+            agent.toggle_profilers()
+        mock_kill.assert_not_called()
+        mock_exit.assert_called_once_with(1)
+
     def test_agent_get_configuration(self):
         Agent(False, conf_file_path=os.path.join(data_dir, "test_waagent.conf"))
 
@@ -183,6 +268,8 @@ class TestAgent(AgentTestCase):
         self.assertTrue("-start" in message)
         self.assertTrue("-run-exthandlers" in message)
         self.assertTrue("-show-configuration" in message)
+        self.assertTrue("-metrics" in message)
+        self.assertTrue("-profile" in message)
 
         # sanity check
         self.assertFalse("-not-a-valid-option" in message)
@@ -32,6 +32,7 @@ import time
 import azurelinuxagent.common.event as event
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
+from azurelinuxagent.common.protocol.util import reset_protocol_util
 from azurelinuxagent.common.utils import fileutil
 
 from azurelinuxagent.common.version import PY_VERSION_MAJOR
@@ -147,6 +148,8 @@ class AgentTestCase(unittest.TestCase):
         event.init_event_status(self.tmp_dir)
         event.init_event_logger(self.tmp_dir)
 
+        reset_protocol_util()
+
     def tearDown(self):
         if not debug and self.tmp_dir is not None:
             shutil.rmtree(self.tmp_dir)
@@ -28,6 +28,7 @@ import uuid
 import unittest
 
 import azurelinuxagent.common.conf as conf
+import azurelinuxagent.common.utils.derutil as derutil
 import azurelinuxagent.common.utils.shellutil as shellutil
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
@@ -75,6 +76,60 @@ class TestCryptoUtilOperations(AgentTestCase):
         crypto = CryptUtil(conf.get_openssl_cmd())
         self.assertRaises(CryptError, crypto.decrypt_secret, encrypted_string, prv_key)
 
+    def test_decrypt_p7m_raises_and_removes_stale_certificates_on_failure(self):
+        p7m_file = os.path.join(self.tmp_dir, "Certificates.p7m")
+        prv_file = os.path.join(self.tmp_dir, "TransportPrivate.pem")
+        pem_file = os.path.join(self.tmp_dir, "Certificates.pem")
+        for path in (p7m_file, prv_file, pem_file):
+            fileutil.write_file(path, "stale")
+
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        with patch("azurelinuxagent.common.utils.shellutil.run", return_value=1):
+            self.assertRaises(CryptError, crypto.decrypt_p7m, p7m_file, prv_file, "cert", pem_file)
+        self.assertFalse(os.path.exists(pem_file))
+
+    def _write_certificates(self):
+        crt_files = []
+        for name in ["wire/trans_cert", "wire/trans_cert"]:
+            crt_file = os.path.join(self.tmp_dir, "{0}.crt".format(len(crt_files)))
+            with open(crt_file, "w") as f:
+                f.write(load_data(name))
+            crt_files.append(crt_file)
+        return crt_files
+
+    def test_get_thumbprints_and_pubkeys_from_crts(self):
+        crt_files = self._write_certificates()
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        expected = [(crypto.get_thumbprint_from_crt(f), crypto.get_pubkey_from_crt(f)) for f in crt_files]
+
+        self.assertEqual(expected, crypto.get_thumbprints_and_pubkeys_from_crts(crt_files))
+
+        # certificates that cannot be decoded in-process are converted by a single openssl invocation
+        with patch.object(CryptUtil, "_read_der", return_value=(None, None)):
+            with patch("subprocess.Popen", wraps=subprocess.Popen) as mock_popen:
+                self.assertEqual(expected, crypto.get_thumbprints_and_pubkeys_from_crts(crt_files))
+                self.assertEqual(1, mock_popen.call_count)
+
+    def test_convert_crts_to_der_passes_the_file_names_as_arguments(self):
+        crt_files = self._write_certificates()
+        crt_file = os.path.join(self.tmp_dir, "with space.crt")
+        os.rename(crt_files[1], crt_file)
+        crypto = CryptUtil(conf.get_openssl_cmd())
+
+        _, der = derutil.pem_to_der(load_data("wire/trans_cert"))
+        self.assertEqual([der, der], crypto._convert_crts_to_der([crt_files[0], crt_file]))
+
+    def test_get_thumbprints_and_pubkeys_from_crts_falls_back_to_single_files(self):
+        crt_files = self._write_certificates()
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        with patch.object(CryptUtil, "_read_der", return_value=(None, None)):
+            with patch.object(CryptUtil, "_convert_crts_to_der", return_value=[]):
+                with patch.object(CryptUtil, "get_thumbprint_from_crt", return_value="T") as mock_thumbprint:
+                    with patch.object(CryptUtil, "get_pubkey_from_crt", return_value="P"):
+                        self.assertEqual([("T", "P"), ("T", "P")],
+                                         crypto.get_thumbprints_and_pubkeys_from_crts(crt_files))
+                        self.assertEqual(2, mock_thumbprint.call_count)
+
 
 if __name__ == '__main__':
     unittest.main()
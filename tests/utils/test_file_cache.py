@@ -0,0 +1,114 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import azurelinuxagent.common.utils.fileutil as fileutil
+
+from azurelinuxagent.common.utils.filecache import FileCache
+from tests.tools import *
+
+
+class TestFileCache(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.path = os.path.join(self.tmp_dir, "GoalState.1.xml")
+        fileutil.write_file(self.path, "<GoalState/>")
+
+    def test_read_is_validated_by_file_attributes(self):
+        cache = FileCache()
+        with patch("azurelinuxagent.common.utils.fileutil.read_file", wraps=fileutil.read_file) as mock_read:
+            self.assertEqual("<GoalState/>", cache.read(self.path))
+            self.assertEqual("<GoalState/>", cache.read(self.path))
+            self.assertEqual(1, mock_read.call_count)
+
+            # replacing the file changes its inode and size
+            fileutil.write_file(self.path + ".tmp", "<GoalState></GoalState>")
+            os.rename(self.path + ".tmp", self.path)
+            self.assertEqual("<GoalState></GoalState>", cache.read(self.path))
+            self.assertEqual(2, mock_read.call_count)
+
+    def test_read_caches_parsed_objects(self):
+        cache = FileCache()
+        parse = Mock(side_effect=lambda text: [text])
+
+        parsed = cache.read(self.path, parse)
+        self.assertTrue(parsed is cache.read(self.path, parse))
+        self.assertEqual(1, parse.call_count)
+        self.assertEqual(["<GoalState/>"], parsed)
+        self.assertEqual((1, 1), cache.get_and_reset_counts())
+        self.assertEqual((0, 0), cache.get_and_reset_counts())
+
+    def test_invalidate_and_evict(self):
+        cache = FileCache()
+        other_path = os.path.join(self.tmp_dir, "Incarnation")
+        fileutil.write_file(other_path, "1")
+        cache.read(self.path)
+        cache.read(other_path)
+
+        cache.invalidate(self.path)
+        self.assertEqual(1, len(cache))
+
+        cache.read(self.path)
+        cache.evict(keep=[other_path])
+        self.assertEqual(1, len(cache))
+        cache.read(other_path)
+        self.assertEqual((1, 0), cache.get_and_reset_counts())
+
+    def test_list_files_is_validated_by_directory_attributes(self):
+        cache = FileCache()
+        os.mkdir(os.path.join(self.tmp_dir, "config"))
+        with patch("os.listdir", wraps=os.listdir) as mock_listdir:
+            self.assertTrue("GoalState.1.xml" in cache.list_files(self.tmp_dir))
+            self.assertFalse("config" in cache.list_files(self.tmp_dir))
+            self.assertEqual(1, mock_listdir.call_count)
+
+            fileutil.write_file(os.path.join(self.tmp_dir, "Incarnation"), "1")
+            self.assertTrue("Incarnation" in cache.list_files(self.tmp_dir))
+            self.assertEqual(2, mock_listdir.call_count)
+
+    def test_invalidate_tree(self):
+        cache = FileCache()
+        other_path = os.path.join(self.tmp_dir + "-other")
+        fileutil.write_file(other_path, "1")
+        try:
+            cache.read(self.path)
+            cache.list_files(self.tmp_dir)
+            cache.read(other_path)
+
+            cache.invalidate_tree(self.tmp_dir)
+            self.assertEqual(1, len(cache))
+        finally:
+            os.remove(other_path)
+
+    def test_evict_directory(self):
+        cache = FileCache()
+        status_dir = os.path.join(self.tmp_dir, "status")
+        os.mkdir(status_dir)
+        status_files = [os.path.join(status_dir, "{0}.status".format(i)) for i in range(3)]
+        for path in status_files:
+            fileutil.write_file(path, "[]")
+            cache.read(path)
+        cache.list_files(status_dir)
+        cache.read(self.path)
+
+        cache.evict_directory(status_dir, keep=[status_files[2]])
+        self.assertEqual(3, len(cache))
+        cache.read(status_files[2])
+        self.assertEqual((1, 0), cache.get_and_reset_counts())
+
+    def test_read_raises_when_file_is_missing(self):
+        cache = FileCache()
+        self.assertRaises(OSError, cache.read, os.path.join(self.tmp_dir, "missing"))
@@ -77,6 +77,42 @@ class TestFileOperations(AgentTestCase):
 
         os.remove(test_file)
 
+    def test_write_file_if_changed(self):
+        test_file = os.path.join(self.tmp_dir, self.test_file)
+        fileutil.get_and_reset_write_counts()
+
+        self.assertTrue(fileutil.write_file_if_changed(test_file, u"\u6211"))
+        os.chmod(test_file, 0o600)
+        inode = os.stat(test_file).st_ino
+
+        self.assertFalse(fileutil.write_file_if_changed(test_file, u"\u6211"))
+        self.assertEqual(inode, os.stat(test_file).st_ino)
+
+        self.assertTrue(fileutil.write_file_if_changed(test_file, u"\u6210"))
+        self.assertNotEqual(inode, os.stat(test_file).st_ino)
+        self.assertEqual(u"\u6210", fileutil.read_file(test_file))
+        self.assertEqual(0o600, os.stat(test_file).st_mode & 0o777)
+
+        self.assertEqual((2, 1), fileutil.get_and_reset_write_counts())
+        self.assertEqual([self.test_file], os.listdir(self.tmp_dir))
+
+    def test_write_file_if_changed_syncs_directories_once(self):
+        with patch("azurelinuxagent.common.utils.fileutil.fsync_dir") as mock_fsync_dir:
+            with fileutil.DirectorySync() as dir_sync:
+                for i in range(3):
+                    fileutil.write_file_if_changed(os.path.join(self.tmp_dir, str(i)), "data", dir_sync=dir_sync)
+                self.assertEqual(0, mock_fsync_dir.call_count)
+            mock_fsync_dir.assert_called_once_with(os.path.abspath(self.tmp_dir))
+
+            fileutil.write_file_if_changed(os.path.join(self.tmp_dir, "3"), "data", fsync_directory=True)
+            self.assertEqual(2, mock_fsync_dir.call_count)
+
+    def test_write_file_if_changed_removes_the_temporary_file_on_failure(self):
+        test_file = os.path.join(self.tmp_dir, self.test_file)
+        with patch("os.rename", side_effect=OSError(errno.EXDEV, "EXDEV")):
+            self.assertRaises(IOError, fileutil.write_file_if_changed, test_file, "data")
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
     def test_findre_in_file(self):
         fp = tempfile.mktemp()
         with open(fp, 'w') as f:
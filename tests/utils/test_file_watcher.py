@@ -0,0 +1,103 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import errno
+
+import azurelinuxagent.common.utils.fileutil as fileutil
+
+from azurelinuxagent.common.utils.filecache import FileCache
+from azurelinuxagent.common.utils.filewatcher import FileWatcher, Inotify
+from tests.tools import *
+
+
+def _is_inotify_available():
+    try:
+        Inotify().close()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class TestFileWatcher(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.directory = os.path.join(self.tmp_dir, "status")
+        os.mkdir(self.directory)
+        self.path = os.path.join(self.directory, "0.status")
+        fileutil.write_file(self.path, "transitioning")
+        self.cache = FileCache()
+        self.watcher = FileWatcher(self.cache)
+
+    def tearDown(self):
+        self.watcher.close()
+        AgentTestCase.tearDown(self)
+
+    @skip_if_predicate_false(_is_inotify_available, "inotify is not available")
+    def test_watched_files_are_not_checked_until_changed(self):
+        self.assertTrue(self.watcher.watch(self.directory))
+        self.assertEqual("transitioning", self.cache.read(self.path))
+
+        with patch("azurelinuxagent.common.utils.filecache._get_file_key") as mock_key:
+            self.assertEqual("transitioning", self.cache.read(self.path))
+            self.assertEqual(0, self.watcher.process_events())
+            self.assertEqual(0, mock_key.call_count)
+
+        fileutil.write_file(self.path, "success")
+        self.assertTrue(self.watcher.process_events() > 0)
+        self.assertEqual("success", self.cache.read(self.path))
+
+    @skip_if_predicate_false(_is_inotify_available, "inotify is not available")
+    def test_new_files_invalidate_the_listing(self):
+        self.watcher.watch(self.directory)
+        self.assertEqual(("0.status",), self.cache.list_files(self.directory))
+
+        fileutil.write_file(os.path.join(self.directory, "1.status"), "transitioning")
+        self.watcher.process_events()
+        self.assertEqual(("0.status", "1.status"), self.cache.list_files(self.directory))
+
+    @skip_if_predicate_false(_is_inotify_available, "inotify is not available")
+    def test_removed_directories_are_no_longer_watched(self):
+        self.watcher.watch(self.directory)
+        self.cache.read(self.path)
+
+        shutil.rmtree(self.directory)
+        self.watcher.process_events()
+        self.assertFalse(self.watcher.is_watched(self.directory))
+        self.assertEqual(0, len(self.cache))
+
+    def test_falls_back_to_polling_without_inotify(self):
+        with patch("azurelinuxagent.common.utils.filewatcher.Inotify", side_effect=OSError(errno.EMFILE, "EMFILE")):
+            self.assertFalse(self.watcher.watch(self.directory))
+        self.assertEqual(0, self.watcher.process_events())
+
+        self.cache.read(self.path)
+        # the rewrite changes the size of the file
+        fileutil.write_file(self.path, "success")
+        self.assertEqual("success", self.cache.read(self.path))
+
+    @skip_if_predicate_false(_is_inotify_available, "inotify is not available")
+    def test_falls_back_to_polling_when_the_watch_limit_is_reached(self):
+        with patch.object(Inotify, "add_watch", side_effect=OSError(errno.ENOSPC, "ENOSPC")):
+            self.assertFalse(self.watcher.watch(self.directory))
+        self.assertFalse(self.watcher.is_watched(self.directory))
+
+        self.cache.read(self.path)
+        fileutil.write_file(self.path, "success")
+        self.assertEqual("success", self.cache.read(self.path))
+
+        # no new watches are added until one is removed
+        self.assertFalse(self.watcher.watch(self.directory))
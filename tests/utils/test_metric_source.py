@@ -0,0 +1,92 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import errno
+
+from azurelinuxagent.common.utils.metricsource import MetricSource, MetricSources, parse_proc_stat_cpu_ticks, \
+    PROC_STAT
+from tests.tools import *
+
+PROC_STAT_SAMPLE = "cpu  813599 3940 909253 154538746 874851 0 6589 0 0 0\n" \
+                   "cpu0 401094 1516 453006 77276738 452939 0 3312 0 0 0\n" \
+                   "cpu1 412505 2423 456246 77262007 421912 0 3276 0 0 0\n" \
+                   "intr 114930548 113199788 3 0 5 263 0 0 0 1 0 0 0 0 0 0\n"
+
+
+class TestMetricSource(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.path = os.path.join(self.tmp_dir, "memory.current")
+        self._write("4096\n")
+
+    def _write(self, contents):
+        # rewritten in place, as the kernel does for cgroup and proc files
+        with open(self.path, "w") as f:
+            f.write(contents)
+
+    def test_read_keeps_the_file_open(self):
+        source = MetricSource(self.path)
+        self.assertEqual(b"4096\n", source.read())
+        self._write("8192\n")
+        self.assertEqual(b"8192\n", source.read())
+        self.assertEqual(1, source.opens)
+        source.close()
+
+    def test_read_files_larger_than_the_buffer(self):
+        contents = "x" * 10000
+        self._write(contents)
+        source = MetricSource(self.path)
+        self.assertEqual(contents.encode("utf-8"), source.read())
+        source.close()
+
+    def test_read_reopens_removed_files(self):
+        source = MetricSource(self.path)
+        source.read()
+        with patch("azurelinuxagent.common.utils.metricsource._pread",
+                   side_effect=[OSError(errno.ENODEV, "ENODEV"), b"4096\n"]):
+            self.assertEqual(b"4096\n", source.read())
+        self.assertEqual(2, source.opens)
+        source.close()
+
+        os.remove(self.path)
+        self.assertRaises(OSError, source.read)
+
+    def test_close_tree(self):
+        sources = MetricSources()
+        other_path = os.path.join(self.tmp_dir, "other")
+        with open(other_path, "w") as f:
+            f.write("0\n")
+        sources.read(self.path)
+        sources.read(other_path)
+        self.assertEqual(2, len(sources))
+
+        sources.close_tree(self.tmp_dir)
+        self.assertEqual(0, len(sources))
+
+    @skip_if_predicate_false(lambda: os.path.exists(PROC_STAT), "/proc/stat is not available")
+    def test_read_proc_stat(self):
+        sources = MetricSources()
+        first = parse_proc_stat_cpu_ticks(sources.read(PROC_STAT))
+        second = parse_proc_stat_cpu_ticks(sources.read(PROC_STAT))
+        self.assertTrue(0 < first <= second)
+        sources.close_all()
+
+    def test_parse_proc_stat_cpu_ticks(self):
+        expected = 813599 + 3940 + 909253 + 154538746 + 874851 + 0
+        self.assertEqual(expected, parse_proc_stat_cpu_ticks(PROC_STAT_SAMPLE))
+        self.assertEqual(expected, parse_proc_stat_cpu_ticks(PROC_STAT_SAMPLE.encode("utf-8")))
+        self.assertEqual(0, parse_proc_stat_cpu_ticks("intr 1 2 3\n"))
@@ -19,7 +19,8 @@ import subprocess
 
 from azurelinuxagent.common.exception import ExtensionError
 from azurelinuxagent.common.utils.processutil \
-    import format_stdout_stderr, capture_from_process
+    import format_stdout_stderr, capture_from_process, poll_with_usage, CommandUsage, record_command_usage, \
+    get_and_reset_command_usage
 from tests.tools import *
 import sys
 
@@ -255,6 +256,51 @@ class TestProcessUtils(AgentTestCase):
 
             self.assertEqual(EXTENSION_ERROR_CODE, ee.exception.code)
 
+    def test_poll_with_usage_sets_the_usage_of_the_process(self):
+        process = subprocess.Popen("i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done; exit 3",
+                                   shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=os.environ)
+
+        self.assertEqual(3, poll_with_usage(process, block=True))
+        self.assertEqual(3, process.returncode)
+        self.assertEqual(3, process.poll())
+        self.assertEqual(1, process.usage.count)
+        self.assertTrue(process.usage.user_time + process.usage.system_time > 0)
+        self.assertTrue(process.usage.max_rss > 0)
+
+    def test_capture_from_process_sets_the_usage_of_the_process(self):
+        cmd = process_cmd_template.format(process_target, "out", "err")
+        process = subprocess.Popen(cmd,
+                                   shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=os.environ,
+                                   preexec_fn=os.setsid)
+
+        capture_from_process(process, cmd, 20)
+        self.assertEqual(0, process.returncode)
+        self.assertEqual(1, process.usage.count)
+
+    def test_command_usage_is_summed_by_key(self):
+        get_and_reset_command_usage()
+        first, second = CommandUsage(), CommandUsage()
+        first.count, first.user_time, first.max_rss, first.blocks_written = 1, 1.5, 100, 8
+        second.count, second.user_time, second.max_rss, second.blocks_written = 1, 0.5, 300, 2
+
+        record_command_usage(("ext", "Enable"), first)
+        record_command_usage(("ext", "Enable"), second)
+        record_command_usage(("ext", "Install"), first)
+
+        usage = get_and_reset_command_usage()
+        self.assertEqual([("ext", "Enable"), ("ext", "Install")], sorted(usage.keys()))
+        self.assertEqual(2, usage[("ext", "Enable")].count)
+        self.assertEqual(2.0, usage[("ext", "Enable")].user_time)
+        self.assertEqual(300, usage[("ext", "Enable")].max_rss)
+        self.assertEqual(10, usage[("ext", "Enable")].blocks_written)
+        self.assertEqual({}, get_and_reset_command_usage())
+
 
 if __name__ == '__main__':
     unittest.main()
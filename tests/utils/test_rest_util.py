@@ -23,6 +23,7 @@ from azurelinuxagent.common.utils.restutil import HTTP_USER_AGENT
 
 from azurelinuxagent.common.future import httpclient, ustr
 
+from azurelinuxagent.common.metrics import registry
 from tests.tools import *
 
 
@@ -84,7 +85,18 @@ class TestIOErrorCounter(AgentTestCase):
         self.assertEqual(2, counts.get("other"))
         self.assertEqual(
            {"hostplugin":0, "protocol":0, "other":0},
-            restutil.IOErrorCounter._counts)
+            restutil.IOErrorCounter.get_and_reset())
+
+    def test_errors_are_counted_in_the_metrics_registry(self):
+        restutil.IOErrorCounter.set_protocol_endpoint()
+        counter = registry.counter("http", "IO Errors")
+        errors = counter.value("protocol")
+
+        restutil.IOErrorCounter.increment(restutil.DEFAULT_PROTOCOL_ENDPOINT, 80)
+        restutil.IOErrorCounter.get_and_reset()
+
+        # the registry counts are cumulative
+        self.assertEqual(errors + 1, counter.value("protocol"))
 
 
 class TestHttpOperations(AgentTestCase):
@@ -601,5 +613,71 @@ class TestHttpOperations(AgentTestCase):
                 self.assertTrue(result in ustr(e))
 
 
+class TestHttpMetrics(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        restutil.IOErrorCounter.set_protocol_endpoint()
+
+    @staticmethod
+    def _get_values():
+        return dict(((metric.category, metric.name), values) for metric, values in registry.snapshot())
+
+    def _get_increase(self, before, name, instance):
+        after = self._get_values()
+        value = after.get(("http", name), {}).get(instance, 0)
+        previous = before.get(("http", name), {}).get(instance, 0)
+        if hasattr(value, "count"):
+            return value.count - (previous.count if hasattr(previous, "count") else 0)
+        return value - previous
+
+    def test_endpoint_classes(self):
+        self.assertEqual("wireserver", restutil._get_endpoint_class(restutil.DEFAULT_PROTOCOL_ENDPOINT, 80))
+        self.assertEqual("hostplugin", restutil._get_endpoint_class(restutil.DEFAULT_PROTOCOL_ENDPOINT,
+                                                                    restutil.HOST_PLUGIN_PORT))
+        self.assertEqual("imds", restutil._get_endpoint_class(restutil.IMDS_ENDPOINT, None))
+        self.assertEqual("storage", restutil._get_endpoint_class("foo.blob.core.windows.net", 443))
+
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_records_the_attempts_retries_and_status_codes(self, _http_request, _sleep):
+        ok = Mock(status=httpclient.OK)
+        ok.getheader.return_value = "1024"
+        _http_request.side_effect = [Mock(status=httpclient.SERVICE_UNAVAILABLE), IOError("IO failure"), ok]
+        before = self._get_values()
+
+        restutil.http_put("http://168.63.129.16/machine", "0123456789")
+
+        self.assertEqual(1, self._get_increase(before, "Requests", "wireserver"))
+        self.assertEqual(3, self._get_increase(before, "Attempts", "wireserver"))
+        self.assertEqual(1, self._get_increase(before, "Retries", "wireserver 503"))
+        self.assertEqual(1, self._get_increase(before, "Retries", "wireserver IOError"))
+        self.assertEqual(1, self._get_increase(before, "Status Codes", "wireserver 503"))
+        self.assertEqual(1, self._get_increase(before, "Status Codes", "wireserver 200"))
+        self.assertEqual(10, self._get_increase(before, "Bytes Sent", "wireserver"))
+        self.assertEqual(1024, self._get_increase(before, "Bytes Received", "wireserver"))
+        self.assertEqual(1, self._get_increase(before, "Total Time", "wireserver"))
+
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request", side_effect=IOError("IO failure"))
+    def test_http_request_records_the_time_of_failed_requests(self, *_):
+        before = self._get_values()
+
+        self.assertRaises(restutil.HttpError, restutil.http_get, "http://169.254.169.254/metadata", max_retry=2)
+
+        self.assertEqual(1, self._get_increase(before, "Total Time", "imds"))
+        self.assertEqual(2, self._get_increase(before, "Attempts", "imds"))
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_records_the_connect_time_and_time_to_first_byte(self, HTTPConnection):
+        HTTPConnection.return_value = MagicMock()
+        before = self._get_values()
+
+        restutil._http_request("GET", restutil.DEFAULT_PROTOCOL_ENDPOINT, "/", port=restutil.HOST_PLUGIN_PORT)
+
+        self.assertEqual(1, HTTPConnection.return_value.connect.call_count)
+        self.assertEqual(1, self._get_increase(before, "Connect Time", "hostplugin"))
+        self.assertEqual(1, self._get_increase(before, "Time To First Byte", "hostplugin"))
+
+
 if __name__ == '__main__':
     unittest.main()